@@ -0,0 +1,98 @@
+"""Compact account records and the versioned format they are stored in.
+
+``Account`` uses ``__slots__``: four fields and no per-instance ``__dict__``,
+which matters once a large guild has hundreds of thousands of accounts in
+memory. Balances and loans are integers, and items are an ``{item: count}``
+map, so owning 10,000 Rolexes is one dict entry rather than 10,000 list
+entries.
+
+On disk an account is ``{"b": balance, "l": loan, "i": {item: count}}`` with
+zero fields left out, the same keys the journal uses for deltas. Older
+formats are upgraded as they are read, one ``UPGRADES`` step per version:
+
+- version 1: ``{"balance", "loan", "items": [item, item, ...]}``, with float
+  balances from ``!sell`` and bet payouts. The last files written in this
+  format already have ``items`` as an ``{item: count}`` map
+- version 2: the current format
+"""
+from catalog import assets_value, canonical_name
+
+SCHEMA_VERSION = 2
+DEFAULT_BALANCE = 1000
+
+
+class Account:
+    __slots__ = ("balance", "loan", "items", "assets")
+
+    def __init__(self, balance=DEFAULT_BALANCE, loan=0, items=None):
+        self.balance = balance
+        self.loan = loan
+        self.items = items if items is not None else {}
+        # Catalog value of the items, kept up to date by the ledger as items
+        # change so net worth never needs a walk over the inventory
+        self.assets = assets_value(self.items)
+
+    def __repr__(self):
+        return f"Account(balance={self.balance}, loan={self.loan}, items={self.items})"
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, Account)
+            and (self.balance, self.loan, self.items) == (other.balance, other.loan, other.items)
+        )
+
+    @property
+    def net_worth(self):
+        return self.balance + self.assets - self.loan
+
+    def copy(self):
+        copied = Account.__new__(Account)
+        copied.balance = self.balance
+        copied.loan = self.loan
+        copied.items = dict(self.items)
+        copied.assets = self.assets
+        return copied
+
+    def to_dict(self):
+        data = {}
+        if self.balance:
+            data["b"] = self.balance
+        if self.loan:
+            data["l"] = self.loan
+        if self.items:
+            data["i"] = self.items
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build an account from the current on-disk format."""
+        return cls(data.get("b", 0), data.get("l", 0), dict(data.get("i", {})))
+
+
+def upgrade_v1(data):
+    items = {}
+    stored = data.get("items", [])
+    pairs = stored.items() if isinstance(stored, dict) else ((item, 1) for item in stored)
+    for item, count in pairs:
+        item = canonical_name(item)
+        items[item] = items.get(item, 0) + count
+    upgraded = {
+        "b": int(data.get("balance", DEFAULT_BALANCE)),
+        "l": int(data.get("loan", 0)),
+        "i": items,
+    }
+    return {key: value for key, value in upgraded.items() if value}
+
+
+# version -> function turning that version's record into the next version's
+UPGRADES = {
+    1: upgrade_v1,
+}
+
+
+def load_account(data, version=SCHEMA_VERSION):
+    """An ``Account`` from a stored record written by schema ``version``."""
+    while version < SCHEMA_VERSION:
+        data = UPGRADES[version](data)
+        version += 1
+    return Account.from_dict(data)
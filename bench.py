@@ -0,0 +1,467 @@
+"""Offline load test for the bot's commands.
+
+Drives the real command callbacks from ``main.py`` with fake contexts,
+users and messages, so nothing connects to Discord. A run seeds a fresh
+economy of ``--users`` accounts in a scratch directory, then runs each
+command ``--ops`` times with ``--concurrency`` invocations in flight and
+reports, per command:
+
+- p50/p99/max latency from invoking the command to its reply being sent
+- how long the event loop was blocked (total and longest single stall),
+  sampled by a task that should wake every millisecond
+- bytes written to storage per invocation (journal plus snapshots; read from
+  ``/proc/self/io`` so it is only available on Linux)
+
+Every run is appended as one JSON line to ``--results`` together with the
+backend, population, concurrency and git revision, so runs can be compared:
+
+    python bench.py run --backend json --users 100000
+    python bench.py run --backend sqlite --users 100000
+    python bench.py run --backend snapshot --users 100000
+    python bench.py compare
+
+Replies are timed with the outbox window set to ``--outbox-window`` (0 by
+default, so latency is command handling rather than the coalescing delay).
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+COMMANDS = ["balance", "slots", "rps", "bet", "resolve_bet", "send", "buy", "sell", "leaderboard", "mines", "doors"]
+RESULTS_FILE = "bench_results.jsonl"
+STAKE = 10
+SAMPLE_INTERVAL = 0.001
+FIRST_USER_ID = 10 ** 17
+# The file main.py opens for each storage backend
+BACKEND_FILES = {"json": "user_data.json", "sqlite": "user_data.db", "snapshot": "user_data.snap"}
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.mention = f"<@{user_id}>"
+        self.name = str(user_id)
+
+    def __eq__(self, other):
+        return getattr(other, "id", None) == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class FakeMessage:
+    _ids = itertools.count(1)
+
+    def __init__(self, content, view=None):
+        self.id = next(self._ids)
+        self.content = content
+        self.view = view
+
+    async def edit(self, content=None, view=None):
+        self.content = content
+        self.view = view
+        return self
+
+
+class FakeChannel:
+    def __init__(self, channel_id, latency=0.0):
+        self.id = channel_id
+        self.latency = latency
+        self.messages = 0
+        self.characters = 0
+
+    async def send(self, content=None, view=None):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.messages += 1
+        self.characters += len(content or "")
+        return FakeMessage(content, view)
+
+
+class FakeContext:
+    def __init__(self, user, channel, guild_id=1):
+        self.author = user
+        self.channel = channel
+        self.guild = types.SimpleNamespace(id=guild_id)
+        self.interaction = None  # a prefix command, so replies go through the outbox
+        self.message = None
+
+    async def send(self, content=None, view=None):
+        self.message = await self.channel.send(content, view=view)
+        return self.message
+
+
+class FakeResponse:
+    async def edit_message(self, content=None, view=None):
+        pass
+
+    async def send_message(self, content=None, ephemeral=False):
+        pass
+
+    async def defer(self):
+        pass
+
+
+class FakeInteraction:
+    def __init__(self, user):
+        self.user = user
+        self.response = FakeResponse()
+
+
+async def click(view, button, user):
+    # What discord.py's view dispatch does for a button press
+    interaction = FakeInteraction(user)
+    if await view.interaction_check(interaction):
+        await button.callback(interaction)
+
+
+def bytes_written():
+    try:
+        with open("/proc/self/io") as file:
+            for line in file:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percentile(ordered, percent):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+class LoopMonitor:
+    """Measures how late a task that sleeps ``interval`` at a time wakes up."""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.blocked = 0.0
+        self.longest = 0.0
+        self._task = None
+
+    def reset(self):
+        self.blocked = 0.0
+        self.longest = 0.0
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = time.perf_counter() - started - self.interval
+            if lag > self.interval:
+                self.blocked += lag
+                self.longest = max(self.longest, lag)
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def stop(self):
+        self._task.cancel()
+
+
+def seed(backend, path, users):
+    """Write ``users`` accounts with random balances, each owning a Rolex to sell."""
+    from account import Account
+    from storage import open_storage
+
+    records = {}
+    for user_id in range(FIRST_USER_ID, FIRST_USER_ID + users):
+        records[str(user_id)] = Account(random.randint(1000, 100000), 0, {"Rolex": 1})
+    storage = open_storage(backend, path)
+    try:
+        storage.write(records, {})
+    finally:
+        storage.close()
+
+
+def load_bot(workdir, backend):
+    # main.py builds its storage from the working directory on import and only
+    # connects to Discord when run as a script
+    os.chdir(workdir)
+    os.environ["BOT_STORAGE_BACKEND"] = backend
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main
+    return main
+
+
+class Bench:
+    def __init__(self, bot, args):
+        self.bot = bot
+        self.args = args
+        self.users = [FakeUser(FIRST_USER_ID + i) for i in range(args.users)]
+        self.channels = [FakeChannel(i + 1, args.send_latency / 1000) for i in range(args.concurrency)]
+        self.monitor = LoopMonitor()
+
+    def callback(self, name):
+        return self.bot.bot.get_command(name).callback
+
+    def context(self, user, channel=None):
+        return FakeContext(user, channel or random.choice(self.channels))
+
+    # One invocation per method; each gets the op number so phases that need
+    # distinct users or channels can pick them deterministically
+
+    async def op_balance(self, n):
+        await self.callback("balance")(self.context(random.choice(self.users)))
+
+    async def op_slots(self, n):
+        await self.callback("slots")(self.context(random.choice(self.users)), STAKE)
+
+    async def op_rps(self, n):
+        choice = random.choice(["rock", "paper", "scissors"])
+        await self.callback("rps")(self.context(random.choice(self.users)), STAKE, choice)
+
+    async def setup_bet(self):
+        # One market per channel, as !start_bet from an admin would open
+        for channel in self.channels:
+            admin = self.context(self.users[0], channel)
+            await self.callback("start_bet")(admin, "bench", 2.0, 1.5)
+        self.bettors = random.sample(self.users, min(self.args.ops, len(self.users)))
+
+    async def op_bet(self, n):
+        user = self.bettors[n % len(self.bettors)]
+        channel = self.channels[n % len(self.channels)]
+        await self.callback("bet")(self.context(user, channel), STAKE, random.choice(["win", "lose"]))
+
+    def resolve_ops(self):
+        return len(self.channels)
+
+    async def op_resolve_bet(self, n):
+        admin = self.context(self.users[0], self.channels[n])
+        await self.callback("resolve_bet")(admin, random.choice(["win", "lose"]))
+
+    async def op_send(self, n):
+        sender, recipient = random.sample(self.users, 2)
+        await self.callback("send")(self.context(sender), recipient, 1)
+
+    async def op_buy(self, n):
+        await self.callback("buy")(self.context(random.choice(self.users)), item="Rolex")
+
+    async def op_sell(self, n):
+        await self.callback("sell")(self.context(random.choice(self.users)), item="Rolex")
+
+    async def op_leaderboard(self, n):
+        pages = max(1, self.bot.leaderboard_index.page_count())
+        await self.callback("leaderboard")(self.context(random.choice(self.users)), random.randint(1, pages))
+
+    async def op_mines(self, n):
+        user = random.choice(self.users)
+        ctx = self.context(user)
+        await self.callback("mines")(ctx, STAKE, 3)
+        view = self.bot.sessions.get(ctx.message.id) if ctx.message else None
+        if view is None:
+            return
+        # Reveal two tiles, then cash out if still alive
+        for button in random.sample(view.tiles, 2):
+            if view.finished:
+                break
+            await click(view, button, user)
+        if not view.finished:
+            await click(view, view.cash_out_button, user)
+
+    async def op_doors(self, n):
+        user = random.choice(self.users)
+        ctx = self.context(user)
+        await self.callback("doors")(ctx, STAKE)
+        view = self.bot.sessions.get(ctx.message.id) if ctx.message else None
+        if view is not None:
+            await click(view, random.choice(view.children), user)
+
+    async def phase(self, name):
+        setup = getattr(self, f"setup_{name}", None)
+        if setup is not None:
+            await setup()
+        ops = self.resolve_ops() if name == "resolve_bet" else self.args.ops
+        operation = getattr(self, f"op_{name}")
+        latencies = []
+        errors = 0
+        counter = iter(range(ops))
+
+        async def worker():
+            nonlocal errors
+            for n in counter:
+                started = time.perf_counter()
+                try:
+                    await operation(n)
+                except Exception:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+
+        written = bytes_written()
+        self.monitor.reset()
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(min(self.args.concurrency, ops))))
+        # Charge each command for the snapshot of what it changed
+        await self.bot.ledger.flush_async()
+        elapsed = time.perf_counter() - started
+        if written is not None:
+            written = bytes_written() - written
+
+        latencies.sort()
+        return {
+            "ops": ops,
+            "errors": errors,
+            "seconds": round(elapsed, 4),
+            "ops_per_second": round(ops / elapsed, 1) if elapsed else None,
+            "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+            "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+            "loop_blocked_ms": round(self.monitor.blocked * 1000, 3),
+            "longest_stall_ms": round(self.monitor.longest * 1000, 3),
+            "bytes_per_op": round(written / ops, 1) if written is not None and ops else None,
+        }
+
+    async def run(self, commands):
+        self.bot.outbox.window = self.args.outbox_window
+        self.bot.ledger.start()
+        self.bot.sessions.start()
+        self.monitor.start()
+        results = {}
+        try:
+            for name in commands:
+                # Bets must be open before they can be resolved
+                if name == "resolve_bet" and "bet" not in results:
+                    results["bet"] = await self.phase("bet")
+                results[name] = await self.phase(name)
+        finally:
+            self.monitor.stop()
+            await self.bot.sessions.close()
+        return results
+
+
+def run(args):
+    unknown = set(args.commands) - set(COMMANDS)
+    if unknown:
+        raise SystemExit(f"Unknown commands: {', '.join(sorted(unknown))}")
+    if args.seed is not None:
+        random.seed(args.seed)
+        # Game outcomes come from the fair RNG, which main.py seeds from this
+        os.environ["BOT_RNG_SEED"] = str(args.seed)
+    results_path = os.path.abspath(args.results)
+    cwd = os.getcwd()
+    revision = git_revision()
+
+    with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+        filename = BACKEND_FILES[args.backend]
+        started = time.perf_counter()
+        seed(args.backend, os.path.join(workdir, filename), args.users)
+        seeded = time.perf_counter() - started
+        bot = load_bot(workdir, args.backend)
+        try:
+            results = asyncio.run(Bench(bot, args).run(args.commands))
+        finally:
+            # Like main.py on shutdown: flushes the ledger and closes the
+            # history and fair RNG logs
+            bot.bank.close()
+            os.chdir(cwd)
+
+    entry = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": revision,
+        "label": args.label,
+        "backend": args.backend,
+        "users": args.users,
+        "concurrency": args.concurrency,
+        "ops": args.ops,
+        "outbox_window": args.outbox_window,
+        "send_latency_ms": args.send_latency,
+        "seed_seconds": round(seeded, 3),
+        "commands": results,
+    }
+    with open(results_path, "a") as file:
+        file.write(json.dumps(entry) + "\n")
+    print_table([entry])
+    print(f"Saved to {results_path}.")
+
+
+def describe(entry):
+    label = f" {entry['label']}" if entry.get("label") else ""
+    return f"{entry['revision'] or '?'} {entry['backend']} {entry['users']}u c{entry['concurrency']}{label}"
+
+
+def print_table(entries):
+    columns = ["p50_ms", "p99_ms", "loop_blocked_ms", "longest_stall_ms", "bytes_per_op", "ops_per_second"]
+    for entry in entries:
+        print(f"== {describe(entry)} ({entry['time']})")
+        print(f"{'command':<12}" + "".join(f"{column:>18}" for column in columns))
+        for name, stats in entry["commands"].items():
+            cells = "".join(f"{'-' if stats[column] is None else stats[column]:>18}" for column in columns)
+            errors = f"  ({stats['errors']} errors)" if stats["errors"] else ""
+            print(f"{name:<12}{cells}{errors}")
+
+
+def compare(args):
+    if not os.path.exists(args.results):
+        raise SystemExit(f"No results in {args.results} yet.")
+    with open(args.results) as file:
+        entries = [json.loads(line) for line in file if line.strip()]
+    if args.backend:
+        entries = [entry for entry in entries if entry["backend"] == args.backend]
+    entries = entries[-args.last:]
+    if not entries:
+        raise SystemExit("No matching runs.")
+
+    # p99 side by side for every command, one column per run
+    print_table(entries)
+    print()
+    print("p99_ms by run:")
+    names = list(dict.fromkeys(name for entry in entries for name in entry["commands"]))
+    print(f"{'command':<12}" + "".join(f"{'#' + str(i + 1):>12}" for i in range(len(entries))))
+    for name in names:
+        cells = "".join(f"{entry['commands'].get(name, {}).get('p99_ms', '-'):>12}" for entry in entries)
+        print(f"{name:<12}{cells}")
+    for i, entry in enumerate(entries):
+        print(f"#{i + 1}: {describe(entry)} ({entry['time']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test for the betting bot.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Benchmark the commands against a seeded economy.")
+    run_parser.add_argument("--backend", choices=sorted(BACKEND_FILES), default="json")
+    run_parser.add_argument("--users", type=int, default=1000, help="accounts to seed (1k to 1M)")
+    run_parser.add_argument("--concurrency", type=int, default=50, help="commands in flight at once")
+    run_parser.add_argument("--ops", type=int, default=1000, help="invocations per command")
+    run_parser.add_argument("--commands", nargs="+", default=COMMANDS, metavar="COMMAND")
+    run_parser.add_argument("--outbox-window", type=float, default=0.0, help="seconds")
+    run_parser.add_argument("--send-latency", type=float, default=0.0, help="simulated ms per Discord send")
+    run_parser.add_argument("--seed", type=int, help="random seed, for repeatable runs")
+    run_parser.add_argument("--label", help="note stored with the results")
+    run_parser.add_argument("--results", default=RESULTS_FILE)
+
+    compare_parser = subparsers.add_parser("compare", help="Show saved runs side by side.")
+    compare_parser.add_argument("--results", default=RESULTS_FILE)
+    compare_parser.add_argument("--backend", choices=sorted(BACKEND_FILES))
+    compare_parser.add_argument("--last", type=int, default=4, help="number of most recent runs")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    elif args.command == "compare":
+        compare(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""The shop's item catalog: one table of names, emoji and prices.
+
+Lookups go through an index of normalized names, so ``!buy diamond ring``,
+``!buy DiamondRing``, ``!buy 💍`` and ``!buy 💍 Diamond Ring`` all find the
+same item. Names stored in user inventories are always the canonical ones.
+"""
+from collections import namedtuple
+
+Item = namedtuple("Item", ["name", "emoji", "price"])
+
+ITEMS = [
+    Item("Rolex", "⌚", 5000),
+    Item("Lambo", "🏎️", 130000),
+    Item("Porsche", "🚘", 100000),
+    Item("Apartment", "🏢", 200000),
+    Item("Penthouse", "🌆", 1000000),
+    Item("JetSki", "🛥️", 15000),
+    Item("PrivateIsland", "🏝️", 5000000),
+    Item("Helicopter", "🚁", 800000),
+    Item("Superyacht", "🛳️", 7500000),
+    Item("Diamond Ring", "💍", 10000),
+    Item("SpaceShuttle", "🚀", 20000000),
+    Item("Hooker", "💃", 50000),
+    Item("SecurityTeam", "🛡️", 9000000),
+    Item("PrivateJet", "✈️", 3000000),
+    Item("Castle", "🏰", 15000000),
+]
+SELL_PERCENT = 70  # items sell back for this share of their price
+
+CATALOG = {item.name: item for item in ITEMS}
+
+
+def normalize(text):
+    # Case, spaces, punctuation and emoji all drop out
+    return "".join(ch for ch in text.lower() if ch.isascii() and ch.isalnum())
+
+
+# Normalized names and emoji (with and without the variation selector) to items
+_INDEX = {}
+for _item in ITEMS:
+    _INDEX[normalize(_item.name)] = _item
+    _INDEX[_item.emoji] = _item
+    _INDEX[_item.emoji.rstrip("\ufe0f")] = _item
+
+
+def find(text):
+    """The item ``text`` refers to, or None."""
+    text = text.strip()
+    return _INDEX.get(normalize(text)) or _INDEX.get(text) or _INDEX.get(text.rstrip("\ufe0f"))
+
+
+def canonical_name(name):
+    item = find(name)
+    return item.name if item is not None else name
+
+
+def price(name):
+    # Items no longer in the catalog are worth nothing
+    item = CATALOG.get(name)
+    return item.price if item is not None else 0
+
+
+def sell_price(name):
+    return price(name) * SELL_PERCENT // 100
+
+
+def assets_value(items):
+    """Total price of an ``{item: count}`` inventory."""
+    return sum(price(item) * count for item, count in items.items())
+
+
+def label(name):
+    item = CATALOG.get(name)
+    return f"{item.emoji} {name}" if item is not None else name
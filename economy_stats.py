@@ -0,0 +1,307 @@
+"""Economy statistics for ``!economy``, kept up to date on every change.
+
+``EconomyStats`` is a ledger observer like the leaderboards, so ``!economy``
+never has to read storage. Each change updates:
+
+- coin supply, outstanding debt and the account count: running sums
+- item ownership: owners and units per item, from the difference between the
+  user's old and new inventory
+- median balance and the richest 1%'s share: a ``SumIndex`` of balances, which
+  finds a rank or sums everything below it in O(log n)
+- the Gini coefficient: ``spread``, the sum of ``|a - b|`` over every ordered
+  pair of balances, kept exactly. Adding a balance ``x`` adds twice the sum of
+  ``|x - b|`` over the others, which follows from the count and sum of the
+  balances below ``x``. Gini is ``spread / (2 * accounts * supply)``
+
+The running totals can be checked against an exact recomputation:
+``check_inputs`` copies the economy jobs' NumPy columns and the tracked
+inventories on the event loop, ``exact_totals`` recomputes everything from
+them (in a worker thread, it is O(n log n)), and ``reconcile`` corrects and
+counts any drift.
+
+``sample`` appends a point to a ring buffer (a deque of at most ``samples``
+points) saved to ``path``: the totals above plus the net coins each reason
+(``strip``, ``doors``, ``economy``, ...) added to balances since the previous
+point, so inflation and where it came from can be charted over days.
+"""
+import csv
+import io
+import json
+import os
+import time
+from collections import deque
+
+import numpy as np
+
+from catalog import ITEMS, label
+from leaderboard import SumIndex
+from storage import atomic_write_json
+
+DAY = 24 * 60 * 60
+TOP_SHARE = 0.01  # the richest 1%
+SCALARS = ("accounts", "supply", "debt", "spread")
+
+
+def count_items(holdings):
+    """``({item: owners}, {item: units})`` for ``{user_id: {item: count}}``."""
+    owners = {}
+    units = {}
+    for items in holdings.values():
+        for item, quantity in items.items():
+            owners[item] = owners.get(item, 0) + 1
+            units[item] = units.get(item, 0) + quantity
+    return owners, units
+
+
+def exact_totals(balance, loan, holdings):
+    """Recompute the running totals from scratch.
+
+    ``balance`` and ``loan`` are NumPy columns with one row per account and
+    ``holdings`` maps owners to ``{item: count}``. Slow on purpose: sorts
+    every balance and sums in Python integers, which can't overflow.
+    """
+    values = np.sort(balance).tolist()
+    count = len(values)
+    owners, units = count_items(holdings)
+    return {
+        "accounts": count,
+        "supply": sum(values),
+        "debt": sum(loan.tolist()),
+        # Sorted ascending, the i-th balance is larger than i others and
+        # smaller than count - 1 - i
+        "spread": 2 * sum((2 * i - count + 1) * value for i, value in enumerate(values)),
+        "owners": owners,
+        "units": units,
+    }
+
+
+class EconomyStats:
+    def __init__(self, path=None, samples=720, flows=None):
+        self.path = path
+        self.accounts = 0
+        self.supply = 0
+        self.debt = 0
+        self.spread = 0
+        self.balances = {}
+        self.loans = {}  # only users with a debt
+        self.holdings = {}  # only users who own an item
+        self.owners = {}
+        self.units = {}
+        self.index = SumIndex()
+        # The ledger's running {reason: net coins}; samples store the change
+        self.flows = flows if flows is not None else {}
+        self._sampled_flows = dict(self.flows)
+        self.series = deque(maxlen=samples)
+        self.checks = 0
+        self.corrections = 0
+        if path is not None and os.path.exists(path):
+            with open(path, "r") as file:
+                self.series.extend(json.load(file))
+
+    def __len__(self):
+        return self.accounts
+
+    def load(self, rows, holdings):
+        """Bulk-build from ``(user_id, balance, loan, assets)`` rows and ``(user_id, items)`` pairs."""
+        self.balances = {row[0]: row[1] for row in rows}
+        self.loans = {row[0]: row[2] for row in rows if row[2]}
+        self.holdings = {user_id: dict(items) for user_id, items in holdings if items}
+        self.index = SumIndex(self.balances.values())
+        self.accounts = len(self.balances)
+        self.debt = sum(self.loans.values())
+        self._reset_balance_totals()
+        self.owners, self.units = count_items(self.holdings)
+
+    def _reset_balance_totals(self):
+        self.supply = self.index.total()
+        # The same sum as exact_totals, over the index instead of a sorted copy
+        self.spread = 0
+        if self.accounts:
+            self.spread = 2 * sum(
+                (2 * i - self.accounts + 1) * value for i, value in enumerate(self.index.slice(0, self.accounts))
+            )
+
+    def _spread_to(self, value):
+        # Sum of |value - b| over the balances in the index
+        below, below_sum = self.index.below(value)
+        above, above_sum = len(self.index) - below, self.index.total() - below_sum
+        return value * below - below_sum + above_sum - value * above
+
+    def _add_balance(self, value):
+        self.spread += 2 * self._spread_to(value)
+        self.index.insert(value)
+        self.supply += value
+
+    def _remove_balance(self, value):
+        self.index.remove(value)
+        self.spread -= 2 * self._spread_to(value)
+        self.supply -= value
+
+    def record_changed(self, user_id, record):
+        old = self.balances.get(user_id)
+        if old is None:
+            self.accounts += 1
+            self._add_balance(record.balance)
+        elif old != record.balance:
+            self._remove_balance(old)
+            self._add_balance(record.balance)
+        self.balances[user_id] = record.balance
+
+        self.debt += record.loan - self.loans.get(user_id, 0)
+        if record.loan:
+            self.loans[user_id] = record.loan
+        else:
+            self.loans.pop(user_id, None)
+
+        held = self.holdings.get(user_id, {})
+        if record.items != held:
+            for item in set(held) | set(record.items):
+                before, after = held.get(item, 0), record.items.get(item, 0)
+                self.units[item] = self.units.get(item, 0) + after - before
+                self.owners[item] = self.owners.get(item, 0) + (after > 0) - (before > 0)
+            if record.items:
+                self.holdings[user_id] = dict(record.items)
+            else:
+                self.holdings.pop(user_id, None)
+
+    def balances_reset(self, balance):
+        # Resets leave items alone
+        self.balances = dict.fromkeys(self.balances, balance)
+        self.loans = {}
+        self.debt = 0
+        self.index = SumIndex([balance] * self.accounts)
+        self._reset_balance_totals()
+
+    def gini(self):
+        if not self.accounts or self.supply <= 0:
+            return 0.0
+        return self.spread / (2 * self.accounts * self.supply)
+
+    def median(self):
+        # The lower median, so it stays a whole number of coins
+        return self.index.at((self.accounts - 1) // 2) if self.accounts else 0
+
+    def top_share(self, fraction=TOP_SHARE):
+        """Share of all coins held by the richest ``fraction`` of accounts."""
+        if not self.accounts or self.supply <= 0:
+            return 0.0
+        top = max(1, int(self.accounts * fraction))
+        return (self.supply - self.index.smallest_sum(self.accounts - top)) / self.supply
+
+    def current(self, now=None):
+        return {
+            "t": round(time.time() if now is None else now, 3),
+            "accounts": self.accounts,
+            "supply": self.supply,
+            "debt": self.debt,
+            "gini": round(self.gini(), 4),
+            "median": self.median(),
+            "top_share": round(self.top_share(), 4),
+        }
+
+    def _unsampled_flows(self):
+        flows = {}
+        for reason, total in self.flows.items():
+            change = total - self._sampled_flows.get(reason, 0)
+            if change:
+                flows[reason] = change
+        return flows
+
+    def sample(self, now=None):
+        """Add a point to the ring buffer and save it. Returns the point."""
+        point = self.current(now)
+        point["flows"] = self._unsampled_flows()
+        self._sampled_flows = dict(self.flows)
+        self.series.append(point)
+        if self.path is not None:
+            atomic_write_json(self.path, list(self.series))
+        return point
+
+    def check_inputs(self, columns):
+        """Copies of everything ``exact_totals`` needs, plus the running totals to compare with.
+
+        Taken on the event loop, so ``exact_totals`` can run in a thread.
+        """
+        balance, loan, _ = columns.view()
+        holdings = {user_id: dict(items) for user_id, items in self.holdings.items()}
+        running = {key: getattr(self, key) for key in SCALARS}
+        running["owners"] = dict(self.owners)
+        running["units"] = dict(self.units)
+        return (balance.copy(), loan.copy(), holdings), running
+
+    def reconcile(self, running, exact):
+        """Correct the drift between ``running`` and ``exact`` totals. Returns what was off."""
+        self.checks += 1
+        drift = {}
+        for key in SCALARS:
+            if exact[key] != running[key]:
+                drift[key] = exact[key] - running[key]
+                setattr(self, key, getattr(self, key) + drift[key])
+        for key in ("owners", "units"):
+            totals = getattr(self, key)
+            for item in set(exact[key]) | set(running[key]):
+                off = exact[key].get(item, 0) - running[key].get(item, 0)
+                if off:
+                    drift[f"{key}:{item}"] = off
+                    totals[item] = totals.get(item, 0) + off
+        self.corrections += len(drift)
+        return drift
+
+    def window(self, days, now=None):
+        """``(oldest point in the last days, flows since then)``, or ``(None, flows)``."""
+        now = time.time() if now is None else now
+        since = now - days * DAY
+        start = None
+        flows = self._unsampled_flows()
+        for point in reversed(self.series):
+            if point["t"] < since:
+                break
+            start = point
+            for reason, change in point["flows"].items():
+                flows[reason] = flows.get(reason, 0) + change
+        if start is not None:
+            # The oldest point's flows happened before it was taken
+            for reason, change in start["flows"].items():
+                flows[reason] -= change
+        return start, {reason: change for reason, change in flows.items() if change}
+
+    def summary(self, days=1, now=None, top=3):
+        lines = [
+            f"Accounts: {self.accounts}. Coin supply: {self.supply}. Outstanding debt: {self.debt}.",
+            f"Median balance: {self.median()}. Gini: {self.gini():.3f}. "
+            f"Richest 1% hold {self.top_share():.1%} of the coins.",
+        ]
+        start, flows = self.window(days, now)
+        if start is not None:
+            change = self.supply - start["supply"]
+            rate = f" ({change / start['supply']:+.2%})" if start["supply"] > 0 else ""
+            hours = ((time.time() if now is None else now) - start["t"]) / 3600
+            # New accounts start with coins that no reason below accounts for
+            joined = self.accounts - start["accounts"]
+            lines.append(f"Supply change over the last {hours:.1f}h: {change:+} coins{rate}, "
+                         f"with {joined:+} accounts.")
+        else:
+            lines.append(f"No samples in the last {days:g} days yet; coin flows are since the last sample.")
+        ranked = sorted(flows.items(), key=lambda pair: pair[1])
+        sources = [f"{reason} {change:+}" for reason, change in reversed(ranked[-top:]) if change > 0]
+        sinks = [f"{reason} {change:+}" for reason, change in ranked[:top] if change < 0]
+        if sources or sinks:
+            lines.append(f"Created: {', '.join(sources) or 'none'}. Removed: {', '.join(sinks) or 'none'}.")
+        owned = [f"{label(item.name)} {self.owners[item.name]} owners ({self.units[item.name]})"
+                 for item in ITEMS if self.owners.get(item.name)]
+        lines.append(f"Items: {', '.join(owned)}" if owned else "Nobody owns any items.")
+        return "\n".join(lines)
+
+    def export_csv(self):
+        """The ring buffer as CSV, one row per point with a column per reason."""
+        reasons = sorted({reason for point in self.series for reason in point["flows"]})
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(["time", "accounts", "supply", "debt", "gini", "median", "top_share", *reasons])
+        for point in self.series:
+            writer.writerow([
+                time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(point["t"])), point["accounts"], point["supply"],
+                point["debt"], point["gini"], point["median"], point["top_share"],
+                *(point["flows"].get(reason, 0) for reason in reasons),
+            ])
+        return out.getvalue()
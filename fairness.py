@@ -0,0 +1,263 @@
+"""Provably fair game outcomes from a server seed, a client seed and a nonce.
+
+Every user has a seed pair and a nonce that counts their rounds. The server
+seed is secret, but its SHA-256 hash is shown up front (``!seeds``), so it
+can't be swapped after the fact. The client seed is the player's own, so the
+server can't pick a server seed to suit it. Round ``nonce`` draws its floats
+from
+
+    HMAC-SHA256(key=server seed, message=f"{client seed}:{nonce}:{cursor}")
+
+four bytes per float, eight floats per digest, with cursor 0, 1, ... for as
+many digests as the game needs. ``GAMES`` turns the floats into an outcome the
+same way for playing and for ``!verify``. ``!seeds rotate`` reveals the server
+seed, so the player can recompute every round it was used for, and commits to
+a new one.
+
+Outcomes are drawn ahead of demand. Nonces are reserved ``batch`` at a time,
+and each reservation is one line appended to the log at ``path`` before any of
+its nonces is used. After a crash a few nonces are skipped but none is
+repeated, and the log is written once per batch instead of once per round.
+The first digests of a user's next rounds are computed ahead, with
+``loop.call_soon`` after the round that used up the last ones, so playing a
+round normally only slices one off a bytes buffer. A user is given as many
+rounds ahead as they have played with their seeds so far, up to ``ahead``:
+someone who plays once wastes one digest, a regular gets ``ahead`` at a time,
+and each user holds at most ``ahead * 32`` bytes. Fresh server seeds are
+generated in batches as well.
+
+With ``seed`` set the outcomes are deterministic, for tests and benchmarks:
+server seeds come from HMAC(seed, counter) instead of ``os.urandom``, and
+client seeds default to the user id. Never set it in production: anyone who
+knows the seed knows every outcome.
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+
+from games import DOORS, DOORS_MULTIPLIERS, MINES_TILES, RPS_CHOICES, SLOT_SYMBOLS, STRIP_RANGE
+
+SEED_BYTES = 32
+DIGEST_BYTES = 32
+
+
+def digest(server_seed, client_seed, nonce, cursor=0):
+    return hmac.digest(server_seed.encode(), f"{client_seed}:{nonce}:{cursor}".encode(), "sha256")
+
+
+def floats(server_seed, client_seed, nonce, first=None):
+    """Floats in [0, 1) for one round, as many as are asked for."""
+    cursor = 0
+    while True:
+        data = first if cursor == 0 and first is not None else digest(server_seed, client_seed, nonce, cursor)
+        for i in range(0, len(data), 4):
+            yield int.from_bytes(data[i:i + 4], "big") / 2 ** 32
+        cursor += 1
+
+
+def seed_hash(server_seed):
+    return hashlib.sha256(server_seed.encode()).hexdigest()
+
+
+def pick(draw, options):
+    return options[int(next(draw) * len(options))]
+
+
+def between(draw, low, high):
+    # Like random.randint: both ends included
+    return low + int(next(draw) * (high - low + 1))
+
+
+def shuffle(draw, count, tiles=MINES_TILES):
+    """The first ``count`` tiles of a Fisher-Yates shuffle.
+
+    Each step only uses its own float, so this is a prefix of any longer
+    shuffle of the same round: ``!verify`` shows the whole order, and a game
+    with n mines has them on its first n tiles.
+    """
+    positions = list(range(tiles))
+    for i in range(count):
+        j = i + int(next(draw) * (tiles - i))
+        positions[i], positions[j] = positions[j], positions[i]
+    return positions[:count]
+
+
+# Game name -> function of (floats, *params) returning the round's outcome
+GAMES = {
+    "rps": lambda draw: pick(draw, RPS_CHOICES),
+    "slots": lambda draw: [pick(draw, SLOT_SYMBOLS) for _ in range(3)],
+    "strip": lambda draw: between(draw, *STRIP_RANGE),
+    "doors": lambda draw: [pick(draw, DOORS), between(draw, *DOORS_MULTIPLIERS)],
+    "mines": lambda draw, mines: sorted(shuffle(draw, mines)),
+}
+
+
+def outcome(game, server_seed, client_seed, nonce, *params, first=None):
+    return GAMES[game](floats(server_seed, client_seed, nonce, first), *params)
+
+
+def verify(game, server_seed, client_seed, nonce):
+    """A round's outcome as text, for ``!verify``."""
+    if game == "mines":
+        order = shuffle(floats(server_seed, client_seed, nonce), MINES_TILES - 1)
+        tiles = ", ".join(str(tile + 1) for tile in order)
+        return f"mines go on tiles {tiles}, in that order; a game with n mines has the first n"
+    result = outcome(game, server_seed, client_seed, nonce)
+    if game == "slots":
+        return " | ".join(result)
+    if game == "doors":
+        return f"the money is behind {result[0]}, paying x{result[1]}"
+    return str(result)
+
+
+class Seeds:
+    __slots__ = ("server", "client", "nonce", "reserved", "ahead", "revealed")
+
+    def __init__(self, server, client, nonce=0, reserved=0, revealed=None):
+        self.server = server
+        self.client = client
+        self.nonce = nonce  # the next round's nonce
+        self.reserved = reserved  # nonces below this are in the log
+        self.ahead = b""  # first digests of the next rounds, from ``nonce`` on
+        # The last pair rotated out: {"server", "client", "rounds"}
+        self.revealed = revealed
+
+    def to_dict(self):
+        return {"s": self.server, "c": self.client, "n": self.reserved, "r": self.revealed}
+
+
+class FairRng:
+    def __init__(self, path, batch=64, ahead=8, seed=None):
+        self.path = path
+        self.batch = batch
+        self.ahead = ahead
+        self.seed = seed
+        self.users = {}
+        self._fresh = []  # server seeds not handed out yet
+        self._generated = 0  # server seeds made in seeded mode
+        self._refilling = set()
+        self.rounds = 0
+        self.reservations = 0
+        lines = self._load()
+        if lines > 2 * len(self.users):
+            self._compact()
+        self._log = open(path, "a")
+
+    def _load(self):
+        # Last line per user wins; returns the number of lines read
+        if not os.path.exists(self.path):
+            return 0
+        lines = 0
+        with open(self.path, "r") as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Torn by a crash before any of its nonces were used
+                    continue
+                lines += 1
+                # Resume after everything reserved, used or not
+                self.users[entry["u"]] = Seeds(entry["s"], entry["c"], entry["n"], entry["n"], entry.get("r"))
+        return lines
+
+    def _compact(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as file:
+            for user_id, seeds in self.users.items():
+                file.write(json.dumps({"u": user_id, **seeds.to_dict()}) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.path)
+
+    def __len__(self):
+        return len(self.users)
+
+    def _server_seed(self):
+        if not self._fresh:
+            if self.seed is None:
+                data = os.urandom(SEED_BYTES * self.batch)
+                self._fresh = [data[i:i + SEED_BYTES].hex() for i in range(0, len(data), SEED_BYTES)]
+            else:
+                key = str(self.seed).encode()
+                start = self._generated
+                self._generated += self.batch
+                self._fresh = [
+                    hmac.new(key, str(i).encode(), hashlib.sha256).hexdigest() for i in range(start, self._generated)
+                ]
+                self._fresh.reverse()
+        return self._fresh.pop()
+
+    def _client_seed(self, user_id):
+        return str(user_id) if self.seed is not None else os.urandom(8).hex()
+
+    def _seeds(self, user_id):
+        seeds = self.users.get(user_id)
+        if seeds is None:
+            seeds = self.users[user_id] = Seeds(self._server_seed(), self._client_seed(user_id))
+            # Logged straight away, so the hash !seeds shows is kept
+            self._reserve(user_id, seeds, 0)
+        return seeds
+
+    def _reserve(self, user_id, seeds, end):
+        # Log that every nonce below ``end`` may be used
+        seeds.reserved = max(seeds.reserved, end) + self.batch
+        self._log.write(json.dumps({"u": user_id, **seeds.to_dict()}) + "\n")
+        self._log.flush()
+        self.reservations += 1
+
+    def _refill(self, user_id):
+        self._refilling.discard(user_id)
+        seeds = self.users.get(user_id)
+        if seeds is None:
+            return
+        start = seeds.nonce + len(seeds.ahead) // DIGEST_BYTES
+        end = seeds.nonce + min(self.ahead, max(1, seeds.nonce))
+        if end > seeds.reserved:
+            self._reserve(user_id, seeds, end)
+        seeds.ahead += b"".join(digest(seeds.server, seeds.client, nonce) for nonce in range(start, end))
+
+    def draw(self, user_id, game, *params):
+        """Play one round of ``game``: ``(nonce, outcome)``."""
+        user_id = str(user_id)
+        seeds = self._seeds(user_id)
+        nonce = seeds.nonce
+        if seeds.ahead:
+            first, seeds.ahead = seeds.ahead[:DIGEST_BYTES], seeds.ahead[DIGEST_BYTES:]
+        else:
+            # Nothing drawn ahead yet, e.g. the user's first round
+            first = None
+            if nonce >= seeds.reserved:
+                self._reserve(user_id, seeds, nonce + 1)
+        seeds.nonce = nonce + 1
+        if not seeds.ahead and user_id not in self._refilling:
+            self._refilling.add(user_id)
+            asyncio.get_running_loop().call_soon(self._refill, user_id)
+        self.rounds += 1
+        return nonce, outcome(game, seeds.server, seeds.client, nonce, *params, first=first)
+
+    def info(self, user_id):
+        """What ``!seeds`` shows: the committed hash, client seed, next nonce and the last revealed pair."""
+        seeds = self._seeds(str(user_id))
+        return {
+            "hash": seed_hash(seeds.server),
+            "client": seeds.client,
+            "nonce": seeds.nonce,
+            "revealed": seeds.revealed,
+        }
+
+    def rotate(self, user_id, client_seed=None):
+        """Reveal the current server seed and commit to a new one. Returns the new ``info``."""
+        user_id = str(user_id)
+        old = self._seeds(user_id)
+        seeds = self.users[user_id] = Seeds(
+            self._server_seed(), client_seed or self._client_seed(user_id),
+            revealed={"server": old.server, "client": old.client, "rounds": old.nonce},
+        )
+        self._reserve(user_id, seeds, 0)
+        return self.info(user_id)
+
+    def close(self):
+        self._log.close()
+        self._compact()
@@ -0,0 +1,244 @@
+"""Button-based Mines and Doors.
+
+Each game is one message with a ``discord.ui.View`` attached. Every click is
+answered by editing that message in place through the interaction response,
+so a game costs one send plus one edit per move instead of a send, a
+reaction per tile and extra messages for every reveal.
+
+Stakes are taken by the command as an open ledger round (see ``ledger.py``)
+and the view settles the round exactly once when the game ends, through the
+ledger service (see ``ledger_service.py``), which may be in another process. Idle
+timeouts are driven by the ``SessionManager`` in ``sessions.py`` rather than
+by discord.py's per-view timeout task.
+
+Outcomes are drawn by the command before the view is built, from the
+provably fair RNG (see ``fairness.py``). Each view shows the round's nonce.
+"""
+import discord
+
+GRID_SIZE = 5
+# Discord allows 25 buttons per message; the last grid cell is the cash-out button
+MINES_TILES = GRID_SIZE * GRID_SIZE - 1
+MINES_HOUSE_EDGE = 0.03
+MINES_TIMEOUT = 60.0
+DOORS = ["🟦", "🟨", "🟥"]
+DOORS_MULTIPLIERS = (2, 4)  # a winning door pays a random multiplier in this range
+DOORS_TIMEOUT = 30.0
+# Payout rules for the games played straight from a command in main.py.
+# rtp.py simulates all of these, so tune them here
+SLOT_SYMBOLS = ["🍒", "🍋", "🔔", "🍀", "🍉"]
+SLOTS_MULTIPLIER = 3  # three of a kind pays this many times the bet
+RPS_CHOICES = ["rock", "paper", "scissors"]
+STRIP_RANGE = (-200, 500)
+
+
+def generate_grid(size, mine_positions):
+    grid = ['0'] * size
+    for mine in mine_positions:
+        grid[mine] = '💣'  # Marking mines
+    return grid
+
+
+def mines_multiplier(num_mines, revealed, tiles=MINES_TILES, house_edge=MINES_HOUSE_EDGE):
+    # Inverse of the odds of picking ``revealed`` safe tiles in a row, less the
+    # house edge, so more mines pay more per tile
+    multiplier = 1.0
+    for i in range(revealed):
+        multiplier *= (tiles - i) / (tiles - num_mines - i)
+    return round(multiplier * (1 - house_edge), 2)
+
+
+class GameView(discord.ui.View):
+    """Shared plumbing: only the player may click, and the round settles once."""
+
+    def __init__(self, bank, player, bet, round_id, reason, timeout, nonce=None):
+        # The session manager owns the timeout, see sessions.py
+        super().__init__(timeout=None)
+        self.nonce = nonce  # the fair RNG round the outcome came from
+        self.idle_timeout = timeout
+        self.manager = None
+        self.session_id = None
+        self.bank = bank
+        self.player = player
+        self.bet = bet
+        self.round_id = round_id
+        self.reason = reason
+        self.message = None
+        self.finished = False
+        self.balance = None
+
+    async def interaction_check(self, interaction):
+        if self.finished:
+            # A click that raced the end of the game
+            await interaction.response.defer()
+            return False
+        if interaction.user.id != self.player.id:
+            await interaction.response.send_message("This isn't your game.", ephemeral=True)
+            return False
+        if self.manager is not None:
+            self.manager.touch(self.session_id)
+        return True
+
+    async def settle(self, payout):
+        self.finished = True
+        self.balance = await self.bank.close_round(self.round_id, payout, self.reason)
+        for item in self.children:
+            item.disabled = True
+        self.stop()
+        if self.manager is not None:
+            self.manager.unregister(self.session_id)
+
+    def render(self):
+        raise NotImplementedError
+
+    def round_label(self):
+        return f" (round {self.nonce})" if self.nonce is not None else ""
+
+    def describe(self):
+        return f"{self.reason} by {self.player.mention}, bet {self.bet}"
+
+    async def on_timeout(self):
+        if self.finished:
+            return
+        await self.timeout_settle()
+        if self.message is not None:
+            await self.message.edit(content=self.render(), view=self)
+
+    async def timeout_settle(self):
+        await self.settle(0)
+
+
+class TileButton(discord.ui.Button):
+    def __init__(self, tile):
+        super().__init__(style=discord.ButtonStyle.secondary, emoji="⬛", row=tile // GRID_SIZE)
+        self.tile = tile
+
+    async def callback(self, interaction):
+        await self.view.reveal(self, interaction)
+
+
+class CashOutButton(discord.ui.Button):
+    def __init__(self):
+        super().__init__(style=discord.ButtonStyle.success, label="Cash out", row=GRID_SIZE - 1, disabled=True)
+
+    async def callback(self, interaction):
+        await self.view.cash_out()
+        await interaction.response.edit_message(content=self.view.render(), view=self.view)
+
+
+class MinesView(GameView):
+    def __init__(self, bank, player, bet, mine_positions, round_id, nonce=None, timeout=MINES_TIMEOUT):
+        super().__init__(bank, player, bet, round_id, "mines", timeout, nonce)
+        self.num_mines = len(mine_positions)
+        self.grid = generate_grid(MINES_TILES, mine_positions)
+        self.revealed = set()  # Keep track of revealed tiles
+        self.tiles = [TileButton(tile) for tile in range(MINES_TILES)]
+        for button in self.tiles:
+            self.add_item(button)
+        self.cash_out_button = CashOutButton()
+        self.add_item(self.cash_out_button)
+        self.result = "Click tiles to reveal them, and cash out before you hit a mine!"
+
+    def describe(self):
+        return f"{super().describe()}, {self.num_mines} mines, {len(self.revealed)} revealed"
+
+    def multiplier(self):
+        return mines_multiplier(self.num_mines, len(self.revealed))
+
+    def payout(self):
+        return int(self.bet * self.multiplier()) if self.revealed else 0
+
+    def render(self):
+        lines = [
+            f"**Mines Game!**{self.round_label()}",
+            f"{self.player.mention} | Your bet: {self.bet} 💸 | Mines: {self.num_mines}",
+        ]
+        if self.revealed:
+            lines.append(f"Multiplier: x{self.multiplier()} | Cash out: {self.payout()} coins")
+        lines.append(self.result)
+        if self.balance is not None:
+            lines.append(f"Balance: {self.balance} coins.")
+        return "\n".join(lines)
+
+    def show_board(self):
+        for button in self.tiles:
+            if self.grid[button.tile] == '💣':
+                button.emoji = "💣"
+                button.style = discord.ButtonStyle.danger
+
+    async def reveal(self, button, interaction):
+        # Reveal the tile
+        self.revealed.add(button.tile)
+        button.disabled = True
+        if self.grid[button.tile] == '💣':
+            # User clicked on a mine, game over
+            self.result = f"You hit a mine! You lost your bet of {self.bet} 💸."
+            self.show_board()
+            await self.settle(0)
+        else:
+            button.emoji = "💎"
+            button.style = discord.ButtonStyle.primary
+            self.cash_out_button.disabled = False
+            if len(self.revealed) == MINES_TILES - self.num_mines:
+                await self.cash_out()
+        await interaction.response.edit_message(content=self.render(), view=self)
+
+    async def cash_out(self):
+        payout = self.payout()
+        self.result = f"You cashed out {payout} coins at x{self.multiplier()}!"
+        self.show_board()
+        await self.settle(payout)
+
+    async def timeout_settle(self):
+        # Whatever was already uncovered is banked; with nothing revealed the bet is lost
+        if self.revealed:
+            await self.cash_out()
+            self.result = f"The game timed out. {self.result}"
+        else:
+            self.result = "The game timed out!"
+            self.show_board()
+            await self.settle(0)
+
+
+class DoorButton(discord.ui.Button):
+    def __init__(self, door):
+        super().__init__(style=discord.ButtonStyle.secondary, emoji=door)
+        self.door = door
+
+    async def callback(self, interaction):
+        await self.view.choose(self, interaction)
+
+
+class DoorsView(GameView):
+    def __init__(self, bank, player, bet, winning_door, multiplier, round_id, nonce=None, timeout=DOORS_TIMEOUT):
+        super().__init__(bank, player, bet, round_id, "doors", timeout, nonce)
+        # Both drawn up front, so the round can be verified whichever door is picked
+        self.winning_door = winning_door
+        self.multiplier = multiplier
+        for door in DOORS:
+            self.add_item(DoorButton(door))
+        self.result = "Pick a door!"
+
+    def render(self):
+        content = f"{self.player.mention}, \n {self.result} \n\nBet amount: {self.bet}{self.round_label()}"
+        if self.balance is not None:
+            content += f"\nBalance: {self.balance} coins."
+        return content
+
+    async def choose(self, button, interaction):
+        # Evaluate the result
+        if button.door == self.winning_door:
+            multiplier = self.multiplier
+            winnings = self.bet * multiplier
+            button.style = discord.ButtonStyle.success
+            self.result = f"{button.door} - You won {winnings} coins! (Multiplier: x{multiplier})"
+        else:
+            winnings = 0
+            button.style = discord.ButtonStyle.danger
+            self.result = f"{button.door} - You lost! The money was behind {self.winning_door}."
+        await self.settle(winnings)
+        await interaction.response.edit_message(content=self.render(), view=self)
+
+    async def timeout_settle(self):
+        self.result = "You took too long to choose a door!"
+        await self.settle(0)
@@ -0,0 +1,238 @@
+"""Per-user transaction history, for ``!history``.
+
+The journal only keeps what the last snapshot doesn't cover, so it can't say
+where a user's coins went last week. The history log keeps every change a
+user sees, in one append-only file, one JSON line per change:
+
+    {"s": 42, "t": 1700000000.0, "u": "1234", "r": "slots", "b": -50, "a": 950, "p": 8812}
+
+``s``, ``t``, ``u``, ``r`` and the ``b``/``l``/``i`` deltas mean the same as in
+the journal. ``a`` is the user's balance after the change and ``p`` is the
+byte offset of that user's previous line, or -1. The index is one
+``[offset, count]`` pair per user, pointing at their newest line. A page is
+read by seeking back along the chain from there, so a lookup costs one seek
+per line on and before the page, however big the file gets.
+
+Changes are buffered in memory and written by ``flush``, which the ledger
+runs with every snapshot, so recording one is an append to a deque. The index
+is saved every ``index_every`` bytes of log. On startup only the lines after
+the saved index are read back. The history isn't the source of truth: after a
+crash, the ledger re-records whatever journal entries the history hadn't
+reached yet (``seq``).
+
+``compact`` rewrites the file without lines older than ``retention_days`` or
+beyond a user's newest ``keep``. It runs from ``flush`` once the file has
+grown to ``compact_growth`` times its size after the last compaction, and at
+least once a day.
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import catalog
+from storage import atomic_write_json
+
+DAY = 24 * 60 * 60
+
+
+def describe(entry):
+    """One line of ``!history`` for a log entry."""
+    parts = []
+    if entry.get("b"):
+        parts.append(f"{entry['b']:+} coins")
+    if entry.get("l"):
+        parts.append(f"debt {entry['l']:+}")
+    for item, count in sorted(entry.get("i", {}).items()):
+        parts.append(f"{count:+} {catalog.label(item)}")
+    return f"<t:{int(entry['t'])}:f> {entry['r']}: {', '.join(parts)} (balance {entry['a']})"
+
+
+class History:
+    def __init__(self, directory, page_size=10, keep=1000, retention_days=90, compact_growth=2.0,
+                 compact_min_bytes=16 * 1024 * 1024, index_every=4 * 1024 * 1024):
+        self.directory = directory
+        self.path = os.path.join(directory, "history.log")
+        self.index_path = os.path.join(directory, "index.json")
+        self.page_size = page_size
+        self.keep = keep
+        self.retention_days = retention_days
+        self.compact_growth = compact_growth
+        self.compact_min_bytes = compact_min_bytes
+        self.index_every = index_every
+        os.makedirs(directory, exist_ok=True)
+        # (seq, time, user id, reason, deltas, balance) waiting for flush;
+        # appended on the event loop and drained from a worker thread
+        self.pending = deque()
+        self._lock = threading.Lock()
+        self.seq = 0  # last journal sequence number in the log
+        self.heads = {}  # user id -> [offset of their newest line, line count]
+        self.size = 0
+        self.indexed_size = 0  # log size when the index was last saved
+        self.compacted_size = 0
+        self.compacted_at = time.time()
+        self.bytes_written = 0
+        self.compactions = 0
+        self._load()
+        self._file = open(self.path, "ab")
+        self._reader = open(self.path, "rb")
+
+    def _load(self):
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as file:
+                index = json.load(file)
+            self.seq = index["seq"]
+            self.heads = index["heads"]
+            self.indexed_size = index["size"]
+            self.compacted_size = index["compacted_size"]
+            self.compacted_at = index["compacted_at"]
+        self.size = self.indexed_size
+        if not os.path.exists(self.path):
+            return
+        # Catch up on the lines written after the index was saved
+        with open(self.path, "r+b") as file:
+            file.seek(self.size)
+            for line in file:
+                try:
+                    entry = json.loads(line) if line.endswith(b"\n") else None
+                except ValueError:
+                    entry = None
+                if entry is None:
+                    # Torn by a crash; the ledger re-records it from the journal
+                    file.truncate(self.size)
+                    break
+                head = self.heads.get(entry["u"])
+                self.heads[entry["u"]] = [self.size, (head[1] if head else 0) + 1]
+                self.seq = max(self.seq, entry["s"])
+                self.size += len(line)
+
+    def __len__(self):
+        return len(self.heads)
+
+    def record(self, seq, user_id, reason, deltas, balance):
+        self.pending.append((seq, round(time.time(), 3), str(user_id), reason, deltas, balance))
+
+    def _flush_locked(self):
+        lines = []
+        for _ in range(len(self.pending)):
+            seq, when, user_id, reason, deltas, balance = self.pending.popleft()
+            head = self.heads.get(user_id)
+            entry = {"s": seq, "t": when, "u": user_id, "r": reason}
+            entry.update(deltas)
+            entry["a"] = balance
+            entry["p"] = head[0] if head else -1
+            line = json.dumps(entry, separators=(",", ":")).encode() + b"\n"
+            self.heads[user_id] = [self.size, (head[1] if head else 0) + 1]
+            self.size += len(line)
+            self.seq = max(self.seq, seq)
+            lines.append(line)
+        if lines:
+            data = b"".join(lines)
+            self._file.write(data)
+            self._file.flush()
+            self.bytes_written += len(data)
+
+    def _save_index(self):
+        atomic_write_json(self.index_path, {
+            "seq": self.seq, "size": self.size, "compacted_size": self.compacted_size,
+            "compacted_at": self.compacted_at, "heads": self.heads,
+        })
+        self.indexed_size = self.size
+
+    def flush(self, now=None):
+        """Write buffered changes; compact or save the index when due."""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._flush_locked()
+            grown = self.size >= max(self.compact_min_bytes, self.compact_growth * self.compacted_size)
+            if grown or now - self.compacted_at >= DAY:
+                self._compact(now)
+            elif self.size - self.indexed_size >= self.index_every:
+                self._save_index()
+
+    def _read(self, offset):
+        self._reader.seek(offset)
+        return json.loads(self._reader.readline())
+
+    def page(self, user_id, page):
+        """``(entries, page, page count)`` for a 1-based page, newest first, or None."""
+        with self._lock:
+            self._flush_locked()
+            head = self.heads.get(str(user_id))
+            if head is None:
+                return None
+            offset, count = head
+            pages = -(-count // self.page_size)
+            page = min(max(page, 1), pages)
+            skip = (page - 1) * self.page_size
+            entries = []
+            while offset >= 0 and len(entries) < self.page_size:
+                entry = self._read(offset)
+                if skip:
+                    skip -= 1
+                else:
+                    entries.append(entry)
+                offset = entry["p"]
+            return entries, page, pages
+
+    def export(self, user_id):
+        """Every entry kept for a user, oldest first."""
+        with self._lock:
+            self._flush_locked()
+            head = self.heads.get(str(user_id))
+            entries = []
+            offset = head[0] if head else -1
+            while offset >= 0:
+                entry = self._read(offset)
+                entries.append(entry)
+                offset = entry["p"]
+            entries.reverse()
+            return entries
+
+    def _compact(self, now):
+        cutoff = now - self.retention_days * DAY if self.retention_days else None
+        seen = {}
+        heads = {}
+        size = 0
+        tmp_path = self.path + ".tmp"
+        with open(self.path, "rb") as source, open(tmp_path, "wb") as target:
+            for line in source:
+                entry = json.loads(line)
+                user_id = entry["u"]
+                position = seen.get(user_id, 0)
+                seen[user_id] = position + 1
+                if self.keep and position < self.heads[user_id][1] - self.keep:
+                    continue
+                if cutoff is not None and entry["t"] < cutoff:
+                    continue
+                head = heads.get(user_id)
+                entry["p"] = head[0] if head else -1
+                line = json.dumps(entry, separators=(",", ":")).encode() + b"\n"
+                heads[user_id] = [size, (head[1] if head else 0) + 1]
+                size += len(line)
+                target.write(line)
+            target.flush()
+            os.fsync(target.fileno())
+        self._file.close()
+        self._reader.close()
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, "ab")
+        self._reader = open(self.path, "rb")
+        self.heads = heads
+        self.size = self.compacted_size = size
+        self.compacted_at = now
+        self.compactions += 1
+        self._save_index()
+
+    def compact(self, now=None):
+        with self._lock:
+            self._flush_locked()
+            self._compact(time.time() if now is None else now)
+
+    def close(self):
+        with self._lock:
+            self._flush_locked()
+            self._save_index()
+            self._file.close()
+            self._reader.close()
@@ -0,0 +1,301 @@
+"""Leaderboard kept up to date on every balance change.
+
+``RankIndex`` is a sorted list split into buckets with a Fenwick tree over
+the bucket sizes, so inserts, removals, rank lookups and page slices are all
+O(log n) instead of re-sorting every user per ``!leaderboard``. The same index
+backs the net-worth ranking behind ``!networth``. ``SumIndex`` adds a second
+tree of bucket sums, for the order statistics behind ``!economy``.
+"""
+from bisect import bisect_left, insort
+
+
+def fenwick(values):
+    """A Fenwick tree over ``values``, 1-based with an unused slot 0."""
+    tree = [0]
+    tree.extend(values)
+    for i in range(1, len(tree)):
+        parent = i + (i & -i)
+        if parent < len(tree):
+            tree[parent] += tree[i]
+    return tree
+
+
+def fenwick_add(tree, i, delta):
+    i += 1
+    while i < len(tree):
+        tree[i] += delta
+        i += i & -i
+
+
+def fenwick_prefix(tree, i):
+    # Sum of values[:i]
+    total = 0
+    while i > 0:
+        total += tree[i]
+        i -= i & -i
+    return total
+
+
+class RankIndex:
+    LOAD = 512  # target bucket size; buckets split at twice this
+
+    def __init__(self, keys=()):
+        keys = sorted(keys)
+        self._buckets = [keys[i:i + self.LOAD] for i in range(0, len(keys), self.LOAD)]
+        self._maxes = [bucket[-1] for bucket in self._buckets]
+        self._len = len(keys)
+        self._rebuild_tree()
+
+    def __len__(self):
+        return self._len
+
+    def _rebuild_tree(self):
+        self._tree = fenwick(len(bucket) for bucket in self._buckets)
+
+    def _bucket_changed(self, i, key, delta):
+        # ``key`` was added to (delta 1) or removed from (-1) bucket i
+        fenwick_add(self._tree, i, delta)
+
+    def _prefix(self, i):
+        # Number of keys in buckets[:i]
+        return fenwick_prefix(self._tree, i)
+
+    def _find(self, position):
+        # Bucket holding the key at ``position`` and the offset inside it
+        i = 0
+        step = 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            nxt = i + step
+            if nxt < len(self._tree) and self._tree[nxt] <= position:
+                i = nxt
+                position -= self._tree[nxt]
+            step >>= 1
+        return i, position
+
+    def insert(self, key):
+        self._len += 1
+        if not self._buckets:
+            self._buckets.append([key])
+            self._maxes.append(key)
+            self._rebuild_tree()
+            return
+        i = bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            i -= 1
+            self._buckets[i].append(key)
+            self._maxes[i] = key
+        else:
+            insort(self._buckets[i], key)
+        bucket = self._buckets[i]
+        if len(bucket) > 2 * self.LOAD:
+            self._buckets[i:i + 1] = [bucket[:self.LOAD], bucket[self.LOAD:]]
+            self._maxes[i:i + 1] = [bucket[self.LOAD - 1], bucket[-1]]
+            self._rebuild_tree()
+        else:
+            self._bucket_changed(i, key, 1)
+
+    def remove(self, key):
+        i = bisect_left(self._maxes, key)
+        bucket = self._buckets[i]
+        j = bisect_left(bucket, key)
+        del bucket[j]
+        self._len -= 1
+        if not bucket:
+            del self._buckets[i]
+            del self._maxes[i]
+            self._rebuild_tree()
+            return
+        if j == len(bucket):
+            self._maxes[i] = bucket[-1]
+        self._bucket_changed(i, key, -1)
+
+    def position(self, key):
+        i = bisect_left(self._maxes, key)
+        return self._prefix(i) + bisect_left(self._buckets[i], key)
+
+    def slice(self, start, stop):
+        stop = min(stop, self._len)
+        if start >= stop:
+            return []
+        i, j = self._find(start)
+        keys = []
+        while len(keys) < stop - start:
+            keys.extend(self._buckets[i][j:j + stop - start - len(keys)])
+            i, j = i + 1, 0
+        return keys
+
+
+class SumIndex(RankIndex):
+    """A ``RankIndex`` of numbers that can also sum them by rank.
+
+    Duplicates are allowed. Bucket sums are rebuilt along with the count tree,
+    which only happens when a bucket splits or empties.
+    """
+
+    def _rebuild_tree(self):
+        super()._rebuild_tree()
+        self._bucket_sums = [sum(bucket) for bucket in self._buckets]
+        self._sums = fenwick(self._bucket_sums)
+        self._total = sum(self._bucket_sums)
+
+    def _bucket_changed(self, i, key, delta):
+        super()._bucket_changed(i, key, delta)
+        fenwick_add(self._sums, i, key * delta)
+        self._bucket_sums[i] += key * delta
+        self._total += key * delta
+
+    def total(self):
+        return self._total
+
+    def _sum_before(self, i, j):
+        # Sum of every value before offset j of bucket i, summing whichever
+        # part of the bucket is shorter
+        bucket = self._buckets[i]
+        if j <= len(bucket) // 2:
+            partial = sum(bucket[:j])
+        else:
+            partial = self._bucket_sums[i] - sum(bucket[j:])
+        return fenwick_prefix(self._sums, i) + partial
+
+    def below(self, value):
+        """``(count, sum)`` of the values less than ``value``."""
+        i = bisect_left(self._maxes, value)
+        if i == len(self._buckets):
+            return self._len, self._total
+        j = bisect_left(self._buckets[i], value)
+        return self._prefix(i) + j, self._sum_before(i, j)
+
+    def smallest_sum(self, count):
+        """Sum of the ``count`` smallest values."""
+        if count >= self._len:
+            return self._total
+        return self._sum_before(*self._find(count))
+
+    def at(self, position):
+        """The value at 0-based ``position`` in ascending order."""
+        i, j = self._find(position)
+        return self._buckets[i][j]
+
+
+class Leaderboard:
+    """Ranks users by balance and caches rendered pages.
+
+    Attach it to the ledger as an observer. A cached page is dropped only when
+    a change moves or touches a rank that falls on it. Subclasses rank by
+    something else by overriding ``score`` and ``render_line``.
+    """
+
+    def __init__(self, page_size=10):
+        self.page_size = page_size
+        self.scores = {}
+        self.debts = {}
+        self.index = RankIndex()
+        self._pages = {}
+
+    def score(self, balance, loan, assets):
+        return balance
+
+    def load(self, rows):
+        """Bulk-build from ``(user_id, balance, loan, assets)`` rows."""
+        self.scores = {}
+        self.debts = {}
+        for user_id, balance, loan, assets in rows:
+            self._track(user_id, balance, loan, assets)
+            self.scores[user_id] = self.score(balance, loan, assets)
+            if loan:
+                self.debts[user_id] = loan
+        self.index = RankIndex((-score, user_id) for user_id, score in self.scores.items())
+        self._pages.clear()
+
+    def _track(self, user_id, balance, loan, assets):
+        # Hook for subclasses that need more of the record than the score
+        pass
+
+    def __len__(self):
+        return len(self.index)
+
+    def _invalidate(self, first, last=None):
+        first_page = first // self.page_size
+        last_page = None if last is None else last // self.page_size
+        for page in list(self._pages):
+            if page >= first_page and (last_page is None or page <= last_page):
+                del self._pages[page]
+
+    def record_changed(self, user_id, record):
+        loan = record.loan
+        self._track(user_id, record.balance, loan, record.assets)
+        score = self.score(record.balance, loan, record.assets)
+        old_score = self.scores.get(user_id)
+        debt_changed = self.debts.get(user_id, 0) != loan
+        if loan:
+            self.debts[user_id] = loan
+        else:
+            self.debts.pop(user_id, None)
+        if old_score is None:
+            # A new user shifts everyone ranked below them
+            self.scores[user_id] = score
+            self.index.insert((-score, user_id))
+            self._invalidate(self.index.position((-score, user_id)))
+            return
+        if old_score != score:
+            old_position = self.index.position((-old_score, user_id))
+            self.index.remove((-old_score, user_id))
+            self.index.insert((-score, user_id))
+            self.scores[user_id] = score
+            new_position = self.index.position((-score, user_id))
+            self._invalidate(min(old_position, new_position), max(old_position, new_position))
+        elif debt_changed:
+            position = self.index.position((-score, user_id))
+            self._invalidate(position, position)
+
+    def balances_reset(self, balance):
+        self.load([(user_id, balance, 0, 0) for user_id in self.scores])
+
+    def rank(self, user_id):
+        """1-based rank of a user, or None if they have no account yet."""
+        score = self.scores.get(str(user_id))
+        if score is None:
+            return None
+        return self.index.position((-score, str(user_id))) + 1
+
+    def page_count(self):
+        return max(1, -(-len(self.index) // self.page_size))
+
+    def render_line(self, rank, user_id):
+        return f"#{rank} <@{user_id}>: {self.scores[user_id]} coins (Debt: {self.debts.get(user_id, 0)})"
+
+    def render_page(self, page):
+        """Text for 1-based ``page``, without the header."""
+        page = min(max(page, 1), self.page_count()) - 1
+        text = self._pages.get(page)
+        if text is None:
+            start = page * self.page_size
+            keys = self.index.slice(start, start + self.page_size)
+            text = "\n".join(self.render_line(rank, user_id) for rank, (_, user_id) in enumerate(keys, start + 1))
+            self._pages[page] = text
+        return text
+
+
+class NetWorthLeaderboard(Leaderboard):
+    """Ranks users by balance plus item value minus debt."""
+
+    def __init__(self, page_size=10):
+        super().__init__(page_size)
+        # Only users who own something, to keep a big economy small in memory
+        self.assets = {}
+
+    def score(self, balance, loan, assets):
+        return balance + assets - loan
+
+    def _track(self, user_id, balance, loan, assets):
+        if assets:
+            self.assets[user_id] = assets
+        else:
+            self.assets.pop(user_id, None)
+
+    def balances_reset(self, balance):
+        # Resets leave items alone, so net worth keeps their value
+        self.load([(user_id, balance, 0, self.assets.get(user_id, 0)) for user_id in self.scores])
+
+    def render_line(self, rank, user_id):
+        return f"#{rank} <@{user_id}>: {self.scores[user_id]} coins"
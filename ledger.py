@@ -0,0 +1,417 @@
+import asyncio
+import weakref
+
+from account import DEFAULT_BALANCE, Account
+from catalog import price
+
+
+def compact_deltas(balance=0, loan=0, items=None):
+    deltas = {}
+    if balance:
+        deltas["b"] = balance
+    if loan:
+        deltas["l"] = loan
+    items = {item: count for item, count in (items or {}).items() if count}
+    if items:
+        deltas["i"] = items
+    return deltas
+
+
+def apply_items(account, items):
+    # Counts and the cached asset value move together, so net worth never
+    # needs a walk over the inventory
+    for item, count in items.items():
+        total = account.items.get(item, 0) + count
+        if total < 0:
+            raise ValueError(f"Not enough {item} to remove {-count}")
+        if total:
+            account.items[item] = total
+        else:
+            account.items.pop(item, None)
+        account.assets += price(item) * count
+
+
+class Transaction:
+    """Staged, delta-based changes to a fixed set of accounts.
+
+    Created by ``Ledger.transaction``. Holding it holds the per-account locks,
+    acquired in sorted order so two transfers between the same pair of users
+    can't deadlock. Deltas are applied when the ``async with`` block exits
+    normally, as one journal entry; if the block raises, nothing is applied.
+    """
+
+    def __init__(self, ledger, user_ids, reason):
+        self.ledger = ledger
+        self.user_ids = sorted({str(user_id) for user_id in user_ids})
+        self.reason = reason
+        self.deltas = {}
+        self._locks = []
+
+    async def __aenter__(self):
+        try:
+            for user_id in self.user_ids:
+                lock = self.ledger._lock_for(user_id)
+                await lock.acquire()
+                self._locks.append(lock)
+        except BaseException:
+            self._release()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.commit()
+        finally:
+            self._release()
+
+    def _release(self):
+        while self._locks:
+            self._locks.pop().release()
+
+    def _staged(self, user_id):
+        user_id = str(user_id)
+        if user_id not in self.user_ids:
+            raise ValueError(f"User {user_id} is not part of this transaction")
+        return self.deltas.setdefault(user_id, {"balance": 0, "loan": 0, "items": {}})
+
+    def record(self, user_id):
+        """The account as it will look once this transaction commits."""
+        staged = self._staged(user_id)
+        account = self.ledger.get(user_id)
+        account.balance += staged["balance"]
+        account.loan += staged["loan"]
+        apply_items(account, staged["items"])
+        return account
+
+    def balance(self, user_id):
+        return self.ledger._record(user_id).balance + self._staged(user_id)["balance"]
+
+    def adjust(self, user_id, balance=0, loan=0, items=None):
+        """Stage changes by amount: ``items`` maps item name to a count change."""
+        staged = self._staged(user_id)
+        staged["balance"] += balance
+        staged["loan"] += loan
+        for item, count in (items or {}).items():
+            staged["items"][item] = staged["items"].get(item, 0) + count
+
+    def commit(self):
+        changes = [
+            [user_id, deltas] for user_id, staged in self.deltas.items()
+            if (deltas := compact_deltas(**staged))
+        ]
+        self.deltas = {}
+        self.ledger.apply_changes(changes, self.reason)
+
+
+class Ledger:
+    """Write-behind cache of user records in front of a storage backend.
+
+    Reads are served from memory after the first lookup of a user. Every
+    change is appended to the journal straight away, and dirty records are
+    written to the backend as a snapshot in the background every
+    ``flush_interval`` seconds or as soon as ``flush_threshold`` records are
+    waiting, whichever comes first. Each snapshot compacts the journal.
+    """
+
+    def __init__(self, storage, journal=None, flush_interval=5.0, flush_threshold=500, history=None):
+        self.storage = storage
+        self.journal = journal
+        # Per-user transaction history (see history.py), written with each snapshot
+        self.history = history
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.records = {}
+        self.dirty = set()
+        # One lock per account, created on demand and dropped when unused
+        self._locks = weakref.WeakValueDictionary()
+        # Objects with record_changed(user_id, record) and balances_reset(balance)
+        # methods, told about every change (e.g. the leaderboard index)
+        self.observers = []
+        # Net coins each reason has added to balances since startup, for
+        # the inflation figures in ``!economy``
+        self.flows = {}
+        # Game stakes that have been taken but not paid out yet, by round id
+        self.open_rounds = dict(storage.meta.get("open_rounds", {}))
+        self._seq = storage.meta.get("journal_seq", 0)
+        if journal is not None:
+            journal.seq = max(journal.seq, self._seq)
+        self._flush_lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def _record(self, user_id):
+        user_id_str = str(user_id)
+        record = self.records.get(user_id_str)
+        if record is None:
+            record = self.storage.fetch(user_id_str)
+            if record is None:
+                self.records[user_id_str] = record = Account()
+                self._changed(user_id_str)
+            else:
+                self.records[user_id_str] = record
+        return record
+
+    def _append(self, user_id, reason, **deltas):
+        if self.journal is not None:
+            return self.journal.append(user_id, reason, **deltas)
+        self._seq += 1
+        return self._seq
+
+    def _log(self, seq, user_id, reason, deltas):
+        if deltas.get("b"):
+            self.flows[reason] = self.flows.get(reason, 0) + deltas["b"]
+        if self.history is not None:
+            self.history.record(seq, user_id, reason, deltas, self.records[user_id].balance)
+
+    def _lock_for(self, user_id):
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = self._locks[user_id] = asyncio.Lock()
+        return lock
+
+    def _apply_deltas(self, user_id, deltas):
+        record = self._record(user_id)
+        # Items first: it is the only part that can refuse a delta
+        apply_items(record, deltas.get("i", {}))
+        # int() because journals from before balances were whole coins can
+        # hold float deltas
+        record.balance += int(deltas.get("b", 0))
+        record.loan += int(deltas.get("l", 0))
+        self._changed(user_id)
+
+    def _apply(self, entry):
+        # Entries the history was written before the crash are already in it
+        seq, reason = entry["s"], entry["r"]
+        logged = self.history is not None and seq <= self.history.seq
+        if "batch" in entry:
+            for round_id, payout in entry["batch"]:
+                user_id = self.open_rounds[str(round_id)][0]
+                self._settle(str(round_id), payout)
+                if payout and not logged:
+                    self._log(seq, user_id, reason, {"b": payout})
+            return
+        if "tx" in entry:
+            for user_id, deltas in entry["tx"]:
+                self._apply_deltas(user_id, deltas)
+                if not logged:
+                    self._log(seq, user_id, reason, deltas)
+            return
+        if "o" in entry:
+            self.open_rounds[str(seq)] = [entry["u"], -entry.get("b", 0), reason]
+        if "c" in entry:
+            self.open_rounds.pop(str(entry["c"]), None)
+        self._apply_deltas(entry["u"], entry)
+        deltas = {key: entry[key] for key in ("b", "l", "i") if key in entry}
+        if deltas and not logged:
+            self._log(seq, entry["u"], reason, deltas)
+
+    def recover(self):
+        """Replay the journal on top of the last snapshot after a restart.
+
+        Stakes of game rounds that were still waiting on a payout when the bot
+        went down are refunded. Returns ``(replayed, refunded)``.
+        """
+        replayed = 0
+        if self.journal is not None:
+            for entry in self.journal.read(after=self.storage.meta.get("journal_seq", 0)):
+                self._apply(entry)
+                replayed += 1
+        refunded = 0
+        for round_id, (user_id, stake, reason) in list(self.open_rounds.items()):
+            self.close_round(round_id, stake, f"refund:{reason}")
+            refunded += 1
+        self.flush()
+        return replayed, refunded
+
+    def get(self, user_id):
+        # Hand out a copy so callers that mutate without calling update()
+        # don't change the ledger behind its back
+        return self._record(user_id).copy()
+
+    def transaction(self, *user_ids, reason):
+        """Lock ``user_ids`` and stage delta changes to them, see ``Transaction``.
+
+        Keep network calls out of the block where possible: the locks are held
+        until it exits.
+        """
+        return Transaction(self, user_ids, reason)
+
+    def adjust(self, user_id, reason, balance=0, loan=0, items=None):
+        """Apply deltas to one account straight away and return its record.
+
+        Runs without yielding to the event loop, so it is atomic on its own.
+        Use ``transaction`` when a check and the change have an await between
+        them or span several accounts.
+        """
+        user_id = str(user_id)
+        deltas = compact_deltas(balance, loan, items)
+        if deltas:
+            seq = self._append(user_id, reason, **deltas)
+            self._apply_deltas(user_id, deltas)
+            self._log(seq, user_id, reason, deltas)
+        return self._record(user_id).copy()
+
+    def apply_changes(self, changes, reason):
+        """Apply ``[[user_id, compact deltas], ...]`` as one journal entry.
+
+        Used by transactions and by bulk passes over many accounts (see
+        ``economy.py``), which then need only one snapshot for all of them.
+        """
+        if not changes:
+            return
+        if len(changes) == 1:
+            user_id, deltas = changes[0]
+            seq = self._append(user_id, reason, **deltas)
+        else:
+            seq = self._append(None, reason, tx=changes)
+        for user_id, deltas in changes:
+            self._apply_deltas(str(user_id), deltas)
+            self._log(seq, str(user_id), reason, deltas)
+
+    def open_round(self, user_id, stake, reason):
+        """Take a game stake that will be settled later by ``close_round``.
+
+        Returns the round id and the new balance.
+        """
+        user_id = str(user_id)
+        record = self._record(user_id)
+        round_id = str(self._append(user_id, reason, b=-stake, o=1))
+        record.balance -= stake
+        self.open_rounds[round_id] = [user_id, stake, reason]
+        self._changed(user_id)
+        self._log(int(round_id), user_id, reason, {"b": -stake})
+        return round_id, record.balance
+
+    def close_round(self, round_id, payout, reason):
+        """Pay out ``payout`` (0 for a loss) for a round and return the new balance."""
+        user_id = self.open_rounds[round_id][0]
+        seq = self._append(user_id, reason, b=payout, c=int(round_id))
+        balance = self._settle(round_id, payout)
+        if payout:
+            self._log(seq, user_id, reason, {"b": payout})
+        return balance
+
+    def settle_rounds(self, payouts, reason):
+        """Settle many rounds at once from ``{round_id: payout}``.
+
+        The whole batch is one journal entry, so after a crash either every
+        payout is replayed or none is and the stakes are refunded.
+        """
+        missing = [round_id for round_id in payouts if round_id not in self.open_rounds]
+        if missing:
+            raise KeyError(f"Unknown rounds: {missing}")
+        if not payouts:
+            return
+        seq = self._append(None, reason, batch=[[int(round_id), payout] for round_id, payout in payouts.items()])
+        for round_id, payout in payouts.items():
+            user_id = self.open_rounds[round_id][0]
+            self._settle(round_id, payout)
+            if payout:
+                self._log(seq, user_id, reason, {"b": payout})
+
+    def _settle(self, round_id, payout):
+        user_id, _, _ = self.open_rounds.pop(round_id)
+        record = self._record(user_id)
+        record.balance += int(payout)
+        self._changed(user_id)
+        return record.balance
+
+    def _changed(self, user_id):
+        self.mark_dirty(user_id)
+        record = self.records[user_id]
+        for observer in self.observers:
+            observer.record_changed(user_id, record)
+
+    def mark_dirty(self, user_id):
+        self.dirty.add(str(user_id))
+        if len(self.dirty) >= self.flush_threshold:
+            self._wake.set()
+
+    def _snapshot(self):
+        # Everything up to the current journal position is in these records,
+        # so rotating here lets us drop the old segments once they are stored
+        changes = {user_id: self.records[user_id].copy() for user_id in self.dirty}
+        self.dirty.clear()
+        segments = []
+        if self.journal is not None:
+            self._seq, segments = self.journal.rotate()
+        meta = {"journal_seq": self._seq, "open_rounds": dict(self.open_rounds)}
+        return changes, meta, segments
+
+    def _write(self, changes, meta):
+        try:
+            # The history catches up from the journal after the snapshot, so
+            # it has to be on disk before the snapshot moves past its entries
+            if self.history is not None:
+                self.history.flush()
+            self.storage.write(changes, meta)
+        except BaseException:
+            # Keep the records dirty so the next snapshot retries them
+            self.dirty.update(changes)
+            raise
+
+    def _compact(self, segments):
+        if self.journal is not None:
+            self.journal.compact(segments)
+
+    def flush(self):
+        """Write a snapshot synchronously. Used on startup and shutdown."""
+        if not self.dirty:
+            return
+        changes, meta, segments = self._snapshot()
+        self._write(changes, meta)
+        self._compact(segments)
+
+    async def flush_async(self):
+        async with self._flush_lock:
+            if not self.dirty:
+                return
+            # Copying the dirty records is O(dirty) and stays on the loop; the
+            # backend write happens in a worker thread
+            changes, meta, segments = self._snapshot()
+            await asyncio.to_thread(self._write, changes, meta)
+            self._compact(segments)
+
+    async def reset_balances(self, balance=DEFAULT_BALANCE):
+        await self.flush_async()
+        async with self._flush_lock:
+            # No awaits from here on: the reset and the snapshot position it is
+            # stored with must not have journal entries slip in between
+            changes, meta, segments = self._snapshot()
+            if changes:
+                self._write(changes, meta)
+            self.storage.reset_balances(balance, meta)
+            for record in self.records.values():
+                record.balance = balance
+                record.loan = 0
+            self._compact(segments)
+        for observer in self.observers:
+            observer.balances_reset(balance)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush_async()
+            except Exception as e:
+                print(f"Ledger flush failed: {e}")
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def close(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        self._task = None
+        self.flush()
+        if self.journal is not None:
+            self.journal.close()
+        if self.history is not None:
+            self.history.close()
+        self.storage.close()
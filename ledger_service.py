@@ -0,0 +1,572 @@
+"""The economy behind one async interface, in-process or over a Unix socket.
+
+``LedgerService`` owns everything that has to stay consistent across the
+whole bot: the ledger (balances, loans and items), the betting markets, the
+leaderboards, the daily economy jobs and the provably fair RNG's seeds.
+Commands only talk to it through its async methods, so the same command code
+runs in two layouts:
+
+- One process: ``main.py`` builds a ``LedgerService`` and calls it directly.
+- Sharded: ``python main.py --serve-ledger`` runs the service alone behind a
+  ``LedgerServer`` on a Unix socket, and any number of bot processes, each
+  running some of the gateway shards, use a ``LedgerClient`` with the same
+  methods. Only the service process touches storage and the journal.
+
+Discord sends all of a guild's events to one shard, so guild-local state that
+is never shared (live Mines/Doors games, reply queues) stays in the shard.
+
+Wire format: one JSON line per frame. A request frame is
+``{"calls": [[call id, method, args], ...]}`` and a response frame is
+``{"results": [[call id, {"ok": value} or {"error": message, "type": name}], ...]}``.
+Both sides put everything they send during one event loop iteration into a
+single frame, so a burst of commands costs one round trip. The service answers
+each call as soon as it finishes rather than once per request frame: a call
+waiting for a lock must not hold back the answers its own client needs to
+release that lock. Accounts travel as ``{"__account__": {"b", "l", "i"}}``.
+
+Transactions keep their locks in the service: ``tx_begin`` waits for the
+accounts' locks and returns the accounts, the client stages changes locally,
+and ``tx_commit`` applies them as one journal entry and releases the locks.
+If a shard disconnects, its open transactions are rolled back.
+"""
+import asyncio
+import heapq
+import itertools
+import json
+import os
+
+from discord.ext import tasks
+
+from account import Account
+from economy_stats import exact_totals
+from ledger import compact_deltas
+
+FRAME_LIMIT = 64 * 1024 * 1024  # longest frame either side will read
+RECONNECT_DELAY = 1.0
+# Exceptions the client re-raises as themselves; anything else is a RuntimeError
+REMOTE_ERRORS = {error.__name__: error for error in (KeyError, ValueError, RuntimeError)}
+
+
+def encode(value):
+    if isinstance(value, Account):
+        return {"__account__": value.to_dict()}
+    raise TypeError(f"Can't send {type(value).__name__} to the ledger service")
+
+
+def decode(data):
+    if "__account__" in data:
+        return Account.from_dict(data["__account__"])
+    return data
+
+
+def dump_frame(frame):
+    return (json.dumps(frame, default=encode, separators=(",", ":")) + "\n").encode()
+
+
+class FrameWriter:
+    """Sends everything added during one event loop iteration as one frame."""
+
+    def __init__(self, key, writer=None):
+        self.key = key  # "calls" or "results"
+        self.writer = writer
+        self.frames = 0
+        self.items = 0
+        self._queued = []
+
+    def add(self, item):
+        if not self._queued:
+            asyncio.get_running_loop().call_soon(self._flush)
+        self._queued.append(item)
+
+    def _flush(self):
+        queued, self._queued = self._queued, []
+        if self.writer is None or self.writer.is_closing():
+            # Whoever was waiting on these hears about the lost connection
+            return
+        self.writer.write(dump_frame({self.key: queued}))
+        self.frames += 1
+        self.items += len(queued)
+
+
+class LedgerService:
+    """The economy's state and every operation commands can run on it.
+
+    ``boards`` maps leaderboard names (``"balance"``, ``"networth"``) to
+    ``Leaderboard`` indexes attached to the ledger. Every method in ``RPC`` is
+    callable through ``LedgerServer``.
+    """
+
+    RPC = (
+        "get", "adjust", "open_round", "open_game", "close_round", "reset_balances",
+        "leaderboard", "rank", "history", "history_export",
+        "open_market", "find_market", "guild_markets", "place_bet", "lock_market", "resolve_market",
+        "run_economy", "economy_status", "economy_report", "economy_export",
+        "roll", "seeds", "rotate_seeds",
+    )
+
+    def __init__(self, ledger, markets, boards, economy, economy_run_at, stats=None, stats_interval=3600,
+                 fair=None):
+        self.ledger = ledger
+        self.markets = markets
+        self.boards = boards
+        self.economy = economy
+        self.economy_loop = tasks.loop(time=economy_run_at)(self._economy_tick)
+        # EconomyStats attached to the ledger, checked and sampled on a timer
+        self.stats = stats
+        self.stats_loop = tasks.loop(seconds=stats_interval)(self._stats_tick)
+        # FairRng; seeds and nonces must be shared by every shard a user plays on
+        self.fair = fair
+
+    async def start(self):
+        self.ledger.start()
+        if not self.economy_loop.is_running():
+            self.economy_loop.start()
+        if self.stats is not None and not self.stats_loop.is_running():
+            self.stats_loop.start()
+
+    def close(self):
+        self.economy_loop.cancel()
+        self.stats_loop.cancel()
+        self.ledger.close()
+        if self.fair is not None:
+            self.fair.close()
+
+    def transaction(self, *user_ids, reason):
+        return self.ledger.transaction(*user_ids, reason=reason)
+
+    async def get(self, user_id):
+        return self.ledger.get(user_id)
+
+    async def adjust(self, user_id, reason, balance=0, loan=0, items=None):
+        return self.ledger.adjust(user_id, reason, balance, loan, items)
+
+    async def open_round(self, user_id, stake, reason):
+        """Take a game stake: ``(round id, balance)``, or None if the balance is too low.
+
+        Checked and taken under the account lock, so a transaction on the same
+        account (from any shard) can't spend the coins in between.
+        """
+        async with self.ledger._lock_for(str(user_id)):
+            if stake > self.ledger.get(user_id).balance:
+                return None
+            return self.ledger.open_round(user_id, stake, reason)
+
+    async def open_game(self, user_id, stake, game, *params):
+        """Take the stake for a round of ``game`` and draw its outcome.
+
+        Returns ``(round id, nonce, outcome)``, or None if the balance is too
+        low. The draw happens under the same lock as the stake, so a failed
+        draw takes nothing and ``rotate_seeds`` can't reveal the seed between
+        the two.
+        """
+        async with self.ledger._lock_for(str(user_id)):
+            if stake > self.ledger.get(user_id).balance:
+                return None
+            nonce, outcome = self.fair.draw(user_id, game, *params)
+            round_id, _ = self.ledger.open_round(user_id, stake, game)
+            return round_id, nonce, outcome
+
+    async def close_round(self, round_id, payout, reason):
+        return self.ledger.close_round(round_id, payout, reason)
+
+    async def reset_balances(self, balance):
+        await self.ledger.reset_balances(balance)
+
+    async def leaderboard(self, board, page):
+        """``(page, page count, text)`` for a 1-based page, or None if the board is empty."""
+        index = self.boards[board]
+        if not len(index):
+            return None
+        page = min(max(page, 1), index.page_count())
+        return page, index.page_count(), index.render_page(page)
+
+    async def rank(self, board, user_id):
+        """``(rank, score, users ranked)`` for a user, or None if they have no account yet."""
+        index = self.boards[board]
+        position = index.rank(user_id)
+        if position is None:
+            return None
+        return position, index.scores[str(user_id)], len(index)
+
+    async def history(self, user_id, page):
+        """``(entries, page, page count)`` of a user's history, newest first, or None."""
+        if self.ledger.history is None:
+            return None
+        # A few seeks into the log, off the event loop like snapshot writes
+        return await asyncio.to_thread(self.ledger.history.page, user_id, page)
+
+    async def history_export(self, user_id):
+        if self.ledger.history is None:
+            return []
+        return await asyncio.to_thread(self.ledger.history.export, user_id)
+
+    async def open_market(self, guild_id, channel_id, reason, win_payout, lose_payout, closes_in=None,
+                          mode="fixed", rake=0):
+        return self.markets.open(
+            guild_id, channel_id, reason, win_payout, lose_payout, closes_in, mode, rake
+        ).info()
+
+    async def find_market(self, guild_id, channel_id, market_id=None):
+        """``(market info, None)`` or ``(None, reason)``, see ``MarketRegistry.find``."""
+        market, error = self.markets.find(guild_id, channel_id, market_id)
+        return (market.info() if market else None), error
+
+    async def guild_markets(self, guild_id):
+        return [market.info() for market in self.markets.in_guild(guild_id)]
+
+    async def place_bet(self, guild_id, channel_id, market_id, user_id, amount, prediction):
+        """Take a stake and place it on a market in one step.
+
+        Returns ``(market info, None)`` on success. Otherwise the error is the
+        ``find_market`` reason when there is no market, or one of
+        ``"closed"``, ``"balance"`` and ``"placed"``.
+        """
+        market, error = self.markets.find(guild_id, channel_id, market_id)
+        if market is None:
+            return None, error
+        async with self.ledger._lock_for(str(user_id)):
+            if not market.is_open():
+                error = "closed"
+            elif amount > self.ledger.get(user_id).balance:
+                error = "balance"
+            elif user_id in market.placements:
+                error = "placed"
+            if error:
+                return market.info(), error
+            # The stake stays an open round in the journal until the bet is
+            # resolved, so a restart refunds it
+            round_id, _ = self.ledger.open_round(user_id, amount, "bet")
+        market.place(user_id, amount, prediction, round_id)
+        return market.info(), None
+
+    async def lock_market(self, guild_id, channel_id, market_id=None):
+        market, error = self.markets.find(guild_id, channel_id, market_id)
+        if market is None:
+            return None, error
+        market.locked = True
+        return market.info(), None
+
+    async def resolve_market(self, guild_id, channel_id, market_id, outcome, top=10):
+        """Pay out a market and close it.
+
+        Returns ``(result, None)`` or ``(None, reason)``. The result has the
+        market's info, bettor and winner counts, totals, and the ``top``
+        biggest wins as ``[winnings, user_id]`` pairs.
+        """
+        market, error = self.markets.find(guild_id, channel_id, market_id)
+        if market is None:
+            return None, error
+        # Take the market out of the registry before paying anything out
+        self.markets.remove(market.id)
+        payouts, winners, total_staked = market.settle(outcome)
+        # One journal entry for every payout, so a crash replays all or none
+        self.ledger.settle_rounds(payouts, "resolve_bet")
+        return {
+            "market": market.info(),
+            "bettors": len(market.placements),
+            "winners": len(winners),
+            "total_staked": total_staked,
+            # Refunds included, for a pool nobody won
+            "total_paid": sum(payouts.values()),
+            "top": heapq.nlargest(top, winners),
+        }, None
+
+    async def _economy_tick(self):
+        try:
+            totals = await self.economy.run()
+        except Exception as e:
+            # Keep the loop alive; tomorrow's run will try again
+            print(f"Economy jobs failed: {e}")
+            return
+        print(f"Economy jobs changed {totals['changed']} of {totals['accounts']} accounts.")
+
+    async def _stats_tick(self):
+        # Check the running totals against a full recomputation, then sample
+        inputs, running = self.stats.check_inputs(self.economy.columns)
+        try:
+            exact = await asyncio.to_thread(exact_totals, *inputs)
+        except Exception as e:
+            print(f"Economy stats check failed: {e}")
+        else:
+            drift = self.stats.reconcile(running, exact)
+            if drift:
+                print(f"Economy stats were off and have been corrected: {drift}")
+        try:
+            self.stats.sample()
+        except OSError as e:
+            print(f"Saving economy stats failed: {e}")
+
+    async def economy_report(self, days=1):
+        return self.stats.summary(days)
+
+    async def economy_export(self):
+        return self.stats.export_csv()
+
+    async def roll(self, user_id, game, *params):
+        """Draw a game round's outcome: ``(nonce, outcome)``, see ``fairness.GAMES``."""
+        return self.fair.draw(user_id, game, *params)
+
+    async def seeds(self, user_id):
+        return self.fair.info(user_id)
+
+    async def rotate_seeds(self, user_id, client_seed=None):
+        """Reveal the server seed and start a new pair; None while the user has a round open.
+
+        A Mines or Doors outcome is drawn when the game starts, so revealing
+        the seed mid-game would give it away.
+        """
+        user_id = str(user_id)
+        async with self.ledger._lock_for(user_id):
+            if any(owner == user_id for owner, _, _ in self.ledger.open_rounds.values()):
+                return None
+            return self.fair.rotate(user_id, client_seed)
+
+    async def run_economy(self):
+        return await self.economy.run()
+
+    async def economy_status(self):
+        next_run = self.economy_loop.next_iteration
+        scheduled = f"Next scheduled run: {next_run:%Y-%m-%d %H:%M} UTC." if next_run else "The daily run isn't scheduled."
+        return f"{self.economy.summary()}\n{scheduled}"
+
+
+class LedgerServer:
+    """Serves a ``LedgerService`` to shard processes on a Unix socket."""
+
+    def __init__(self, service, path):
+        self.service = service
+        self.path = path
+        self.connections = 0
+        self.frames = 0
+        self.calls = 0
+        self._server = None
+        self._handlers = {}  # connection task -> its writer
+
+    async def start(self):
+        if os.path.exists(self.path):
+            # Left behind by a service that didn't shut down cleanly
+            os.remove(self.path)
+        self._server = await asyncio.start_unix_server(self._handle, self.path, limit=FRAME_LIMIT)
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        # Hang up on the shards and let each connection roll back and finish
+        for writer in self._handlers.values():
+            writer.close()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+
+    async def _handle(self, reader, writer):
+        self._handlers[asyncio.current_task()] = writer
+        self.connections += 1
+        replies = FrameWriter("results", writer)
+        transactions = {}
+        pending = set()
+        try:
+            while line := await reader.readline():
+                frame = json.loads(line)
+                self.frames += 1
+                self.calls += len(frame["calls"])
+                # Calls with no awaits run to completion in frame order as
+                # their tasks start; the rest (lock waits, flushes) answer
+                # whenever they finish
+                for call_id, method, args in frame["calls"]:
+                    task = asyncio.create_task(self._answer(replies, call_id, method, args, transactions))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+        except (ConnectionError, ValueError) as e:
+            print(f"Ledger client dropped: {e}")
+        finally:
+            self.connections -= 1
+            for task in list(pending):
+                task.cancel()
+            # Roll back whatever the shard left half done
+            for tx in transactions.values():
+                await tx.__aexit__(ConnectionError, None, None)
+            writer.close()
+            del self._handlers[asyncio.current_task()]
+
+    async def _answer(self, replies, call_id, method, args, transactions):
+        try:
+            if method == "tx_begin":
+                result = await self._tx_begin(transactions, *args)
+            elif method == "tx_commit":
+                result = await self._tx_commit(transactions, *args)
+            elif method == "tx_abort":
+                await transactions.pop(args[0]).__aexit__(RuntimeError, None, None)
+                result = None
+            elif method in self.service.RPC:
+                result = await getattr(self.service, method)(*args)
+            else:
+                raise ValueError(f"Unknown ledger call {method!r}")
+            replies.add([call_id, {"ok": result}])
+        except Exception as e:
+            replies.add([call_id, {"error": str(e), "type": type(e).__name__}])
+
+    async def _tx_begin(self, transactions, tx_id, user_ids, reason):
+        tx = self.service.transaction(*user_ids, reason=reason)
+        await tx.__aenter__()
+        transactions[tx_id] = tx
+        return {user_id: self.service.ledger.get(user_id) for user_id in tx.user_ids}
+
+    async def _tx_commit(self, transactions, tx_id, changes):
+        tx = transactions.pop(tx_id)
+        try:
+            for user_id, deltas in changes:
+                tx.adjust(user_id, deltas.get("b", 0), deltas.get("l", 0), deltas.get("i"))
+        except BaseException as e:
+            await tx.__aexit__(type(e), e, None)
+            raise
+        await tx.__aexit__(None, None, None)
+
+
+class RemoteTransaction:
+    """``Transaction`` for a shard: locks live in the service, changes are staged here.
+
+    ``record`` and ``balance`` read the accounts as they were when the locks
+    were taken, plus the changes staged so far.
+    """
+
+    def __init__(self, client, user_ids, reason):
+        self.client = client
+        self.user_ids = sorted({str(user_id) for user_id in user_ids})
+        self.reason = reason
+        self.tx_id = None
+        self.accounts = {}
+        self.deltas = {}
+
+    async def __aenter__(self):
+        self.tx_id = next(self.client._tx_ids)
+        self.accounts = await self.client._call("tx_begin", self.tx_id, self.user_ids, self.reason)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            await self.client._call("tx_abort", self.tx_id)
+            return
+        changes = [
+            [user_id, deltas] for user_id, staged in self.deltas.items()
+            if (deltas := compact_deltas(**staged))
+        ]
+        await self.client._call("tx_commit", self.tx_id, changes)
+
+    def _staged(self, user_id):
+        user_id = str(user_id)
+        if user_id not in self.user_ids:
+            raise ValueError(f"User {user_id} is not part of this transaction")
+        return self.deltas.setdefault(user_id, {"balance": 0, "loan": 0, "items": {}})
+
+    def record(self, user_id):
+        staged = self._staged(user_id)
+        account = self.accounts[str(user_id)].copy()
+        account.balance += staged["balance"]
+        account.loan += staged["loan"]
+        for item, count in staged["items"].items():
+            account.items[item] = account.items.get(item, 0) + count
+            if not account.items[item]:
+                del account.items[item]
+        return account
+
+    def balance(self, user_id):
+        return self.accounts[str(user_id)].balance + self._staged(user_id)["balance"]
+
+    def adjust(self, user_id, balance=0, loan=0, items=None):
+        staged = self._staged(user_id)
+        staged["balance"] += balance
+        staged["loan"] += loan
+        for item, count in (items or {}).items():
+            staged["items"][item] = staged["items"].get(item, 0) + count
+
+
+class LedgerClient:
+    """The ``LedgerService`` methods for a shard, run by the service over the socket.
+
+    Calls made in the same event loop iteration go out as one frame. The
+    connection is re-established in the background if the service restarts;
+    calls made while it is down raise ``ConnectionError``.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._requests = FrameWriter("calls")
+        self._waiting = {}
+        self._call_ids = itertools.count(1)
+        self._tx_ids = itertools.count(1)
+        self._connected = asyncio.Event()
+        self._task = None
+
+    @property
+    def frames(self):
+        return self._requests.frames
+
+    @property
+    def calls(self):
+        return self._requests.items
+
+    def __getattr__(self, method):
+        if method not in LedgerService.RPC:
+            raise AttributeError(method)
+
+        async def call(*args):
+            return await self._call(method, *args)
+        return call
+
+    async def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        await self._connected.wait()
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def transaction(self, *user_ids, reason):
+        return RemoteTransaction(self, user_ids, reason)
+
+    def _call(self, method, *args):
+        if self._requests.writer is None:
+            raise ConnectionError("Not connected to the ledger service")
+        call_id = next(self._call_ids)
+        future = self._waiting[call_id] = asyncio.get_running_loop().create_future()
+        self._requests.add([call_id, method, args])
+        return future
+
+    def _receive(self, frame):
+        for call_id, result in frame["results"]:
+            future = self._waiting.pop(call_id, None)
+            if future is None or future.done():
+                continue
+            if "error" in result:
+                future.set_exception(REMOTE_ERRORS.get(result["type"], RuntimeError)(result["error"]))
+            else:
+                future.set_result(result["ok"])
+
+    def _fail_waiting(self):
+        error = ConnectionError("Lost the connection to the ledger service")
+        for future in self._waiting.values():
+            if not future.done():
+                future.set_exception(error)
+        self._waiting.clear()
+
+    async def _run(self):
+        while True:
+            try:
+                reader, self._requests.writer = await asyncio.open_unix_connection(self.path, limit=FRAME_LIMIT)
+            except OSError as e:
+                print(f"Couldn't reach the ledger service at {self.path}: {e}")
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+            self._connected.set()
+            try:
+                while line := await reader.readline():
+                    self._receive(json.loads(line, object_hook=decode))
+            except (ConnectionError, ValueError) as e:
+                print(f"Ledger service connection failed: {e}")
+            finally:
+                self._connected.clear()
+                self._requests.writer.close()
+                self._requests.writer = None
+                self._fail_waiting()
+            await asyncio.sleep(RECONNECT_DELAY)
@@ -1,666 +1,1213 @@
 import discord
+from discord import app_commands
 from discord.ext import commands
 from discord.ext.commands import has_permissions
-import random
+import asyncio
+import datetime
+import io
 import json
 import os
+import signal
+import sys
+import time
+
+import catalog
+from economy import AccountColumns, EconomyJobs
+from economy_stats import EconomyStats
+import fairness
+import history
+from games import MINES_TILES, RPS_CHOICES, SLOTS_MULTIPLIER, DoorsView, MinesView
+from journal import Journal
+from leaderboard import Leaderboard, NetWorthLeaderboard
+from ledger import Ledger
+from ledger_service import LedgerClient, LedgerServer, LedgerService
+from markets import MarketRegistry
+from metrics import MetricsServer, Registry
+from outbox import LiveMessages, Outbox, split_content
+from profiler import CommandProfiler, LagMonitor, hotspots
+from sessions import SessionManager
+from storage import open_storage
+from throttle import Throttle, Throttled
+
+# Deployment. By default one process runs the whole bot. For big bots, run
+# `python main.py --serve-ledger` once, then start any number of bot processes
+# with BOT_LEDGER_SOCKET pointing at its socket and BOT_SHARD_COUNT /
+# BOT_SHARD_IDS choosing the gateway shards each one runs
+LEDGER_SOCKET = os.environ.get("BOT_LEDGER_SOCKET")
+SERVE_LEDGER = "--serve-ledger" in sys.argv
+SHARD_COUNT = os.environ.get("BOT_SHARD_COUNT")
+SHARD_IDS = os.environ.get("BOT_SHARD_IDS")  # e.g. "0,1"; all shards when unset
+# Every command is also a slash command. Registering them with Discord is rate
+# limited, so set BOT_SYNC_COMMANDS=1 (in one process) only when they change.
+# BOT_MINIMAL_INTENTS=1 drops message events altogether: the gateway stops
+# sending every message in every channel, and only slash commands work
+SYNC_COMMANDS = os.environ.get("BOT_SYNC_COMMANDS") == "1"
+MINIMAL_INTENTS = os.environ.get("BOT_MINIMAL_INTENTS") == "1"
 
 # Bot setup
-intents = discord.Intents.default()
-intents.message_content = True
-bot = commands.Bot(command_prefix='!', intents=intents)
-current_bet = None
-DATA_FILE = "user_data.json"
-
-# Load and save user data
-def load_data():
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, "r") as file:
-            return json.load(file)
-    return {}
-
-def save_data(data):
-    with open(DATA_FILE, "w") as file:
-        json.dump(data, file)
-
-def get_user_data(user_id):
-    data = load_data()
-    user_id_str = str(user_id)
-    
-    # Ensure user data exists with default values
-    if user_id_str not in data:
-        data[user_id_str] = {"balance": 1000, "loan": 0}
-    
-    # Ensure all keys are present in the user's data
-    if "items" not in data[user_id_str]:
-        data[user_id_str]["items"] = []
-    
-    # Save any changes back to ensure defaults are persisted
-    save_data(data)
-    
-    return data[user_id_str]
+if MINIMAL_INTENTS:
+    intents = discord.Intents.none()
+    intents.guilds = True
+else:
+    intents = discord.Intents.default()
+    intents.message_content = True
+if SHARD_COUNT:
+    bot = commands.AutoShardedBot(
+        command_prefix='!', intents=intents, shard_count=int(SHARD_COUNT),
+        shard_ids=[int(shard) for shard in SHARD_IDS.split(",")] if SHARD_IDS else None,
+    )
+else:
+    bot = commands.Bot(command_prefix='!', intents=intents)
+# "json" for small servers, "sqlite" or "snapshot" for large ones
+STORAGE_BACKEND = os.environ.get("BOT_STORAGE_BACKEND", "json")
+STORAGE_FILES = {"json": "user_data.json", "sqlite": "user_data.db", "snapshot": "user_data.snap"}
+JOURNAL_DIR = "journal"
+HISTORY_DIR = "history"
+HISTORY_PAGE_SIZE = 10
+HISTORY_KEEP = 1000  # newest entries kept per user
+HISTORY_RETENTION_DAYS = 90  # entries older than this are dropped; 0 keeps them forever
+JOURNAL_FSYNC = False  # fsync every journal append; survives power loss, not just crashes
+FLUSH_INTERVAL = 30.0  # seconds between snapshots; the journal covers everything in between
+FLUSH_THRESHOLD = 500  # snapshot early once this many records are waiting
+LEADERBOARD_PAGE_SIZE = 10
+TOP_WINNERS_SHOWN = 10
+POOL_RAKE = 5  # percent of every pool bet the house keeps; 0 for none
+ODDS_INTERVAL = 3.0  # seconds between edits of a pool bet's odds message
+MESSAGE_LIMIT = 2000  # Discord's maximum message length
+AUTOCOMPLETE_LIMIT = 25  # Discord shows at most this many suggestions
+# Token buckets per command, as (commands per second, burst). "user" limits
+# each user and "guild" each server; commands not listed use THROTTLE_DEFAULT
+THROTTLE_LIMITS = {
+    "strip": {"user": (0.2, 3), "guild": (5, 50)},
+    "slots": {"user": (1, 5), "guild": (20, 100)},
+    "rps": {"user": (1, 5), "guild": (20, 100)},
+    "mines": {"user": (0.5, 3), "guild": (10, 50)},
+    "doors": {"user": (0.5, 3), "guild": (10, 50)},
+}
+THROTTLE_DEFAULT = {"user": (2, 10), "guild": (50, 200)}
+THROTTLE_CAPACITY = 100000  # buckets kept; the least recently used go first
+OUTBOX_WINDOW = 0.25  # seconds to gather a burst of replies into one message
+METRICS_HOST = "127.0.0.1"
+# Prometheus scrapes /metrics here; 0 turns it off. Give every process its own
+METRICS_PORT = int(os.environ.get("BOT_METRICS_PORT", 9100))
+PROFILE_DIR = "profiles"  # where !profile stop saves .prof files
+PROFILE_TOP = 15  # functions listed in the !profile report
+LAG_INTERVAL = 0.1  # seconds between event loop lag checks
+LAG_THRESHOLD = 0.1  # lag that counts as a stall
+# Daily economy jobs, run in one pass over every account. Rates are in basis
+# points (1/100 of a percent); 0 turns a job off
+ECONOMY_RUN_AT = datetime.time(hour=0, tzinfo=datetime.timezone.utc)
+LOAN_INTEREST = 500  # debts grow 5% a day
+DEFAULT_RATIO = 3  # debt over 3x balance plus items is a default; the balance is seized
+WEALTH_TAX = 10  # 0.1% a day of net worth above WEALTH_TAX_THRESHOLD
+WEALTH_TAX_THRESHOLD = 1000000
+STIPEND = 100  # paid daily to every balance under STIPEND_BELOW
+STIPEND_BELOW = 1000
+# !economy statistics are kept up to date on every change. Every
+# STATS_INTERVAL seconds they are checked against a full recomputation and a
+# point is added to a ring buffer of the last STATS_SAMPLES points
+STATS_FILE = "economy_stats.json"
+STATS_INTERVAL = 60 * 60
+STATS_SAMPLES = 24 * 30
+# Game outcomes come from per-user server/client seeds and nonces (see
+# fairness.py). BOT_RNG_SEED makes every outcome repeatable, for tests and
+# benchmarks only
+FAIRNESS_FILE = "fairness.log"
+FAIR_BATCH = 64  # nonces reserved per line written to FAIRNESS_FILE
+FAIR_AHEAD = 8  # rounds per user computed ahead of demand
+RNG_SEED = os.environ.get("BOT_RNG_SEED")
+
+# Prometheus metrics. Per-command numbers come from the invoke hooks below;
+# everything else is read from where it already lives at scrape time
+metrics = Registry()
+
+if LEDGER_SOCKET and not SERVE_LEDGER:
+    # A shard process: balances, markets and leaderboards live in the ledger
+    # service, which exports its own metrics
+    bank = LedgerClient(LEDGER_SOCKET)
+    metrics.counter_from("bot_ledger_client_frames_total", "Frames sent to the ledger service.", lambda: bank.frames)
+    metrics.counter_from("bot_ledger_client_calls_total", "Calls sent to the ledger service.", lambda: bank.calls)
+else:
+    storage = open_storage(STORAGE_BACKEND, STORAGE_FILES.get(STORAGE_BACKEND))
+    journal = Journal(JOURNAL_DIR, fsync=JOURNAL_FSYNC)
+    transactions = history.History(
+        HISTORY_DIR, page_size=HISTORY_PAGE_SIZE, keep=HISTORY_KEEP, retention_days=HISTORY_RETENTION_DAYS
+    )
+    ledger = Ledger(
+        storage, journal, flush_interval=FLUSH_INTERVAL, flush_threshold=FLUSH_THRESHOLD, history=transactions
+    )
 
+    # Replay anything the last run journaled but never snapshotted
+    replayed, refunded = ledger.recover()
+    if replayed or refunded:
+        print(f"Recovered {replayed} journal entries and refunded {refunded} unfinished game rounds.")
+
+    # Every open bet, keyed by guild/channel and bet number
+    markets = MarketRegistry()
+
+    # Rank indexes kept current by the ledger, so the leaderboards never re-sort
+    accounts = storage.iter_accounts()
+    leaderboard_index = Leaderboard(page_size=LEADERBOARD_PAGE_SIZE)
+    leaderboard_index.load(accounts)
+    networth_index = NetWorthLeaderboard(page_size=LEADERBOARD_PAGE_SIZE)
+    networth_index.load(accounts)
+    # The same accounts as NumPy columns, for the scheduled economy jobs
+    account_columns = AccountColumns()
+    account_columns.load(accounts)
+    # Supply, debt, inequality and item ownership for !economy
+    economy_stats = EconomyStats(STATS_FILE, samples=STATS_SAMPLES, flows=ledger.flows)
+    economy_stats.load(accounts, storage.iter_items())
+    ledger.observers.extend([leaderboard_index, networth_index, account_columns, economy_stats])
+    del accounts
+    economy_jobs = EconomyJobs(
+        ledger, account_columns,
+        interest_rate=LOAN_INTEREST, default_ratio=DEFAULT_RATIO, tax_rate=WEALTH_TAX,
+        tax_threshold=WEALTH_TAX_THRESHOLD, stipend=STIPEND, stipend_below=STIPEND_BELOW,
+    )
+    bank = LedgerService(
+        ledger, markets, {"balance": leaderboard_index, "networth": networth_index},
+        economy_jobs, ECONOMY_RUN_AT, economy_stats, STATS_INTERVAL,
+        fairness.FairRng(FAIRNESS_FILE, batch=FAIR_BATCH, ahead=FAIR_AHEAD, seed=RNG_SEED),
+    )
 
-def update_user_data(user_id, balance=None, loan=None, items=None):
-    data = load_data()
-    user_id_str = str(user_id)
-    
-    # Ensure user data exists
-    if user_id_str not in data:
-        data[user_id_str] = {"balance": 1000, "loan": 0}
-    
-    # Update balance and loan if provided
-    if balance is not None:
-        data[user_id_str]["balance"] = balance
-    if loan is not None:
-        data[user_id_str]["loan"] = loan
-    
-    # Update items if provided
-    if items is not None:
-        # Ensure "items" is initialized as a list if it doesn't exist
-        if "items" not in data[user_id_str]:
-            data[user_id_str]["items"] = []
-        data[user_id_str]["items"] = items
-    
-    # Save the updated data
-    save_data(data)
+    for stat, help in [
+        ("read_bytes", "Bytes read from storage."),
+        ("write_bytes", "Bytes written to storage (payload bytes for SQLite)."),
+        ("writes", "Snapshot writes to storage."),
+        ("rewrites", "Storage writes that rewrote the whole data file."),
+    ]:
+        metrics.counter_from(f"bot_storage_{stat}_total", help, lambda stat=stat: {STORAGE_BACKEND: storage.stats[stat]}, ["backend"])
+    metrics.counter_from("bot_journal_write_bytes_total", "Bytes appended to the journal.", lambda: journal.bytes_written)
+    metrics.counter_from("bot_history_write_bytes_total", "Bytes appended to the transaction history.",
+                         lambda: transactions.bytes_written)
+    metrics.gauge("bot_history_bytes", "Size of the transaction history log.", lambda: transactions.size)
+    metrics.counter_from("bot_history_compactions_total", "Transaction history compactions.",
+                         lambda: transactions.compactions)
+    metrics.gauge("bot_ledger_dirty_records", "Records changed since the last snapshot.", lambda: len(ledger.dirty))
+    metrics.gauge("bot_ledger_cached_records", "Records held in memory by the ledger.", lambda: len(ledger.records))
+    metrics.gauge("bot_active_markets", "Bets that are open or locked but not resolved.", lambda: len(markets))
+    metrics.gauge("bot_pending_bet_placements", "Bets placed on markets that are not resolved yet.", markets.pending_placements)
+    metrics.counter_from("bot_economy_runs_total", "Scheduled economy passes run.", lambda: economy_jobs.runs)
+    metrics.gauge(
+        "bot_economy_last_run_seconds", "Duration of the last economy pass.",
+        lambda: {
+            stage: economy_jobs.last_run[1].get(f"{stage}_seconds", 0) if economy_jobs.last_run else 0
+            for stage in ("pass", "apply", "write")
+        }, ["stage"],
+    )
+    metrics.counter_from("bot_fair_rounds_total", "Game rounds drawn from the fair RNG.", lambda: bank.fair.rounds)
+    metrics.counter_from("bot_fair_reservations_total", "Batches of nonces reserved in the fairness log.",
+                         lambda: bank.fair.reservations)
+    metrics.gauge("bot_coin_supply", "Coins in every balance combined.", lambda: economy_stats.supply)
+    metrics.gauge("bot_outstanding_debt", "Coins owed on loans.", lambda: economy_stats.debt)
+    metrics.gauge("bot_balance_gini", "Gini coefficient of the balances.", economy_stats.gini)
+    metrics.counter_from("bot_economy_stats_corrections_total",
+                         "Running economy totals the consistency check found off and corrected.",
+                         lambda: economy_stats.corrections)
+
+# Outbound replies, queued and coalesced per channel
+outbox = Outbox(window=OUTBOX_WINDOW, limit=MESSAGE_LIMIT)
+
+# Pool bets' odds messages, edited at most once per ODDS_INTERVAL
+odds_boards = LiveMessages(interval=ODDS_INTERVAL)
+
+# Live Mines/Doors games by message id, with one shared timeout wheel
+sessions = SessionManager()
+
+command_invocations = metrics.counter("bot_command_invocations_total", "Commands invoked.", ["command"])
+command_errors = metrics.counter("bot_command_errors_total", "Commands that raised an error.", ["command"])
+command_latency = metrics.histogram(
+    "bot_command_latency_seconds", "Time from a command starting until it returned, replies included.", ["command"]
+)
+metrics.gauge("bot_active_sessions", "Mines and Doors games in progress.", lambda: len(sessions))
+metrics.counter_from("bot_odds_updates_total", "Pool bet changes that needed the odds message updated.",
+                     lambda: odds_boards.updates)
+metrics.counter_from("bot_odds_edits_total", "Edits of pool bet odds messages.", lambda: odds_boards.edits)
+metrics.gauge("bot_outbox_depth", "Replies waiting to be sent.", outbox.depth)
+metrics.counter_from("bot_outbox_replies_total", "Replies queued in the outbox.", lambda: outbox.queued)
+metrics.counter_from("bot_outbox_messages_total", "Messages the outbox sent.", lambda: outbox.sent)
+metrics.gauge(
+    "bot_outbox_latency_seconds", "Recent time from queueing a reply to Discord accepting it.",
+    lambda: {"0.5": outbox.latency_percentile(50), "0.99": outbox.latency_percentile(99)}, ["quantile"],
+)
+
+# Spam protection, checked before a command touches the ledger
+throttle = Throttle(THROTTLE_LIMITS, THROTTLE_DEFAULT, THROTTLE_CAPACITY)
+metrics.counter_from(
+    "bot_throttled_total", "Commands rejected by a rate limit.", lambda: throttle.hits, ["command", "scope"]
+)
+metrics.gauge("bot_throttle_buckets", "Rate limit buckets held in memory.", lambda: len(throttle))
+
+# cProfile around chosen commands on demand, and a watchdog on event loop lag
+profiler = CommandProfiler(PROFILE_DIR)
+lag_monitor = LagMonitor(interval=LAG_INTERVAL, threshold=LAG_THRESHOLD)
+metrics.gauge(
+    "bot_event_loop_lag_seconds", "Recent event loop lag.",
+    lambda: {"0.5": lag_monitor.percentile(50), "0.99": lag_monitor.percentile(99)}, ["quantile"],
+)
+metrics.counter_from("bot_event_loop_stalls_total", "Times the event loop was blocked past the threshold.",
+                     lambda: lag_monitor.stall_count)
+metrics_server = MetricsServer(metrics, METRICS_HOST, METRICS_PORT)
+
+# Read user data through the ledger service. Changes go through
+# bank.adjust or bank.transaction so they apply as deltas
+async def get_user_data(user_id):
+    return await bank.get(user_id)
+
+
+# Replies go through the per-channel outbox, which batches bursts into fewer
+# messages and splits anything over Discord's length limit. Slash commands
+# answer their interaction instead; the first piece is the response and the
+# rest are followups
+async def reply(ctx, content):
+    if ctx.interaction is None:
+        return await outbox.post(ctx.channel, content)
+    for piece in split_content(content, MESSAGE_LIMIT):
+        message = await ctx.send(piece)
+    return message
+
+
+# Time every command and count the ones that fail
+@bot.before_invoke
+async def start_command_timer(ctx):
+    name = ctx.command.qualified_name
+    lag_monitor.command_started(name)
+    ctx.profiled = profiler.command_started(name)
+    ctx.started_at = time.perf_counter()
+    # Discord drops interactions that aren't answered within 3 seconds, so
+    # slow commands acknowledge theirs up front
+    if ctx.interaction is not None and ctx.command.extras.get("defer"):
+        await ctx.defer()
+
+
+@bot.after_invoke
+async def record_command(ctx):
+    name = ctx.command.qualified_name
+    profiler.command_finished(getattr(ctx, "profiled", None))
+    lag_monitor.command_finished(name)
+    command_invocations.inc(command=name)
+    if ctx.command_failed:
+        command_errors.inc(command=name)
+    command_latency.observe(time.perf_counter() - ctx.started_at, command=name)
+
+
+@bot.check
+async def throttle_check(ctx):
+    # Global checks run before argument conversion and before_invoke
+    throttle.check(ctx.command.qualified_name, ctx.author.id, ctx.guild.id if ctx.guild else None)
+    return True
+
+
+@bot.event
+async def on_command_error(ctx, error):
+    if isinstance(error, Throttled):
+        if ctx.interaction is not None:
+            # Interactions are always answered, even past the first rejection;
+            # the reply is only visible to the user, so it can't spam a channel
+            await ctx.interaction.response.send_message(str(error), ephemeral=True)
+        elif error.notify:
+            await reply(ctx, f"{ctx.author.mention} {error}")
+        return
+    # A slash command that fails a check or gets bad input still has to
+    # answer its interaction, or Discord shows "The application did not respond"
+    if ctx.interaction is not None and isinstance(error, (commands.CheckFailure, commands.UserInputError)):
+        if ctx.interaction.response.is_done():
+            await ctx.interaction.followup.send(str(error), ephemeral=True)
+        else:
+            await ctx.interaction.response.send_message(str(error), ephemeral=True)
+        return
+    await commands.Bot.on_command_error(bot, ctx, error)
+
+
+@bot.event
+async def setup_hook():
+    # Runs once per process, after logging in and before connecting
+    if SYNC_COMMANDS:
+        synced = await bot.tree.sync()
+        print(f"Registered {len(synced)} slash commands.")
 
 
 # Bot commands
 @bot.event
 async def on_ready():
+    # Starts the ledger's snapshots and the daily economy jobs, or connects
+    # to the ledger service in a shard process
+    await bank.start()
+    sessions.start()
+    lag_monitor.start()
+    if METRICS_PORT:
+        try:
+            await metrics_server.start()
+        except OSError as e:
+            print(f"Couldn't serve metrics on {METRICS_HOST}:{METRICS_PORT}: {e}")
     print(f"{bot.user} has connected to Discord!")
 
-@bot.command(name="balance", help="Check your balance.")
+@bot.hybrid_command(name="balance", help="Check your balance.")
 async def balance(ctx):
-    user_data = get_user_data(ctx.author.id)
-    await ctx.send(
-        f"{ctx.author.mention}, your balance is {user_data['balance']} coins. "
-        f"Debt: {user_data['loan']} coins."
+    user_data = await get_user_data(ctx.author.id)
+    await reply(
+        ctx,
+        f"{ctx.author.mention}, your balance is {user_data.balance} coins. "
+        f"Debt: {user_data.loan} coins."
     )
-@bot.command(name="loan", help="Apply for a loan.")
+@bot.hybrid_command(name="loan", help="Apply for a loan.")
+@app_commands.describe(amount="Coins to borrow")
 async def loan(ctx, amount: int):
-    user_data = get_user_data(ctx.author.id)
-    item_prices = {
-        "Rolex": 5000,
-        "Lambo": 130000,
-        "Porsche": 100000,
-        "Apartment": 200000,
-        "Penthouse": 1000000,
-        "JetSki": 15000,
-        "PrivateIsland": 5000000,
-        "Helicopter": 800000,
-        "Superyacht": 7500000,
-        "Diamond Ring": 10000,
-        "SpaceShuttle": 20000000,
-        "Hooker": 50000,
-        "SecurityTeam": 9000000,
-        "PrivateJet": 3000000,
-        "Castle": 15000000
-    }
-
-    # Check if the user already has a loan
-    if user_data["loan"] > 0:
-        await ctx.send(f"{ctx.author.mention}, you must repay your current loan first!")
-        return
-
-    # Get user balance and assets
-    balance = user_data.get("balance", 0)
-    assets_value = sum(item_prices.get(item, 0) for item in user_data.get("items", []))  # Calculate total asset value
-
-    # Determine maximum loan amount
-    max_loan = max(5000, assets_value) if balance < 5000 else assets_value
-    if amount > max_loan:
-        await ctx.send(f"{ctx.author.mention}, you can only take a loan up to {max_loan} coins.")
-        return
-
-    # Update balance and loan with 100% interest
-    user_data["balance"] += amount
-    user_data["loan"] = amount * 2  # 100% interest
-    update_user_data(ctx.author.id, user_data["balance"], user_data["loan"])
-
-    await ctx.send(f"{ctx.author.mention}, loan approved! Balance: {user_data['balance']}, Debt: {user_data['loan']}.")
-
-
-@bot.command(name="repay", help="Repay your loan.")
+    # Replies go out after the block, so the account isn't locked while they send
+    async with bank.transaction(ctx.author.id, reason="loan") as tx:
+        user_data = tx.record(ctx.author.id)
+
+        # Get user balance and assets. The asset value is kept up to date as
+        # items are bought and sold, so there is nothing to add up here
+        balance = user_data.balance
+        assets_value = user_data.assets
+
+        # Determine maximum loan amount
+        max_loan = max(5000, assets_value) if balance < 5000 else assets_value
+
+        # Check if the user already has a loan
+        if user_data.loan > 0:
+            message = f"{ctx.author.mention}, you must repay your current loan first!"
+        elif amount > max_loan:
+            message = f"{ctx.author.mention}, you can only take a loan up to {max_loan} coins."
+        else:
+            # Interest is added to the debt by the daily economy jobs
+            tx.adjust(ctx.author.id, balance=amount, loan=amount)
+            user_data = tx.record(ctx.author.id)
+            message = f"{ctx.author.mention}, loan approved! Balance: {user_data.balance}, Debt: {user_data.loan}."
+
+    await reply(ctx, message)
+
+
+@bot.hybrid_command(name="repay", help="Repay your loan.")
+@app_commands.describe(amount="Coins to pay back")
 async def repay(ctx, amount: int):
-    user_data = get_user_data(ctx.author.id)
-    if user_data["loan"] == 0:
-        await ctx.send(f"{ctx.author.mention}, you have no loans to repay.")
-        return
-    if amount > user_data["balance"]:
-        await ctx.send(f"{ctx.author.mention}, you don't have enough coins!")
-        return
-    repayment = min(amount, user_data["loan"])
-    user_data["balance"] -= repayment
-    user_data["loan"] -= repayment
-    update_user_data(ctx.author.id, user_data["balance"], user_data["loan"])
-    await ctx.send(f"{ctx.author.mention}, you repaid {repayment} coins. Debt remaining: {user_data['loan']}.")
-
-@bot.command(name="leaderboard", help="Show the leaderboard.")
-async def leaderboard(ctx):
-    data = load_data()
-    
-    if not data:
-        await ctx.send("No data available to display on the leaderboard.")
+    async with bank.transaction(ctx.author.id, reason="repay") as tx:
+        user_data = tx.record(ctx.author.id)
+        if user_data.loan == 0:
+            message = f"{ctx.author.mention}, you have no loans to repay."
+        elif amount > user_data.balance:
+            message = f"{ctx.author.mention}, you don't have enough coins!"
+        else:
+            repayment = min(amount, user_data.loan)
+            tx.adjust(ctx.author.id, balance=-repayment, loan=-repayment)
+            user_data = tx.record(ctx.author.id)
+            message = f"{ctx.author.mention}, you repaid {repayment} coins. Debt remaining: {user_data.loan}."
+    await reply(ctx, message)
+
+@bot.hybrid_command(name="leaderboard", description="Show the leaderboard.", help="Show the leaderboard. Usage: !leaderboard [page]")
+async def leaderboard(ctx, page: int = 1):
+    # Pages come from the rank index and stay cached until a rank on them changes
+    found = await bank.leaderboard("balance", page)
+    if found is None:
+        await reply(ctx, "No users with balances found.")
         return
-    
-    # Sort users by balance in descending order
-    leaderboard = sorted(data.items(), key=lambda x: x[1]["balance"], reverse=True)
-    
-    if not leaderboard:
-        await ctx.send("No users with balances found.")
+    page, pages, text = found
+    await reply(ctx, f"**Leaderboard** (page {page}/{pages})\n{text}")
+
+
+@bot.hybrid_command(name="rank", help="Show your rank on the leaderboard.")
+@app_commands.describe(member="Whose rank to show; yours if left out")
+async def rank(ctx, member: discord.User = None):
+    member = member or ctx.author
+    found = await bank.rank("balance", member.id)
+    if found is None:
+        await reply(ctx, f"{member.mention} isn't on the leaderboard yet.")
         return
-    
-    leaderboard_msg = "**Leaderboard**\n"
-    for user_id, info in leaderboard:
-        debt = info.get("loan", 0)  # Default to 0 if 'loan' is not found
-        balance = info.get("balance", 0)  # Default to 0 if 'balance' is not found
-        leaderboard_msg += f"<@{user_id}>: {balance} coins (Debt: {debt})\n"
-    
-    await ctx.send(leaderboard_msg)
+    position, balance, ranked = found
+    await reply(ctx, f"{member.mention} is ranked #{position} of {ranked} with {balance} coins.")
+
+
+@bot.hybrid_command(
+    name="networth", description="Show the net worth leaderboard: balance plus items minus debt.",
+    help="Show the net worth leaderboard: balance plus items minus debt. Usage: !networth [page]",
+)
+async def networth(ctx, page: int = 1):
+    # Both lookups go to the ledger service in the same frame
+    found, position = await asyncio.gather(
+        bank.leaderboard("networth", page), bank.rank("networth", ctx.author.id)
+    )
+    if found is None:
+        await reply(ctx, "No users with balances found.")
+        return
+    page, pages, text = found
+    message = f"**Net Worth Leaderboard** (page {page}/{pages})\n{text}"
+    if position is not None:
+        message += f"\nYou are #{position[0]} with {position[1]} coins."
+    await reply(ctx, message)
 
 
-@bot.command(name="rps", help="Play Rock, Paper, Scissors.")
+@bot.hybrid_command(name="rps", help="Play Rock, Paper, Scissors.")
+@app_commands.describe(bet="Coins to bet", choice="rock, paper or scissors")
 async def rps(ctx, bet: int, choice: str):
-    user_data = get_user_data(ctx.author.id)
-    if bet > user_data["balance"]:
-        await ctx.send(f"{ctx.author.mention}, you don't have enough coins to bet.")
-        return
-    choices = ["rock", "paper", "scissors"]
-    if choice not in choices:
-        await ctx.send(f"{ctx.author.mention}, choose rock, paper, or scissors.")
-        return
-    bot_choice = random.choice(choices)
-    user_data["balance"] -= bet
-    result = "lose"
-    if (choice == "rock" and bot_choice == "scissors") or \
-       (choice == "paper" and bot_choice == "rock") or \
-       (choice == "scissors" and bot_choice == "paper"):
-        user_data["balance"] += bet * 2
-        result = "win"
-    elif choice == bot_choice:
-        user_data["balance"] += bet  # Tie, refund the bet
-        result = "tie"
-    update_user_data(ctx.author.id, user_data["balance"])
-    await ctx.send(
+    if choice not in RPS_CHOICES:
+        await reply(ctx, f"{ctx.author.mention}, choose rock, paper, or scissors.")
+        return
+    async with bank.transaction(ctx.author.id, reason="rps") as tx:
+        broke = bet > tx.balance(ctx.author.id)
+        if not broke:
+            nonce, bot_choice = await bank.roll(ctx.author.id, "rps")
+            tx.adjust(ctx.author.id, balance=-bet)
+            result = "lose"
+            if (choice == "rock" and bot_choice == "scissors") or \
+               (choice == "paper" and bot_choice == "rock") or \
+               (choice == "scissors" and bot_choice == "paper"):
+                tx.adjust(ctx.author.id, balance=bet * 2)
+                result = "win"
+            elif choice == bot_choice:
+                tx.adjust(ctx.author.id, balance=bet)  # Tie, refund the bet
+                result = "tie"
+            user_data = tx.record(ctx.author.id)
+    # Replies go out after the block, so the account isn't locked while they send
+    if broke:
+        await reply(ctx, f"{ctx.author.mention}, you don't have enough coins to bet.")
+        return
+    await reply(
+        ctx,
         f"{ctx.author.mention}, you chose {choice}, I chose {bot_choice}. You {result}! "
-        f"New balance: {user_data['balance']} coins."
+        f"New balance: {user_data.balance} coins. (round {nonce})"
     )
 
-@bot.command(name="slots", help="Play the slot machine.")
+@bot.hybrid_command(name="slots", help="Play the slot machine.")
+@app_commands.describe(bet="Coins to bet")
 async def slots(ctx, bet: int):
-    user_data = get_user_data(ctx.author.id)
-    if bet > user_data["balance"]:
-        await ctx.send(f"{ctx.author.mention}, you don't have enough coins.")
-        return
-    user_data["balance"] -= bet
-    spin = [random.choice(["🍒", "🍋", "🔔", "🍀", "🍉"]) for _ in range(3)]
-    if len(set(spin)) == 1:
-        winnings = bet * 3
-        user_data["balance"] += winnings
-        result = f"You won {winnings} coins!"
-    else:
-        result = "You lost!"
-    update_user_data(ctx.author.id, user_data["balance"])
-    await ctx.send(f"{ctx.author.mention}, {' | '.join(spin)} - {result} Balance: {user_data['balance']} coins.")
+    async with bank.transaction(ctx.author.id, reason="slots") as tx:
+        broke = bet > tx.balance(ctx.author.id)
+        if not broke:
+            tx.adjust(ctx.author.id, balance=-bet)
+            nonce, spin = await bank.roll(ctx.author.id, "slots")
+            if len(set(spin)) == 1:
+                winnings = bet * SLOTS_MULTIPLIER
+                tx.adjust(ctx.author.id, balance=winnings)
+                result = f"You won {winnings} coins!"
+            else:
+                result = "You lost!"
+            user_data = tx.record(ctx.author.id)
+    if broke:
+        await reply(ctx, f"{ctx.author.mention}, you don't have enough coins.")
+        return
+    await reply(ctx, f"{ctx.author.mention}, {' | '.join(spin)} - {result} Balance: {user_data.balance} coins. (round {nonce})")
 
-@bot.command(name="reset_balances", help="Reset all balances. (Admins only)")
+@bot.hybrid_command(name="reset_balances", help="Reset all balances. (Admins only)", extras={"defer": True})
 @has_permissions(administrator=True)
+@app_commands.default_permissions(administrator=True)
 async def reset_balances(ctx):
-    data = load_data()
-    for user_id in data:
-        data[user_id]["balance"] = 1000
-        data[user_id]["loan"] = 0
-    save_data(data)
-    await ctx.send("All balances have been reset.")
+    await bank.reset_balances(1000)
+    await reply(ctx, "All balances have been reset.")
     
+def guild_key(ctx):
+    # DMs have no guild; their markets all live under 0
+    return ctx.guild.id if ctx.guild else 0
+
 # Command to start a new bet with separate payouts for win/lose
-@bot.command(name='start_bet', help='Start a new bet. (Admins only)')
+@bot.hybrid_command(
+    name='start_bet', description='Start a new bet. (Admins only)',
+    help='Start a new bet. (Admins only) Usage: !start_bet <reason> <win_payout> <lose_payout> [minutes open]',
+)
 @has_permissions(administrator=True)
-async def start_bet(ctx, reason: str, win_payout: float, lose_payout: float):
-    global current_bet, bet_placements
-
-    if current_bet:
-        await ctx.send("A bet is already active. Resolve it before starting a new one.")
-        return
-
-    # Create the new bet with specific payouts for win/lose
-    current_bet = {"reason": reason, "win_payout": win_payout, "lose_payout": lose_payout}
-    bet_placements = {}
-    await ctx.send(f"A new bet has started: **{reason}**\nWin Payout: **{win_payout}x**\nLose Payout: **{lose_payout}x**\nPlace your bets with `!bet <amount> <win/lose>`.")
+@app_commands.default_permissions(administrator=True)
+@app_commands.describe(
+    reason="What the bet is on", win_payout="Payout multiplier for 'win'",
+    lose_payout="Payout multiplier for 'lose'", minutes="Close betting after this many minutes",
+)
+async def start_bet(ctx, reason: str, win_payout: float, lose_payout: float, minutes: float = None):
+    # Create the new bet with specific payouts for win/lose. Any number of bets
+    # can run at once; each gets its own number.
+    market = await bank.open_market(
+        guild_key(ctx), ctx.channel.id, reason, win_payout, lose_payout,
+        minutes * 60 if minutes else None,
+    )
+    closes = f"\nBetting closes in **{minutes:g}** minutes." if minutes else ""
+    await reply(ctx, f"Bet #{market['id']} has started: **{reason}**\nWin Payout: **{win_payout}x**\nLose Payout: **{lose_payout}x**{closes}\nPlace your bets with `!bet <amount> <win/lose> {market['id']}`.")
+
+def render_pool(market):
+    # The live odds message of a pool bet
+    lines = [f"**Pool bet #{market['id']}: {market['reason']}** ({market['status']})"]
+    for side in ("win", "lose"):
+        odds = market['odds'][side]
+        pays = f"pays {odds:g}x" if odds else "no bets yet"
+        lines.append(f"{side.capitalize()}: {market['pools'][side]} coins from {market['counts'][side]} bets, {pays}")
+    if market['rake']:
+        lines.append(f"The house keeps {market['rake']}% of the pool.")
+    if market['open']:
+        lines.append(f"Bet with `!bet <amount> <win/lose> {market['id']}`.")
+    return "\n".join(lines)
+
+
+@bot.hybrid_command(
+    name='start_pool', description='Start a pool bet, where the odds come from the bets. (Admins only)',
+    help='Start a pool bet, where winners split the losing side. (Admins only) Usage: !start_pool <reason> [minutes open]',
+)
+@has_permissions(administrator=True)
+@app_commands.default_permissions(administrator=True)
+@app_commands.describe(reason="What the bet is on", minutes="Close betting after this many minutes")
+async def start_pool(ctx, reason: str, minutes: float = None):
+    market = await bank.open_market(
+        guild_key(ctx), ctx.channel.id, reason, None, None, minutes * 60 if minutes else None, "pool", POOL_RAKE,
+    )
+    # The odds message is a plain channel message rather than an interaction
+    # response, which could only be edited for 15 minutes
+    odds_boards.track(market['id'], await ctx.channel.send(render_pool(market)))
+    if ctx.interaction is not None:
+        await reply(ctx, f"Pool bet #{market['id']} has started.")
+
+
+# Why the ledger service turned a bet down
+BET_ERRORS = {
+    "closed": "Betting on #{market[id]} is closed.",
+    "balance": "{mention}, you don't have enough coins to place this bet.",
+    "placed": "{mention}, you've already placed a bet on this round.",
+}
 
 # Command to place a bet
-@bot.command(name='bet', help='Place a bet on the current game.')
-async def bet(ctx, amount: int, prediction: str):
-    global current_bet, bet_placements
-
-    user_id = ctx.author.id
-    user_data = get_user_data(user_id)
-
-    if not current_bet:
-        await ctx.send("No active bet to place your wager on.")
-        return
-
+@bot.hybrid_command(
+    name='bet', description='Place a bet on an active game.',
+    help='Place a bet on an active game. Usage: !bet <amount> <win/lose> [bet number]',
+)
+@app_commands.describe(
+    amount="Coins to bet", prediction="win or lose", market_id="Bet number; the one in this channel if left out"
+)
+async def bet(ctx, amount: int, prediction: str, market_id: int = None):
     if prediction.lower() not in ['win', 'lose']:
-        await ctx.send("Invalid prediction. Use 'win' or 'lose'.")
+        await reply(ctx, "Invalid prediction. Use 'win' or 'lose'.")
         return
 
-    if amount > user_data["balance"]:
-        await ctx.send(f"{ctx.author.mention}, you don't have enough coins to place this bet.")
+    if amount <= 0:
+        await reply(ctx, f"{ctx.author.mention}, please enter a valid bet amount!")
         return
 
-    if user_id in bet_placements:
-        await ctx.send(f"{ctx.author.mention}, you've already placed a bet on this round.")
+    # The service checks the market and balance, deducts the bet and records
+    # the placement in one step. The stake stays an open round in the journal
+    # until the bet is resolved, so a restart refunds it
+    market, error = await bank.place_bet(
+        guild_key(ctx), ctx.channel.id, market_id, ctx.author.id, amount, prediction.lower()
+    )
+    if market is None:
+        await reply(ctx, error)
+        return
+    if error:
+        await reply(ctx, BET_ERRORS[error].format(market=market, mention=ctx.author.mention))
         return
 
-    # Deduct bet amount and record the placement
-    user_data["balance"] -= amount
-    bet_placements[user_id] = {"amount": amount, "prediction": prediction.lower()}
-    update_user_data(user_id, user_data["balance"])
-
-    await ctx.send(f"{ctx.author.mention}, you placed a bet of {amount} coins predicting '{prediction}'.")
+    if market['mode'] == "pool":
+        odds_boards.update(market['id'], render_pool(market))
+    await reply(ctx, f"{ctx.author.mention}, you placed a bet of {amount} coins on #{market['id']} predicting '{prediction}'.")
 
-# Command to resolve the bet and payout separately for win/lose predictions
-# Command to resolve the bet and payout separately for win/lose predictions
-@bot.command(name='resolve_bet', help='Resolve the current bet. (Admins only)')
+@bot.hybrid_command(
+    name='lock_bet', description='Stop taking bets on a game. (Admins only)',
+    help='Stop taking bets on a game. (Admins only) Usage: !lock_bet [bet number]',
+)
 @has_permissions(administrator=True)
-async def resolve_bet(ctx, outcome: str):
-    global current_bet, bet_placements
-
-    if not current_bet:
-        await ctx.send("No active bet to resolve.")
+@app_commands.default_permissions(administrator=True)
+@app_commands.describe(market_id="Bet number; the one in this channel if left out")
+async def lock_bet(ctx, market_id: int = None):
+    market, error = await bank.lock_market(guild_key(ctx), ctx.channel.id, market_id)
+    if market is None:
+        await reply(ctx, error)
+        return
+    if market['mode'] == "pool":
+        odds_boards.update(market['id'], render_pool(market))
+    await reply(ctx, f"Betting on #{market['id']} (**{market['reason']}**) is now locked.")
+
+@bot.hybrid_command(name='markets', aliases=['current_bet'], help='List the active bets in this server.')
+async def markets_list(ctx):
+    active = await bank.guild_markets(guild_key(ctx))
+    if not active:
+        await reply(ctx, "There are no active bets.")
         return
+    lines = ["**Active bets:**"]
+    for market in active:
+        # Pool odds move with the bets; a side nobody has backed has none yet
+        odds = {side: f"{value:g}x" if value else "-" for side, value in market['odds'].items()}
+        lines.append(
+            f"#{market['id']} **{market['reason']}** in <#{market['channel_id']}> ({market['status']}"
+            f"{', pool' if market['mode'] == 'pool' else ''}): "
+            f"win {odds['win']}, {market['counts']['win']} bets, {market['pools']['win']} coins | "
+            f"lose {odds['lose']}, {market['counts']['lose']} bets, {market['pools']['lose']} coins"
+        )
+    await reply(ctx, "\n".join(lines))
 
+# Command to resolve the bet and payout separately for win/lose predictions
+@bot.hybrid_command(
+    name='resolve_bet', description='Resolve a bet. (Admins only)',
+    help='Resolve a bet. (Admins only) Usage: !resolve_bet <win/lose> [bet number]', extras={"defer": True},
+)
+@has_permissions(administrator=True)
+@app_commands.default_permissions(administrator=True)
+@app_commands.describe(outcome="win or lose", market_id="Bet number; the one in this channel if left out")
+async def resolve_bet(ctx, outcome: str, market_id: int = None):
     if outcome.lower() not in ['win', 'lose']:
-        await ctx.send("Invalid outcome. Use 'win' or 'lose'.")
+        await reply(ctx, "Invalid outcome. Use 'win' or 'lose'.")
         return
 
-    # Save current bet's reason and outcome before clearing the bet
-    reason = current_bet['reason']
-    win_payout = current_bet['win_payout']
-    lose_payout = current_bet['lose_payout']
-
-    # Get the specific payout multiplier based on the outcome
-    payout = win_payout if outcome.lower() == 'win' else lose_payout
-    results = []
-
-    # Process payouts for each bet placement
-    for user_id, bet in bet_placements.items():
-        user_data = get_user_data(user_id)
-        
-        if bet["prediction"] == outcome.lower():
-            winnings = bet["amount"] * payout
-            user_data["balance"] += winnings
-            results.append(f"<@{user_id}> won {winnings} coins!")
-        else:
-            results.append(f"<@{user_id}> lost their bet of {bet['amount']} coins.")
-        
-        update_user_data(user_id, user_data["balance"])
-
-    # Reset the bet placements and current bet
-    bet_placements = {}
-    current_bet = None
-
-    winners_message = "\n".join(results) if results else "No winners this time."
-    await ctx.send(f"**Bet Resolved: {reason}**\nResult: **{outcome.capitalize()}**\n\n{winners_message}")
+    # The service closes the market and settles every payout as a single batch
+    result, error = await bank.resolve_market(
+        guild_key(ctx), ctx.channel.id, market_id, outcome.lower(), TOP_WINNERS_SHOWN
+    )
+    if result is None:
+        await reply(ctx, error)
+        return
+    market = result["market"]
+    bettors = result["bettors"]
+    winners = result["winners"]
+
+    # Post totals plus the biggest winners rather than a line per bettor
+    lines = [
+        f"**Bet #{market['id']} Resolved: {market['reason']}**",
+        f"Result: **{outcome.capitalize()}**",
+        "",
+        f"Bettors: {bettors} ({winners} won, {bettors - winners} lost)",
+        f"Total staked: {result['total_staked']} coins. Total paid out: {result['total_paid']} coins.",
+    ]
+    if market['mode'] == "pool":
+        if winners:
+            lines.append(f"The house kept {result['total_staked'] - result['total_paid']} coins.")
+        elif bettors:
+            lines.append("Nobody backed the result, so every stake was refunded.")
+        market.update(status=f"resolved: {outcome.lower()}", open=False)
+        await odds_boards.finish(market['id'], render_pool(market))
+    if winners:
+        lines.append("")
+        lines.append("**Top winners:**")
+        for winnings, user_id in result["top"]:
+            lines.append(f"<@{user_id}> won {winnings} coins!")
+    else:
+        lines.append("No winners this time.")
+    await reply(ctx, "\n".join(lines))
 
 # Command to send money to another user
-@bot.command(name='send', help='Send coins to another user.')
+@bot.hybrid_command(name='send', help='Send coins to another user.')
+@app_commands.describe(recipient="Who gets the coins", amount="Coins to send")
 async def send(ctx, recipient: discord.User, amount: int):
     sender_id = ctx.author.id
     recipient_id = recipient.id
 
-    # Fetch sender data
-    sender_data = get_user_data(sender_id)
-    if sender_data["loan"] > 0:
-        await ctx.send(f"{ctx.author.mention}, you must repay your current loan first!")
+    if sender_id == recipient_id:
+        await reply(ctx, f"{ctx.author.mention}, you can't send coins to yourself.")
         return
     if amount <= 0:
-        await ctx.send(f"{ctx.author.mention}, you can't send a negative or zero amount.")
-        return
-
-    if sender_data["balance"] < amount:
-        await ctx.send(f"{ctx.author.mention}, you don't have enough coins to send that amount.")
+        await reply(ctx, f"{ctx.author.mention}, you can't send a negative or zero amount.")
         return
 
-    # Fetch recipient data (make sure the recipient has a record)
-    recipient_data = get_user_data(recipient_id)
-    
-    if not recipient_data:
-        await ctx.send(f"{ctx.author.mention}, the recipient doesn't have a valid account.")
-        return
-
-    # Deduct from sender and add to recipient
-    sender_data["balance"] -= amount
-    recipient_data["balance"] += amount
-
-    # Update both users' balances in the data storage
-    update_user_data(sender_id, sender_data["balance"])
-    update_user_data(recipient_id, recipient_data["balance"])
+    # Lock both accounts; the transfer commits to both or neither. The reply
+    # goes out after the block, so the accounts aren't locked while it sends
+    async with bank.transaction(sender_id, recipient_id, reason="send") as tx:
+        sender_data = tx.record(sender_id)
+        if sender_data.loan > 0:
+            message = f"{ctx.author.mention}, you must repay your current loan first!"
+        elif sender_data.balance < amount:
+            message = f"{ctx.author.mention}, you don't have enough coins to send that amount."
+        else:
+            # Deduct from sender and add to recipient
+            tx.adjust(sender_id, balance=-amount)
+            tx.adjust(recipient_id, balance=amount)
+            message = f"{ctx.author.mention} successfully sent {amount} coins to {recipient.mention}."
 
-    await ctx.send(f"{ctx.author.mention} successfully sent {amount} coins to {recipient.mention}.")
+    await reply(ctx, message)
 
-@bot.command(name='strip', help='Become a stripper and make money from -200 to 500 coins.')
+@bot.hybrid_command(name='strip', help='Become a stripper and make money from -200 to 500 coins.')
 async def strip(ctx):
     user_id = ctx.author.id
 
-    # Fetch user data
-    user_data = get_user_data(user_id)
-
-    # Generate a random amount between -200 and 500
-    amount = random.randint(-200, 500)
+    # A fair amount between -200 and 500
+    nonce, amount = await bank.roll(user_id, "strip")
 
     # Update balance
-    user_data["balance"] += amount
-
-    # Save updated data
-    update_user_data(user_id, user_data["balance"])
+    await bank.adjust(user_id, "strip", balance=amount)
 
     # Prepare response message
     if amount >= 0:
-        await ctx.send(f"{ctx.author.mention} stripped and earned **{amount}** coins!")
+        await reply(ctx, f"{ctx.author.mention} stripped and earned **{amount}** coins! (round {nonce})")
     else:
-        await ctx.send(f"{ctx.author.mention} stripped and lost **{-amount}** coins... Better luck next time!")
+        await reply(ctx, f"{ctx.author.mention} stripped and lost **{-amount}** coins... Better luck next time! (round {nonce})")
         
         
-SHOP_ITEMS = {
-    "⌚ Rolex": 5000,
-    "🏎️ Lambo": 130000,
-    "🚘 Porsche": 100000,
-    "🏢 Apartment": 200000,
-    "🌆 Penthouse": 1000000,
-    "🛥️ JetSki": 15000,
-    "🏝️ PrivateIsland": 5000000,
-    "🚁 Helicopter": 800000,
-    "🛳️ Superyacht": 7500000,
-    "💍 DiamondRing": 10000,
-    "🚀 SpaceShuttle": 20000000,
-    "💃 Hooker": 50000,
-    "🛡️ SecurityTeam": 9000000,
-    "✈️ PrivateJet": 3000000,
-    "🏰 Castle": 15000000
-}
-@bot.command(name='buy', help='Purchase an item from the shop.')
-async def buy(ctx, item: str):
+@bot.hybrid_command(name='buy', description='Purchase an item from the shop.', help='Purchase an item from the shop. Usage: !buy <item>')
+@app_commands.describe(item="Item name or emoji")
+async def buy(ctx, *, item: str):
     user_id = ctx.author.id
-    user_data = get_user_data(user_id)
-
-    # Define the item prices
-    item_prices = {
-        "Rolex": 5000,
-        "Lambo": 130000,
-        "Porsche": 100000,
-        "Apartment": 200000,
-        "Penthouse": 1000000,
-        "JetSki": 15000,
-        "PrivateIsland": 5000000,
-        "Helicopter": 800000,
-        "Superyacht": 7500000,
-        "Diamond Ring": 10000,
-        "SpaceShuttle": 20000000,
-        "Hooker": 50000,
-        "SecurityTeam": 9000000,
-        "PrivateJet": 3000000,
-        "Castle": 15000000
-    }
 
-    # Check if the item exists in the shop
-    if item not in item_prices:
-        await ctx.send(f"{ctx.author.mention}, this item is not available in the shop.")
+    # Check if the item exists in the shop; any case, spacing or its emoji will do
+    found = catalog.find(item)
+    if found is None:
+        await reply(ctx, f"{ctx.author.mention}, this item is not available in the shop.")
         return
 
-    # Check if the user can afford the item
-    if user_data["balance"] < item_prices[item]:
-        await ctx.send(f"{ctx.author.mention}, you don't have enough balance to buy the {item}.")
-        return
+    async with bank.transaction(user_id, reason="buy") as tx:
+        # Check if the user can afford the item
+        if tx.balance(user_id) < found.price:
+            message = f"{ctx.author.mention}, you don't have enough balance to buy the {found.name}."
+        else:
+            # Deduct the price and add the item to the user's inventory
+            tx.adjust(user_id, balance=-found.price, items={found.name: 1})
+            message = f"{ctx.author.mention} successfully purchased a {catalog.label(found.name)}!"
 
-    # Deduct the price of the item from the user's balance
-    user_data["balance"] -= item_prices[item]
+    await reply(ctx, message)
 
-    # Add the item to the user's inventory
-    items = user_data.get("items", [])
-    items.append(item)
 
-    # Save the updated data
-    update_user_data(user_id, balance=user_data["balance"], items=items)
+@bot.hybrid_command(name='sell', description='Sell an item from your inventory.', help='Sell an item from your inventory. Usage: !sell <item>')
+@app_commands.describe(item="Item name or emoji")
+async def sell(ctx, *, item: str):
+    user_id = ctx.author.id
 
-    await ctx.send(f"{ctx.author.mention} successfully purchased a {item}!")
+    found = catalog.find(item)
+    name = found.name if found is not None else item
 
+    async with bank.transaction(user_id, reason="sell") as tx:
+        if tx.record(user_id).items.get(name, 0) < 1:
+            message = f"{ctx.author.mention}, you don't own a {name}."
+        else:
+            # Calculate the sell price (70% of the original value, in whole coins)
+            sell_price = catalog.sell_price(name)
 
+            # Remove the item from inventory and add the sell price to the balance
+            tx.adjust(user_id, balance=sell_price, items={name: -1})
+            message = f"{ctx.author.mention} successfully sold the {catalog.label(name)} for {sell_price} coins!"
 
-@bot.command(name='sell', help='Sell an item from your inventory.')
-async def sell(ctx, item: str):
-    user_id = ctx.author.id
-    user_data = get_user_data(user_id)
+    await reply(ctx, message)
 
-    item_prices = {
-        "Rolex": 5000,
-        "Lambo": 130000,
-        "Porsche": 100000,
-        "Apartment": 200000,
-        "Penthouse": 1000000,
-        "JetSki": 15000,
-        "PrivateIsland": 5000000,
-        "Helicopter": 800000,
-        "Superyacht": 7500000,
-        "Diamond Ring": 10000,
-        "SpaceShuttle": 20000000,
-        "Hooker": 50000,
-        "SecurityTeam": 9000000,
-        "PrivateJet": 3000000,
-        "Castle": 15000000
-    }
 
-    # Validate user data structure
-    if not isinstance(user_data.get("balance"), (int, float)):
-        user_data["balance"] = 1000  # Reset to default value if corrupted
+@bot.hybrid_command(name='shop', help='View the shop and available items.')
+async def shop(ctx):
+    shop_items = "\n".join(f"{item.emoji} {item.name}: {item.price} coins" for item in catalog.ITEMS)
+    await reply(ctx, f"**Welcome to the Shop!**\nHere are the available items:\n{shop_items}\nUse `!buy <item>` to purchase an item.")
+@bot.hybrid_command(name='inventory', help='Check your inventory of items.')
+async def inventory(ctx):
+    user_id = ctx.author.id
+    user_data = await get_user_data(user_id)
 
-    if "items" not in user_data or item not in user_data["items"]:
-        await ctx.send(f"{ctx.author.mention}, you don't own a {item}.")
+    # Check if the user has any items
+    if not user_data.items:
+        await reply(ctx, f"{ctx.author.mention}, your inventory is empty.")
         return
 
-    # Calculate the sell price (70% of the original value)
-    sell_price = item_prices[item] * 0.7
-
-    # Remove the item from inventory
-    user_data["items"].remove(item)
+    # Format and display the items in the user's inventory
+    inventory_items = "\n".join(
+        f"{catalog.label(item)} x{count}" for item, count in sorted(user_data.items.items())
+    )
+    await reply(
+        ctx,
+        f"{ctx.author.mention}, your inventory contains:\n{inventory_items}\n"
+        f"Total value: {user_data.assets} coins."
+    )
 
-    # Add the sell price to the user's balance
-    user_data["balance"] += sell_price
+@bot.hybrid_command(name='history', description='Show where your coins went.', help='Show where your coins went. Usage: !history [page]')
+@app_commands.describe(page="Page number; 1 is the most recent")
+async def history_command(ctx, page: int = 1):
+    found = await bank.history(ctx.author.id, page)
+    if found is None:
+        await reply(ctx, f"{ctx.author.mention}, you have no transactions yet.")
+        return
+    entries, page, pages = found
+    lines = [f"**{ctx.author.mention}'s transactions** (page {page}/{pages})"]
+    lines.extend(history.describe(entry) for entry in entries)
+    await reply(ctx, "\n".join(lines))
 
-    # Save the updated data
-    update_user_data(user_id, balance=user_data["balance"], items=user_data["items"])
 
-    await ctx.send(f"{ctx.author.mention} successfully sold the {item} for {sell_price:.2f} coins!")
+@bot.hybrid_command(
+    name='history_export', description="Export a user's full transaction history. (Admins only)",
+    help="Export a user's full transaction history as JSON lines. (Admins only)", extras={"defer": True},
+)
+@has_permissions(administrator=True)
+@app_commands.default_permissions(administrator=True)
+@app_commands.describe(member="Whose history to export")
+async def history_export(ctx, member: discord.User):
+    entries = await bank.history_export(member.id)
+    if not entries:
+        await reply(ctx, f"{member.mention} has no transactions.")
+        return
+    data = "".join(json.dumps(entry) + "\n" for entry in entries).encode()
+    # Attachments can't go through the outbox, which only joins text
+    await ctx.send(
+        f"{len(entries)} transactions for {member.mention}.",
+        file=discord.File(io.BytesIO(data), filename=f"history-{member.id}.jsonl"),
+    )
 
 
-@bot.command(name='shop', help='View the shop and available items.')
-async def shop(ctx):
-    shop_items = "\n".join([f"{item}: {price} coins" for item, price in SHOP_ITEMS.items()])
-    await ctx.send(f"**Welcome to the Shop!**\nHere are the available items:\n{shop_items}\nUse `!buy <item>` to purchase an item.")
-@bot.command(name='inventory', help='Check your inventory of items.')
-async def inventory(ctx):
-    user_id = ctx.author.id
-    user_data = get_user_data(user_id)
-
-    # Check if the user has any items
-    if "items" not in user_data or not user_data["items"]:
-        await ctx.send(f"{ctx.author.mention}, your inventory is empty.")
+def render_seeds(mention, info):
+    lines = [
+        f"{mention}, your provably fair seeds:",
+        f"Server seed hash: `{info['hash']}`",
+        f"Client seed: `{info['client']}`",
+        f"Next round: {info['nonce']}",
+    ]
+    revealed = info['revealed']
+    if revealed:
+        lines.append(
+            f"Previous server seed: `{revealed['server']}` with client seed `{revealed['client']}`, "
+            f"for rounds below {revealed['rounds']}. Check them with !verify <game> <round>."
+        )
+    return "\n".join(lines)
+
+
+@bot.hybrid_command(
+    name='seeds', description='Show or rotate your provably fair seeds.',
+    help='Show your provably fair seeds, or rotate them to reveal the server seed. '
+         'Usage: !seeds [rotate] [new client seed]',
+)
+@app_commands.describe(action="show, or rotate to reveal the server seed and start new ones",
+                       client_seed="Your own client seed for the new pair")
+async def seeds_command(ctx, action: str = "show", client_seed: str = None):
+    if action == "rotate":
+        info = await bank.rotate_seeds(ctx.author.id, client_seed)
+        if info is None:
+            # Revealing the seed now would give away the open round's outcome
+            await reply(ctx, f"{ctx.author.mention}, finish your open games and bets before rotating your seeds.")
+            return
+    elif action == "show":
+        info = await bank.seeds(ctx.author.id)
+    else:
+        await reply(ctx, "Usage: !seeds [rotate] [new client seed]")
+        return
+    await reply(ctx, render_seeds(ctx.author.mention, info))
+
+
+@bot.hybrid_command(
+    name='verify', description='Recompute a game round from its seeds.',
+    help='Recompute a game round from revealed seeds; your last revealed pair by default. '
+         'Usage: !verify <game> <round> [server seed] [client seed]',
+)
+@app_commands.describe(game="The game played", nonce="The round number shown with the result",
+                       server_seed="A revealed server seed", client_seed="The client seed used with it")
+async def verify(ctx, game: str, nonce: int, server_seed: str = None, client_seed: str = None):
+    game = game.lower()
+    if game not in fairness.GAMES:
+        await reply(ctx, f"Pick one of: {', '.join(fairness.GAMES)}.")
+        return
+    if server_seed is None:
+        revealed = (await bank.seeds(ctx.author.id))['revealed']
+        if revealed is None:
+            await reply(ctx, f"{ctx.author.mention}, your server seed hasn't been revealed yet. Use !seeds rotate first.")
+            return
+        server_seed, client_seed = revealed['server'], client_seed or revealed['client']
+    elif client_seed is None:
+        await reply(ctx, "Give the client seed that was used with that server seed.")
         return
+    await reply(
+        ctx,
+        f"Server seed hash: `{fairness.seed_hash(server_seed)}`\n"
+        f"{game} round {nonce}: {fairness.verify(game, server_seed, client_seed, nonce)}",
+    )
 
-    # Format and display the items in the user's inventory
-    inventory_items = "\n".join(user_data["items"])
-    await ctx.send(f"{ctx.author.mention}, your inventory contains:\n{inventory_items}")
 
-@bot.command(name='commands', help='List all commands.')
+@bot.hybrid_command(name='commands', help='List all commands.')
 async def commands_list(ctx):
     """List all commands."""
     commands = """
-    **Commands List:**
+    **Commands List:** (every command also works as a slash command, e.g. /balance)
     - !balance: Check your balance and loans.
     - !loan <amount>: Apply for a loan.
     - !repay <amount>: Repay your loan.
-    - !leaderboard: Show the leaderboard.
+    - !leaderboard [page]: Show the leaderboard.
+    - !rank [user]: Show a leaderboard rank.
+    - !networth [page]: Show the net worth leaderboard.
     - !rps <bet> <choice>: Play Rock, Paper, Scissors with a bet.
     - !slots <bet>: Play the slot machine with a bet.
     - !reset_balances: Reset all balances. (Admins only)
-    - !start_bet <reason> <odds win> <odds lose>: Start a new bet. (Admins only)
-    - !bet <amount> <win/lose>: Place a bet on the current game.
-    - !resolve_bet <win/lose>: Resolve the current bet and payout winnings. (Admins only)
+    - !start_bet <reason> <odds win> <odds lose> [minutes]: Start a new bet. (Admins only)
+    - !start_pool <reason> [minutes]: Start a pool bet whose odds come from the bets. (Admins only)
+    - !bet <amount> <win/lose> [bet number]: Place a bet on an active game.
+    - !lock_bet [bet number]: Stop taking bets on a game. (Admins only)
+    - !resolve_bet <win/lose> [bet number]: Resolve a bet and payout winnings. (Admins only)
     - !send: <person> <amount>
     - !strip: Become a stripper and make money
     - !shop: Check things to buy
     - !inventory: Check inventory
-    - !buy: Buy things
-    - !sell: Sell things to afford your addiction
+    - !history [page]: See where your coins went
+    - !history_export <user>: Export a user's transaction history. (Admins only)
+    - !seeds [rotate] [client seed]: Show your provably fair seeds, or reveal them and start new ones
+    - !verify <game> <round> [server seed] [client seed]: Recompute a game round from revealed seeds
+    - !buy <item>: Buy things
+    - !sell <item>: Sell things to afford your addiction
     - !doors <amount>: Choose a door and gamble
-    - !current_bet: Check the status of the current bet.
+    - !mines <bet> <mines>: Uncover tiles and cash out before hitting a mine
+    - !markets: List the active bets in this server.
+    - !sessions: List live games. (Admins only)
+    - !outbox: Show the outbound message queue. (Admins only)
+    - !profile <start|stop|status> [commands]: Profile commands live. (Admins only)
+    - !economy_jobs [run]: Show or run the daily economy jobs. (Admins only)
+    - !economy [days]: Show supply, debt, inequality and item ownership. (Admins only)
+    - !economy_export: Export economy statistics over time as CSV. (Admins only)
     """
-    await ctx.send(commands)
-# Helper function for Mines game
-def generate_grid(size, mines):
-    grid = ['0'] * (size * size)  # 5x5 grid flattened
-    mine_positions = random.sample(range(size * size), mines)
-    for mine in mine_positions:
-        grid[mine] = '💣'  # Marking mines
-    return grid
-
-def display_grid(grid, revealed_tiles):
-    display = ""
-    for i in range(5):  # 5x5 grid
-        display += " ".join(
-            [grid[i*5 + j] if (i*5 + j) in revealed_tiles else '⬛' for j in range(5)]
-        ) + "\n"
-    return display
-
-@bot.command(name="mines", help="Play a game of Mines.")
+    await reply(ctx, commands)
+@bot.hybrid_command(name="mines", description="Play a game of Mines.", help="Play a game of Mines. Usage: !mines <bet> <number of mines>")
+@app_commands.describe(bet="Coins to bet", num_mines=f"Mines hidden in the grid, 1 to {MINES_TILES - 1}")
 async def mines(ctx, bet: int, num_mines: int):
     user_id = ctx.author.id
 
-    # Get the user data and check balance
-    user_data = get_user_data(user_id)
-    if user_data["balance"] < bet:
-        await ctx.send(f"{ctx.author.mention}, you don't have enough balance to play this game!")
+    if bet <= 0:
+        await reply(ctx, f"{ctx.author.mention}, please enter a valid bet amount!")
+        return
+    if not 1 <= num_mines < MINES_TILES:
+        await reply(ctx, f"{ctx.author.mention}, choose between 1 and {MINES_TILES - 1} mines.")
         return
 
-    # Deduct the bet from the user's balance
-    user_data["balance"] -= bet
-    update_user_data(user_id, balance=user_data["balance"])
-
-    # Generate the grid with mines
-    grid = generate_grid(5, num_mines)
-    revealed_tiles = set()  # Keep track of revealed tiles
-
-    # Send the grid to the user and add reactions
-    grid_message = await ctx.send(f"**Mines Game!**\nYour bet: {bet} 💸\n{display_grid(grid, revealed_tiles)}\nReact with the numbers (1-25) to reveal tiles!")
-
-    # Add reactions for clicking the grid (1-25)
-    for i in range(1, 26):
-        await grid_message.add_reaction(str(i))
-
-    def check(reaction, user):
-        return user == ctx.author and str(reaction.emoji) in [str(i) for i in range(1, 26)]
+    # Check the balance, deduct the bet and draw the mines in one step. The
+    # bet stays an open round in the journal until the view settles it, so a
+    # restart mid-game refunds it
+    opened = await bank.open_game(user_id, bet, "mines", num_mines)
+    if opened is None:
+        await reply(ctx, f"{ctx.author.mention}, you don't have enough balance to play this game!")
+        return
+    round_id, nonce, mine_positions = opened
+    view = MinesView(bank, ctx.author, bet, mine_positions, round_id, nonce)
+    await start_game(ctx, view)
 
-    # Game loop
-    while True:
-        try:
-            reaction, user = await bot.wait_for('reaction_add', timeout=60.0, check=check)
-
-            # Get the tile number from the emoji
-            tile_num = int(reaction.emoji) - 1
-            if tile_num in revealed_tiles:
-                await ctx.send(f"{ctx.author.mention}, this tile has already been revealed.")
-                continue
-
-            # Reveal the tile
-            revealed_tiles.add(tile_num)
-            if grid[tile_num] == '💣':
-                # User clicked on a mine, game over
-                await ctx.send(f"{ctx.author.mention}, you hit a mine! You lost your bet of {bet} 💸.")
-                update_user_data(user_id, balance=user_data["balance"] - bet)  # Subtract the bet from the user's balance
-                break
-            else:
-                # Display the updated grid
-                updated_grid = grid[:]
-                for idx in revealed_tiles:
-                    updated_grid[idx] = '✅'  # Mark revealed tiles with a check mark
-
-                updated_grid_display = display_grid(updated_grid, revealed_tiles)
-                await grid_message.edit(content=f"**Mines Game!**\nYour bet: {bet} 💸\n{updated_grid_display}\nReact with the numbers (1-25) to reveal more tiles!")
-
-        except asyncio.TimeoutError:
-            await ctx.send(f"{ctx.author.mention}, the game timed out!")
-            break
-
-        except Exception as e:
-            await ctx.send(f"An error occurred: {str(e)}")
-            break
-import random
-import asyncio
 
-@bot.command(name="doors", help="Choose a door to find the money! Usage: !doors <amount>")
+@bot.hybrid_command(name="doors", description="Choose a door to find the money!", help="Choose a door to find the money! Usage: !doors <amount>")
+@app_commands.describe(amount="Coins to bet")
 async def doors(ctx, amount: int):
     user_id = ctx.author.id
-    user_data = get_user_data(user_id)
-    
+
     # Validate the bet amount
     if amount <= 0:
-        await ctx.send(f"{ctx.author.mention}, please enter a valid bet amount!")
+        await reply(ctx, f"{ctx.author.mention}, please enter a valid bet amount!")
         return
 
-    if amount > user_data["balance"]:
-        await ctx.send(f"{ctx.author.mention}, you don't have enough balance to place this bet.")
+    # Check the balance, deduct the bet and draw the doors in one step. The
+    # bet stays an open round in the journal until a door is picked, so a
+    # restart mid-game refunds it
+    opened = await bank.open_game(user_id, amount, "doors")
+    if opened is None:
+        await reply(ctx, f"{ctx.author.mention}, you don't have enough balance to place this bet.")
         return
+    round_id, nonce, (winning_door, multiplier) = opened
+    view = DoorsView(bank, ctx.author, amount, winning_door, multiplier, round_id, nonce)
+    await start_game(ctx, view)
 
-    # Deduct the bet amount
-    user_data["balance"] -= amount
-    update_user_data(user_id, user_data["balance"])
 
-    # Randomly choose the winning door
-    winning_door = random.choice(["🟦", "🟨", "🟥"])
-    doors = ["🟦", "🟨", "🟥"]
+async def start_game(ctx, view):
+    # One message per game; every move edits it through the button interaction
+    try:
+        view.message = await ctx.send(view.render(), view=view)
+        sessions.register(view.message.id, view)
+    except Exception:
+        # The game never reached the player, so hand the stake back
+        await view.bank.close_round(view.round_id, view.bet, f"refund:{view.reason}")
+        view.stop()
+        raise
 
-    # Send the game message
-    message = await ctx.send(
-        f"{ctx.author.mention}, \n Pick a door! \n React with one of the emojis: 🟦 🟨 🟥\n\n"
-        f"Bet amount: {amount}"
-    )
 
-    # Add reactions for the doors
-    for door in doors:
-        await message.add_reaction(door)
+@bot.hybrid_command(name="sessions", help="List live game sessions. (Admins only)")
+@has_permissions(administrator=True)
+@app_commands.default_permissions(administrator=True)
+async def sessions_list(ctx):
+    live = sessions.describe()
+    if not live:
+        await reply(ctx, "No games are in progress.")
+        return
+    lines = [f"**Live games: {len(live)}**"]
+    for message_id, session, age, remaining in live:
+        lines.append(f"{message_id}: {session.describe()} (running {age:.0f}s, times out in {remaining:.0f}s)")
+    await reply(ctx, "\n".join(lines))
 
-    # Wait for the user's reaction
-    def check(reaction, user):
-        return (
-            user == ctx.author
-            and str(reaction.emoji) in doors
-            and reaction.message.id == message.id
-        )
 
-    try:
-        reaction, _ = await bot.wait_for("reaction_add", timeout=30.0, check=check)
-    except asyncio.TimeoutError:
-        await ctx.send(f"{ctx.author.mention}, you took too long to choose a door!")
-        return
-
-    # Evaluate the result
-    chosen_door = str(reaction.emoji)
-    if chosen_door == winning_door:
-        multiplier = random.randint(2, 4)  # Payout multiplier
-        winnings = amount * multiplier
-        user_data["balance"] += winnings  # Add winnings to balance
-        result = f"You won {winnings} coins! (Multiplier: x{multiplier})"
+@bot.hybrid_command(name="outbox", help="Show the outbound message queue. (Admins only)")
+@has_permissions(administrator=True)
+@app_commands.default_permissions(administrator=True)
+async def outbox_stats(ctx):
+    stats = outbox.stats()
+    await reply(
+        ctx,
+        f"Queue depth: {stats['depth']} replies across {stats['channels']} channels.\n"
+        f"Replies queued: {stats['queued']}, sent as {stats['sent']} messages.\n"
+        f"Send latency: p50 {stats['latency_p50'] * 1000:.0f} ms, p99 {stats['latency_p99'] * 1000:.0f} ms."
+    )
+
+
+@bot.hybrid_command(
+    name="profile", description="Profile commands live. (Admins only)",
+    help="Profile commands live. (Admins only) Usage: !profile <start|stop|status> [commands...]", extras={"defer": True},
+)
+@has_permissions(administrator=True)
+@app_commands.default_permissions(administrator=True)
+@app_commands.describe(action="start, stop or status", command_names="Commands to profile, separated by spaces; all if left out")
+async def profile(ctx, action: str, *, command_names: str = ""):
+    # Slash commands can't take a variable number of options, so the names
+    # come in as one string
+    command_names = command_names.split()
+    action = action.lower()
+    if action == "start":
+        unknown = [name for name in command_names if bot.get_command(name) is None]
+        if unknown:
+            await reply(ctx, f"Unknown commands: {', '.join(unknown)}")
+            return
+        # Aliases profile under the command's real name
+        names = [bot.get_command(name).qualified_name for name in command_names]
+        try:
+            profiler.start(names)
+        except RuntimeError as e:
+            await reply(ctx, str(e))
+            return
+        target = ", ".join(f"!{name}" for name in names) if names else "every command"
+        await reply(ctx, f"Profiling {target}. Use `!profile stop` for the report.")
+    elif action == "stop":
+        try:
+            # On the loop: cProfile is switched off per thread
+            stopped = profiler.stop()
+        except RuntimeError as e:
+            await reply(ctx, str(e))
+            return
+        # Writing the .prof file is quick but it is disk I/O, so keep it off the loop
+        path, stats = await asyncio.to_thread(profiler.save, stopped)
+        lines = [f"**Profile** of {profiler.calls} commands over {time.time() - profiler.started_at:.0f}s, saved to `{path}`"]
+        rows = hotspots(stats, PROFILE_TOP)
+        if rows:
+            lines.append("```")
+            lines.append(f"{'self ms':>9} {'total ms':>9} {'calls':>7}  function")
+            for self_time, total_time, calls, label in rows:
+                lines.append(f"{self_time * 1000:>9.1f} {total_time * 1000:>9.1f} {calls:>7}  {label[:70]}")
+            lines.append("```")
+        else:
+            lines.append("No matching commands ran.")
+        lines.append(lag_monitor.summary())
+        await reply(ctx, "\n".join(lines))
+    elif action == "status":
+        if profiler.active:
+            target = ", ".join(f"!{name}" for name in sorted(profiler.commands)) if profiler.commands else "every command"
+            status = f"Profiling {target} for {time.time() - profiler.started_at:.0f}s ({profiler.calls} calls so far)."
+        else:
+            status = "No profile is running."
+        await reply(ctx, f"{status}\n{lag_monitor.summary()}")
     else:
-        result = "You lost! The money was behind another door."
+        await reply(ctx, "Usage: !profile <start|stop|status> [commands...]")
+
+
+@bot.hybrid_command(
+    name="economy_jobs", description="Show or run the daily economy jobs. (Admins only)",
+    help="Show or run the daily economy jobs. (Admins only) Usage: !economy_jobs [run]", extras={"defer": True},
+)
+@has_permissions(administrator=True)
+@app_commands.default_permissions(administrator=True)
+@app_commands.describe(action="status, or run to run them now")
+async def economy_jobs_command(ctx, action: str = "status"):
+    if action == "run":
+        await bank.run_economy()
+    elif action != "status":
+        await reply(ctx, "Usage: !economy_jobs [run]")
+        return
+    await reply(ctx, await bank.economy_status())
+
+
+@bot.hybrid_command(
+    name="economy", description="Show coin supply, debt, inequality and item ownership. (Admins only)",
+    help="Show coin supply, debt, inequality and item ownership. (Admins only) Usage: !economy [days]",
+)
+@has_permissions(administrator=True)
+@app_commands.default_permissions(administrator=True)
+@app_commands.describe(days="How far back to compare the coin supply")
+async def economy_command(ctx, days: float = 1.0):
+    if days <= 0:
+        await reply(ctx, "Usage: !economy [days]")
+        return
+    await reply(ctx, f"**Economy:**\n{await bank.economy_report(days)}")
+
+
+@bot.hybrid_command(
+    name="economy_export", description="Export the economy statistics over time as CSV. (Admins only)",
+    help="Export the sampled economy statistics as CSV, for charting. (Admins only)",
+)
+@has_permissions(administrator=True)
+@app_commands.default_permissions(administrator=True)
+async def economy_export(ctx):
+    data = await bank.economy_export()
+    # Attachments can't go through the outbox, which only joins text
+    await ctx.send("Economy statistics, one row per sample.",
+                   file=discord.File(io.BytesIO(data.encode()), filename="economy.csv"))
+
+
+# Slash command autocomplete. Suggestions are filtered by what has been typed
+# so far, ignoring case, spaces and emoji like catalog.find does
+def suggest(options, current):
+    typed = catalog.normalize(current)
+    return [
+        app_commands.Choice(name=name[:100], value=value)
+        for name, value in options if typed in catalog.normalize(name)
+    ][:AUTOCOMPLETE_LIMIT]
+
+
+def fixed_choices(*values):
+    async def autocomplete(interaction, current):
+        return suggest([(value, value) for value in values], current)
+    return autocomplete
+
+
+@buy.autocomplete("item")
+async def shop_item_autocomplete(interaction, current):
+    return suggest([(f"{item.emoji} {item.name} ({item.price} coins)", item.name) for item in catalog.ITEMS], current)
+
+
+@sell.autocomplete("item")
+async def inventory_item_autocomplete(interaction, current):
+    user_data = await get_user_data(interaction.user.id)
+    return suggest([
+        (f"{catalog.label(name)} x{count} (sells for {catalog.sell_price(name)} coins)", name)
+        for name, count in sorted(user_data.items.items())
+    ], current)
+
+
+async def market_choices(interaction, current, open_only):
+    active = await bank.guild_markets(interaction.guild_id or 0)
+    return suggest([
+        (f"#{market['id']} {market['reason']} ({market['status']})", market['id'])
+        for market in active if market['open'] or not open_only
+    ], current)
 
-    # Save the updated user data
-    update_user_data(user_id, user_data["balance"]) 
 
-    # Send the result
-    await ctx.send(f"{ctx.author.mention}, {' | '.join([str(reaction.emoji)])} - {result} Balance: {user_data['balance']} coins.")
+@bet.autocomplete("market_id")
+async def open_market_autocomplete(interaction, current):
+    return await market_choices(interaction, current, open_only=True)
 
 
-# Run the bot
-bot.run('#YOUR TOKEN')
+@lock_bet.autocomplete("market_id")
+@resolve_bet.autocomplete("market_id")
+async def market_autocomplete(interaction, current):
+    return await market_choices(interaction, current, open_only=False)
+
+
+bet.autocomplete("prediction")(fixed_choices("win", "lose"))
+resolve_bet.autocomplete("outcome")(fixed_choices("win", "lose"))
+rps.autocomplete("choice")(fixed_choices(*RPS_CHOICES))
+seeds_command.autocomplete("action")(fixed_choices("show", "rotate"))
+verify.autocomplete("game")(fixed_choices(*fairness.GAMES))
+profile.autocomplete("action")(fixed_choices("start", "stop", "status"))
+economy_jobs_command.autocomplete("action")(fixed_choices("status", "run"))
+
+
+async def serve_ledger():
+    # The ledger service on its own, for shard processes to connect to
+    server = LedgerServer(bank, LEDGER_SOCKET or "ledger.sock")
+    await bank.start()
+    await server.start()
+    if METRICS_PORT:
+        metrics.counter_from("bot_ledger_server_frames_total", "Frames received from shards.", lambda: server.frames)
+        metrics.counter_from("bot_ledger_server_calls_total", "Calls received from shards.", lambda: server.calls)
+        metrics.gauge("bot_ledger_server_connections", "Connected shard processes.", lambda: server.connections)
+        try:
+            await metrics_server.start()
+        except OSError as e:
+            print(f"Couldn't serve metrics on {METRICS_HOST}:{METRICS_PORT}: {e}")
+    print(f"Ledger service listening on {server.path}")
+    stop = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        await server.close()
+        # Final flush of anything still waiting in the ledger
+        bank.close()
+
+
+# Run the bot. Importing main.py (e.g. from bench.py) sets everything up without connecting
+if __name__ == "__main__":
+    if SERVE_LEDGER:
+        try:
+            asyncio.run(serve_ledger())
+        except KeyboardInterrupt:
+            pass
+    else:
+        bot.run('#YOUR TOKEN')
+
+        # Final flush of anything still waiting in the ledger once the bot shuts down
+        if isinstance(bank, LedgerService):
+            bank.close()
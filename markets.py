@@ -0,0 +1,184 @@
+"""Betting markets, many at once, keyed by guild and channel.
+
+Every ``!start_bet`` opens a ``Market`` with its own id, placements and
+running pool totals, so events in different channels (or several in the same
+channel) no longer queue up behind one global bet.
+
+A market is in one of two modes:
+
+- ``"fixed"``: winners get their stake times the multiplier the admin set,
+  however much was bet on either side
+- ``"pool"`` (parimutuel, ``!start_pool``): every stake goes into one pool.
+  The house keeps ``rake`` percent and the rest is split among the winners in
+  proportion to their stakes, so the odds follow the running per-side totals
+  and the house never pays out more than came in. Payouts are rounded down;
+  the odd coins left over stay with the house. If nobody backed the outcome,
+  every stake is refunded and no rake is taken
+"""
+import itertools
+import time
+
+SIDES = ("win", "lose")
+MODES = ("fixed", "pool")
+
+
+class Market:
+    def __init__(self, market_id, guild_id, channel_id, reason, win_payout, lose_payout, closes_at=None,
+                 mode="fixed", rake=0):
+        if mode not in MODES:
+            raise ValueError(f"Unknown market mode {mode!r}")
+        self.id = market_id
+        self.mode = mode
+        self.rake = rake  # percent of a pool the house keeps
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.reason = reason
+        self.win_payout = win_payout
+        self.lose_payout = lose_payout
+        self.opened_at = time.time()
+        self.closes_at = closes_at
+        self.locked = False
+        # user_id -> {"amount", "prediction", "round"}
+        self.placements = {}
+        # Running totals so listings never have to walk the placements
+        self.pools = {side: 0 for side in SIDES}
+        self.counts = {side: 0 for side in SIDES}
+
+    def is_open(self, now=None):
+        if self.locked:
+            return False
+        return self.closes_at is None or (now or time.time()) < self.closes_at
+
+    def place(self, user_id, amount, prediction, round_id):
+        self.placements[user_id] = {"amount": amount, "prediction": prediction, "round": round_id}
+        self.pools[prediction] += amount
+        self.counts[prediction] += 1
+
+    def payout_for(self, outcome):
+        return self.win_payout if outcome == "win" else self.lose_payout
+
+    def pool_after_rake(self):
+        total = sum(self.pools.values())
+        return total - total * self.rake // 100
+
+    def odds(self):
+        """What a winning coin on each side returns right now, or None for an empty side."""
+        if self.mode == "fixed":
+            return {"win": self.win_payout, "lose": self.lose_payout}
+        pool = self.pool_after_rake()
+        return {side: round(pool / self.pools[side], 2) if self.pools[side] else None for side in SIDES}
+
+    def settle(self, outcome):
+        """Work out a resolution: ``({round: payout}, [(winnings, user_id)], total staked)``.
+
+        One pass over the placements in either mode.
+        """
+        total_staked = sum(self.pools.values())
+        payouts = {}
+        winners = []
+        if self.mode == "pool" and not self.pools[outcome]:
+            # Nobody backed the outcome, so there is no one to split the pool
+            for bet in self.placements.values():
+                payouts[bet["round"]] = bet["amount"]
+            return payouts, winners, total_staked
+        pool = self.pool_after_rake()
+        backed = self.pools[outcome]
+        payout = self.payout_for(outcome)
+        for user_id, bet in self.placements.items():
+            if bet["prediction"] != outcome:
+                payouts[bet["round"]] = 0
+                continue
+            if self.mode == "pool":
+                # Integer maths, so the payouts never add up to more than the pool
+                winnings = bet["amount"] * pool // backed
+            else:
+                # Multipliers can be fractional; payouts are whole coins
+                winnings = int(bet["amount"] * payout)
+            payouts[bet["round"]] = winnings
+            winners.append((winnings, user_id))
+        return payouts, winners, total_staked
+
+    def info(self, now=None):
+        """A plain summary for listings, safe to send to another process."""
+        return {
+            "id": self.id,
+            "mode": self.mode,
+            "rake": self.rake,
+            "odds": self.odds(),
+            "guild_id": self.guild_id,
+            "channel_id": self.channel_id,
+            "reason": self.reason,
+            "win_payout": self.win_payout,
+            "lose_payout": self.lose_payout,
+            "open": self.is_open(now),
+            "status": self.status(now),
+            "pools": dict(self.pools),
+            "counts": dict(self.counts),
+        }
+
+    def status(self, now=None):
+        if self.locked:
+            return "locked"
+        if not self.is_open(now):
+            return "closed"
+        if self.closes_at is None:
+            return "open"
+        return f"open, closes in {int(self.closes_at - (now or time.time()))}s"
+
+
+class MarketRegistry:
+    def __init__(self):
+        self.markets = {}
+        self._by_channel = {}
+        self._ids = itertools.count(1)
+
+    def __len__(self):
+        return len(self.markets)
+
+    def open(self, guild_id, channel_id, reason, win_payout, lose_payout, closes_in=None, mode="fixed", rake=0):
+        closes_at = time.time() + closes_in if closes_in else None
+        market = Market(
+            next(self._ids), guild_id, channel_id, reason, win_payout, lose_payout, closes_at, mode, rake
+        )
+        self.markets[market.id] = market
+        self._by_channel.setdefault((guild_id, channel_id), {})[market.id] = market
+        return market
+
+    def get(self, market_id):
+        return self.markets.get(market_id)
+
+    def in_channel(self, guild_id, channel_id):
+        return list(self._by_channel.get((guild_id, channel_id), {}).values())
+
+    def in_guild(self, guild_id):
+        return [market for market in self.markets.values() if market.guild_id == guild_id]
+
+    def find(self, guild_id, channel_id, market_id=None):
+        """The market a command refers to.
+
+        With no id, the channel's only market is used. Returns the market, or
+        None with a reason when there is no unambiguous match.
+        """
+        if market_id is not None:
+            market = self.markets.get(market_id)
+            if market is None or market.guild_id != guild_id:
+                return None, f"There is no bet #{market_id}."
+            return market, None
+        markets = self.in_channel(guild_id, channel_id)
+        if not markets:
+            return None, "There is no active bet in this channel."
+        if len(markets) > 1:
+            ids = ", ".join(f"#{market.id}" for market in markets)
+            return None, f"Several bets are active here ({ids}). Add the bet number to your command."
+        return markets[0], None
+
+    def remove(self, market_id):
+        market = self.markets.pop(market_id)
+        channel = self._by_channel[(market.guild_id, market.channel_id)]
+        del channel[market_id]
+        if not channel:
+            del self._by_channel[(market.guild_id, market.channel_id)]
+        return market
+
+    def pending_placements(self):
+        return sum(len(market.placements) for market in self.markets.values())
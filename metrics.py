@@ -0,0 +1,170 @@
+"""Counters, gauges and histograms, served in the Prometheus text format.
+
+``Registry`` holds the metrics and renders them for a scrape. Values that
+already live elsewhere (session counts, queue depths, storage byte counts) are
+registered as callbacks and read at scrape time, so nothing has to push them.
+``MetricsServer`` serves ``GET /metrics`` on a local port with aiohttp, which
+discord.py already depends on.
+"""
+import math
+
+from aiohttp import web
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, format_labels(self.labels, key), value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # label values -> [bucket counts..., sum, count]
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labels)
+        series = self.values.get(key)
+        if series is None:
+            series = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+                break
+        series[-2] += value
+        series[-1] += 1
+
+    def samples(self):
+        names = self.labels + ("le",)
+        for key, series in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield f"{self.name}_bucket", format_labels(names, key + (format_value(bound),)), cumulative
+            yield f"{self.name}_sum", format_labels(self.labels, key), series[-2]
+            yield f"{self.name}_count", format_labels(self.labels, key), series[-1]
+
+
+class Callback:
+    """A metric whose samples come from ``read()`` at scrape time.
+
+    ``read`` returns a number, or a dict of label value (tuples) to numbers
+    when ``labels`` are given.
+    """
+
+    def __init__(self, name, help, read, kind="gauge", labels=()):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.kind = kind
+        self.labels = tuple(labels)
+
+    def samples(self):
+        value = self.read()
+        if not self.labels:
+            yield self.name, "", value
+            return
+        for key, sample in value.items():
+            key = key if isinstance(key, tuple) else (key,)
+            yield self.name, format_labels(self.labels, key), sample
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, read, labels=()):
+        return self._add(Callback(name, help, read, "gauge", labels))
+
+    def counter_from(self, name, help, read, labels=()):
+        # A running total kept somewhere else, e.g. bytes a storage backend wrote
+        return self._add(Callback(name, help, read, "counter", labels))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                # One broken callback shouldn't take the whole scrape down
+                print(f"Metric {metric.name} failed: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in samples:
+                lines.append(f"{name}{labels} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    def __init__(self, registry, host="127.0.0.1", port=9100):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    async def _handle(self, request):
+        return web.Response(
+            body=self.registry.render().encode(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    async def start(self):
+        if self._runner is not None:
+            return
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,180 @@
+"""Per-channel outbound message queue.
+
+Replies are queued per channel instead of sent straight away. Each channel
+has at most one send in flight, and replies that arrive within ``window``
+seconds of each other are joined into one message, split at line breaks to
+stay under Discord's length limit. A burst of commands in a busy channel
+therefore turns into a few large messages rather than a pile of small ones
+stuck behind the per-channel rate limit.
+
+``LiveMessages`` does the same for messages that are edited rather than
+sent, such as a pool bet's odds: a burst of changes becomes one edit.
+"""
+import asyncio
+import time
+from collections import deque
+
+
+def split_content(content, limit):
+    """Split text into pieces of at most ``limit`` characters, at line breaks where possible."""
+    if len(content) <= limit:
+        return [content]
+    pieces = []
+    current = ""
+    for line in content.split("\n"):
+        while len(line) > limit:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(line[:limit])
+            line = line[limit:]
+        if current and len(current) + 1 + len(line) > limit:
+            pieces.append(current)
+            current = ""
+        current = f"{current}\n{line}" if current else line
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+class Outbox:
+    def __init__(self, window=0.25, limit=2000, history=1000):
+        self.window = window
+        self.limit = limit
+        self._pending = {}  # channel id -> [(content, future, queued at)]
+        self._workers = {}
+        # Seconds from queueing a reply to Discord accepting the message
+        self.latencies = deque(maxlen=history)
+        self.queued = 0
+        self.sent = 0
+
+    def depth(self):
+        return sum(len(pending) for pending in self._pending.values())
+
+    def post(self, channel, content):
+        """Queue ``content`` for ``channel``; the future resolves to the sent message."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.setdefault(channel.id, []).append((content, future, time.monotonic()))
+        self.queued += 1
+        if channel.id not in self._workers:
+            self._workers[channel.id] = asyncio.create_task(self._drain(channel))
+        return future
+
+    def pack(self, batch):
+        """Join queued replies into as few messages as fit under the limit.
+
+        Returns ``[(text, [(future, queued at), ...]), ...]``; each reply is
+        attached to the message holding its last piece.
+        """
+        messages = []
+        text = ""
+        waiting = []
+        for content, future, queued_at in batch:
+            for piece in split_content(content, self.limit):
+                if text and len(text) + 1 + len(piece) > self.limit:
+                    messages.append((text, waiting))
+                    text = ""
+                    waiting = []
+                text = f"{text}\n{piece}" if text else piece
+            waiting.append((future, queued_at))
+        if text or waiting:
+            messages.append((text, waiting))
+        return messages
+
+    async def _drain(self, channel):
+        try:
+            while self._pending.get(channel.id):
+                # Give the rest of a burst a moment to arrive
+                await asyncio.sleep(self.window)
+                batch = self._pending.pop(channel.id)
+                for text, waiting in self.pack(batch):
+                    try:
+                        message = await channel.send(text)
+                    except Exception as e:
+                        for future, _ in waiting:
+                            if not future.done():
+                                future.set_exception(e)
+                        continue
+                    self.sent += 1
+                    now = time.monotonic()
+                    for future, queued_at in waiting:
+                        self.latencies.append(now - queued_at)
+                        if not future.done():
+                            future.set_result(message)
+        finally:
+            del self._workers[channel.id]
+
+    def latency_percentile(self, percentile):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+    def stats(self):
+        return {
+            "depth": self.depth(),
+            "channels": len(self._workers),
+            "queued": self.queued,
+            "sent": self.sent,
+            "latency_p50": self.latency_percentile(50),
+            "latency_p99": self.latency_percentile(99),
+        }
+
+
+class LiveMessages:
+    """Messages kept current by editing them, at most once per ``interval``.
+
+    ``update`` records the latest text for a message. If the message hasn't
+    been edited for ``interval`` seconds the edit goes out straight away;
+    otherwise one edit is scheduled for when the interval is up, carrying
+    whatever text is latest by then. However many updates arrive, each
+    message costs at most one edit per interval.
+    """
+
+    def __init__(self, interval=3.0):
+        self.interval = interval
+        # key -> {"message", "content", "edited_at", "task"}
+        self._live = {}
+        self.updates = 0
+        self.edits = 0
+
+    def __len__(self):
+        return len(self._live)
+
+    def track(self, key, message):
+        self._live[key] = {"message": message, "content": None, "edited_at": time.monotonic(), "task": None}
+
+    def update(self, key, content):
+        live = self._live.get(key)
+        if live is None:
+            return
+        self.updates += 1
+        live["content"] = content
+        if live["task"] is None:
+            delay = max(0.0, live["edited_at"] + self.interval - time.monotonic())
+            live["task"] = asyncio.create_task(self._edit_after(key, live, delay))
+
+    async def _edit_after(self, key, live, delay):
+        await asyncio.sleep(delay)
+        live["task"] = None
+        if self._live.get(key) is live:
+            await self._edit(live)
+
+    async def _edit(self, live):
+        live["edited_at"] = time.monotonic()
+        self.edits += 1
+        try:
+            await live["message"].edit(content=live["content"])
+        except Exception as e:
+            # A deleted message or a lost permission shouldn't break betting
+            print(f"Couldn't edit live message {live['message'].id}: {e}")
+
+    async def finish(self, key, content):
+        """Edit one last time, straight away, and stop tracking the message."""
+        live = self._live.pop(key, None)
+        if live is None:
+            return
+        if live["task"] is not None:
+            live["task"].cancel()
+        live["content"] = content
+        await self._edit(live)
@@ -0,0 +1,176 @@
+"""On-demand profiling of live commands, and an event-loop lag watchdog.
+
+``CommandProfiler`` runs cProfile while matching commands are in flight,
+driven by the bot's invoke hooks, so ``!profile start slots`` can be turned on
+in production without a restart. cProfile sees everything the event loop
+thread runs while it is enabled, including other coroutines that interleave
+with the profiled command; it does not see worker threads (e.g. the ledger's
+snapshot writes). ``!profile stop`` saves a ``.prof`` file for ``snakeviz`` or
+``pstats`` and reports the functions with the most self time.
+
+``LagMonitor`` wakes every ``interval`` seconds and measures how late it is.
+Anything over ``threshold`` is a stall: some callback held the loop without
+yielding. Stalls are recorded with the commands that were running at the
+time, which narrows down who is blocking the loop.
+"""
+import asyncio
+import cProfile
+import os
+import pstats
+import time
+from collections import Counter, deque
+
+
+class CommandProfiler:
+    def __init__(self, directory="profiles"):
+        self.directory = directory
+        self.profile = None
+        self.commands = None  # None profiles every command
+        self.started_at = None
+        self.calls = 0
+        self._depth = 0
+
+    @property
+    def active(self):
+        return self.profile is not None
+
+    def _matches(self, name):
+        return self.active and (self.commands is None or name in self.commands)
+
+    def start(self, commands=()):
+        if self.active:
+            raise RuntimeError("A profile is already running.")
+        self.profile = cProfile.Profile()
+        self.commands = set(commands) or None
+        self.started_at = time.time()
+        self.calls = 0
+        self._depth = 0
+
+    def command_started(self, name):
+        """Count a command in; returns a token to hand to ``command_finished``."""
+        if not self._matches(name):
+            return None
+        self.calls += 1
+        # Commands overlap on the loop; the profiler stays on while any runs
+        self._depth += 1
+        if self._depth == 1:
+            self.profile.enable()
+        return self.profile
+
+    def command_finished(self, token):
+        # Only commands counted in by this profile count out, so ones that
+        # were already running when it started (or belong to an earlier
+        # profile) can't turn it off early or leave it on
+        if token is None or token is not self.profile:
+            return
+        self._depth -= 1
+        if self._depth == 0:
+            self.profile.disable()
+
+    def stop(self):
+        """Stop profiling and return the profile for ``save``.
+
+        Must run on the event loop thread: cProfile hooks are per thread, so
+        disabling it from a worker would leave the loop profiled.
+        """
+        if not self.active:
+            raise RuntimeError("No profile is running.")
+        profile = self.profile
+        if self._depth:
+            profile.disable()
+        self.profile = None
+        self._depth = 0
+        return profile
+
+    def save(self, profile):
+        """Save a stopped profile. Returns the ``.prof`` path and the stats.
+
+        Disk I/O and stats parsing only, so it can run in a worker thread.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        now = time.time()
+        name = f"profile-{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}-{int(now * 1000) % 1000:03d}.prof"
+        path = os.path.join(self.directory, name)
+        profile.dump_stats(path)
+        try:
+            stats = pstats.Stats(profile)
+        except TypeError:
+            # Nothing matching ran, so there are no stats to load
+            stats = None
+        return path, stats
+
+
+def is_idle(filename, function):
+    # The loop waiting on its selector is idle time, not work
+    return os.path.basename(filename) == "selectors.py" or function.startswith(
+        ("<method 'poll' of 'select.", "<method 'select' of 'select.", "<method 'control' of 'select.")
+    )
+
+
+def hotspots(stats, limit=15):
+    """Top functions by self time, as ``(self s, total s, calls, label)``."""
+    if stats is None:
+        return []
+    rows = []
+    for (filename, line, function), (_, calls, self_time, total_time, _) in stats.stats.items():
+        if is_idle(filename, function):
+            continue
+        location = f"{os.path.basename(filename)}:{line}" if line else filename
+        rows.append((self_time, total_time, calls, f"{function} ({location})"))
+    rows.sort(reverse=True)
+    return rows[:limit]
+
+
+class LagMonitor:
+    def __init__(self, interval=0.1, threshold=0.1, history=600):
+        self.interval = interval
+        self.threshold = threshold
+        self.lags = deque(maxlen=history)
+        self.stalls = deque(maxlen=20)  # (when, lag, commands running)
+        self.stall_count = 0
+        self.worst = 0.0
+        self.in_flight = Counter()
+        self._task = None
+
+    def command_started(self, name):
+        self.in_flight[name] += 1
+
+    def command_finished(self, name):
+        self.in_flight[name] -= 1
+        if self.in_flight[name] <= 0:
+            del self.in_flight[name]
+
+    def percentile(self, percent):
+        if not self.lags:
+            return 0.0
+        ordered = sorted(self.lags)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            # Commands running now may be the ones that stall the wake-up
+            running = sorted(self.in_flight)
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - started - self.interval)
+            self.lags.append(lag)
+            self.worst = max(self.worst, lag)
+            if lag >= self.threshold:
+                self.stall_count += 1
+                running = sorted(set(running) | set(self.in_flight))
+                self.stalls.append((time.time(), lag, running))
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def summary(self):
+        lines = [
+            f"Event loop lag: p50 {self.percentile(50) * 1000:.1f} ms, p99 {self.percentile(99) * 1000:.1f} ms, "
+            f"worst {self.worst * 1000:.0f} ms. {self.stall_count} stalls over {self.threshold * 1000:.0f} ms."
+        ]
+        for when, lag, running in list(self.stalls)[-5:]:
+            during = ", ".join(running) if running else "no command"
+            lines.append(f"- {time.strftime('%H:%M:%S', time.localtime(when))}: {lag * 1000:.0f} ms during {during}")
+        return "\n".join(lines)
@@ -0,0 +1,217 @@
+"""Monte Carlo return-to-player analysis for the games.
+
+Simulates millions of rounds of each game with NumPy, using the payout rules
+from ``games.py``, and reports per game:
+
+- RTP: coins paid back per coin staked (1 - house edge)
+- the standard deviation of a player's net result per round
+- coins created (or destroyed, if negative) per round, which is also the
+  player's mean net result, and per hour at the given command rates
+
+Rates can be given per game (``--rate slots=600``) or estimated from the
+transaction history (``history.py``), which keeps every balance change with
+a timestamp long after the journal has been compacted away:
+
+    python rtp.py --rounds 5000000 --bet 100 --history history --hours 24
+
+The estimate covers the last ``--hours`` of the log (all of it by default).
+The history keeps each user's newest ``HISTORY_KEEP`` changes for
+``HISTORY_RETENTION_DAYS`` days, so a window longer than that undercounts
+the busiest players. A round that leaves the balance unchanged (an rps tie,
+a 0-coin strip) writes no entry, so those games are scaled up by the odds
+of such a round.
+
+Mines depends on how the player plays it, so it is simulated for a fixed
+number of mines and tiles revealed before cashing out (``--mines``,
+``--reveals``). Betting markets pay whatever the admin sets and are not
+simulated. Like the bot itself, it needs NumPy (see requirements.txt).
+"""
+import argparse
+import json
+import os
+from collections import Counter
+
+import numpy as np
+
+from games import (
+    DOORS, DOORS_MULTIPLIERS, MINES_TILES, RPS_CHOICES, SLOT_SYMBOLS, SLOTS_MULTIPLIER, STRIP_RANGE,
+    mines_multiplier,
+)
+
+GAMES = ["slots", "rps", "doors", "mines", "strip"]
+CHUNK = 1_000_000  # rounds sampled per batch, to bound memory
+
+
+# Each simulator returns (staked, returned) arrays for n rounds at a fixed bet
+
+def simulate_slots(rng, n, bet, **options):
+    reels = rng.integers(0, len(SLOT_SYMBOLS), size=(n, 3))
+    jackpot = (reels[:, 0] == reels[:, 1]) & (reels[:, 1] == reels[:, 2])
+    return np.full(n, bet), np.where(jackpot, bet * SLOTS_MULTIPLIER, 0)
+
+
+def simulate_rps(rng, n, bet, **options):
+    # The bot picks uniformly, so the player's choice doesn't matter: the
+    # difference between the two picks decides the round
+    player = rng.integers(0, len(RPS_CHOICES), size=n)
+    bot = rng.integers(0, len(RPS_CHOICES), size=n)
+    difference = (player - bot) % 3
+    # 0: tie (stake back), 1: player's pick beats the bot's (double), 2: loss
+    returned = np.select([difference == 0, difference == 1], [bet, bet * 2], 0)
+    return np.full(n, bet), returned
+
+
+def simulate_doors(rng, n, bet, **options):
+    low, high = DOORS_MULTIPLIERS
+    win = rng.integers(0, len(DOORS), size=n) == 0
+    multiplier = rng.integers(low, high + 1, size=n)
+    return np.full(n, bet), np.where(win, bet * multiplier, 0)
+
+
+def simulate_mines(rng, n, bet, mines=3, reveals=2, **options):
+    # Revealing ``reveals`` tiles is a draw without replacement from the grid,
+    # so the number of mines hit is hypergeometric
+    hits = rng.hypergeometric(mines, MINES_TILES - mines, reveals, size=n)
+    payout = int(bet * mines_multiplier(mines, reveals))
+    return np.full(n, bet), np.where(hits == 0, payout, 0)
+
+
+def simulate_strip(rng, n, bet, **options):
+    # Free to play, so every coin it pays is newly created
+    low, high = STRIP_RANGE
+    return np.zeros(n, dtype=np.int64), rng.integers(low, high + 1, size=n)
+
+
+SIMULATORS = {
+    "slots": simulate_slots,
+    "rps": simulate_rps,
+    "doors": simulate_doors,
+    "mines": simulate_mines,
+    "strip": simulate_strip,
+}
+
+
+def analyze(game, rounds, bet, rng, **options):
+    simulate = SIMULATORS[game]
+    count = 0
+    staked = 0
+    returned = 0
+    net_sum = 0.0
+    net_squares = 0.0
+    while count < rounds:
+        n = min(CHUNK, rounds - count)
+        stakes, payouts = simulate(rng, n, bet, **options)
+        net = (payouts - stakes).astype(np.float64)
+        count += n
+        staked += int(stakes.sum())
+        returned += int(payouts.sum())
+        net_sum += net.sum()
+        net_squares += np.square(net).sum()
+    mean = net_sum / count
+    variance = net_squares / count - mean * mean
+    return {
+        "rounds": count,
+        "rtp": returned / staked if staked else None,
+        "std_net": max(variance, 0.0) ** 0.5,
+        "created_per_round": mean,
+    }
+
+
+# Chance that a round of the game nets 0 coins and so leaves no history entry
+UNLOGGED = {
+    "rps": 1 / len(RPS_CHOICES),  # a tie
+    "strip": 1 / (STRIP_RANGE[1] - STRIP_RANGE[0] + 1),
+}
+
+
+def read_history(path):
+    """Entries of a history log, oldest first. Stops at a line torn by a crash."""
+    with open(path, "r") as file:
+        for line in file:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                return
+
+
+def history_rates(path, hours=None):
+    """Rounds per hour of each game, and the hours of history they come from.
+
+    ``path`` is the history directory or its ``history.log``. Slots, rps and
+    strip are one entry per play; Mines and Doors are counted by their
+    stakes, the negative entries (payouts are positive, losses add none).
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, "history.log")
+    entries = [entry for entry in read_history(path) if entry["r"] in SIMULATORS]
+    if hours is not None and entries:
+        since = entries[-1]["t"] - hours * 3600
+        entries = [entry for entry in entries if entry["t"] >= since]
+    counts = Counter(
+        entry["r"] for entry in entries
+        if entry["r"] not in ("mines", "doors") or entry.get("b", 0) < 0
+    )
+    if not entries or entries[-1]["t"] <= entries[0]["t"]:
+        return {}, 0.0
+    span = (entries[-1]["t"] - entries[0]["t"]) / 3600
+    return {game: count / (1 - UNLOGGED.get(game, 0)) / span for game, count in counts.items()}, span
+
+
+def parse_rates(values):
+    rates = {}
+    for value in values:
+        game, _, rate = value.partition("=")
+        if game not in SIMULATORS or not rate:
+            raise SystemExit(f"Bad rate {value!r}, expected <game>=<rounds per hour>.")
+        rates[game] = float(rate)
+    return rates
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate the games and report their return to player.")
+    parser.add_argument("games", nargs="*", metavar="GAME", help=f"any of {', '.join(GAMES)} (default: all)")
+    parser.add_argument("--rounds", type=int, default=1_000_000, help="rounds simulated per game")
+    parser.add_argument("--bet", type=int, default=100)
+    parser.add_argument("--mines", type=int, default=3, help="mines on the board")
+    parser.add_argument("--reveals", type=int, default=2, help="tiles revealed before cashing out")
+    parser.add_argument("--rate", action="append", default=[], metavar="GAME=PER_HOUR")
+    parser.add_argument("--history", help="estimate rates from this transaction history directory")
+    parser.add_argument("--hours", type=float, help="only use the last HOURS of the history")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+    unknown = set(args.games) - set(GAMES)
+    if unknown:
+        raise SystemExit(f"Unknown games: {', '.join(sorted(unknown))}")
+    if not 1 <= args.mines < MINES_TILES or not 1 <= args.reveals <= MINES_TILES - args.mines:
+        raise SystemExit(f"Choose 1-{MINES_TILES - 1} mines and at most {MINES_TILES} - mines reveals.")
+
+    rates = {}
+    if args.history:
+        rates, hours = history_rates(args.history, args.hours)
+        print(f"Rates estimated from {hours:.1f} hours of history in {args.history}")
+    rates.update(parse_rates(args.rate))
+    rng = np.random.default_rng(args.seed)
+
+    print(f"{args.rounds} rounds per game at a bet of {args.bet} "
+          f"(mines: {args.mines} mines, cash out after {args.reveals} tiles)")
+    print(f"{'game':<8}{'RTP':>9}{'edge':>9}{'std dev':>11}{'coins/round':>13}{'rounds/h':>10}{'coins/h':>12}")
+    total = 0.0
+    for game in args.games or GAMES:
+        result = analyze(game, args.rounds, args.bet, rng, mines=args.mines, reveals=args.reveals)
+        rtp = "-" if result["rtp"] is None else f"{result['rtp']:.2%}"
+        edge = "-" if result["rtp"] is None else f"{1 - result['rtp']:.2%}"
+        rate = rates.get(game)
+        hourly = "-"
+        if rate is not None:
+            total += result["created_per_round"] * rate
+            hourly = f"{result['created_per_round'] * rate:+.0f}"
+        print(
+            f"{game:<8}{rtp:>9}{edge:>9}{result['std_net']:>11.2f}"
+            f"{result['created_per_round']:>+13.2f}{'-' if rate is None else f'{rate:.0f}':>10}{hourly:>12}"
+        )
+    if rates:
+        print(f"Net coins created per hour at these rates: {total:+.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Registry of live game sessions with one shared timeout wheel.
+
+Sessions are keyed by the id of their game message, which is also how
+discord.py's view store routes button clicks to them, so each event reaches
+its game in O(1) and no per-game ``wait_for`` predicates are evaluated
+against unrelated events. Idle timeouts for every game run off a single
+hashed timer wheel ticked by one task, instead of one timeout task per view.
+"""
+import asyncio
+import math
+import time
+
+
+class TimerWheel:
+    def __init__(self, slots=256, tick=1.0):
+        self.tick = tick
+        self.slots = [set() for _ in range(slots)]
+        self.current = 0
+        self.deadlines = {}
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def schedule(self, key, delay):
+        self.cancel(key)
+        target = self.current + max(1, math.ceil(delay / self.tick))
+        self.deadlines[key] = target
+        self.slots[target % len(self.slots)].add(key)
+
+    def cancel(self, key):
+        target = self.deadlines.pop(key, None)
+        if target is not None:
+            self.slots[target % len(self.slots)].discard(key)
+
+    def remaining(self, key):
+        target = self.deadlines.get(key)
+        return None if target is None else (target - self.current) * self.tick
+
+    def advance(self):
+        """Move one tick forward and return the keys that expired."""
+        self.current += 1
+        slot = self.slots[self.current % len(self.slots)]
+        # Keys more than one lap away share the slot but aren't due yet
+        expired = [key for key in slot if self.deadlines[key] <= self.current]
+        for key in expired:
+            slot.discard(key)
+            del self.deadlines[key]
+        return expired
+
+
+class SessionManager:
+    """Live games by message id.
+
+    A session is any object with an ``idle_timeout`` attribute and an async
+    ``on_timeout()`` method; ``GameView`` in ``games.py`` is the usual one.
+    """
+
+    def __init__(self, tick=1.0):
+        self.sessions = {}
+        self.started_at = {}
+        self.wheel = TimerWheel(tick=tick)
+        self._task = None
+        # Running timeouts; the loop only keeps weak references to tasks
+        self._tasks = set()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def register(self, message_id, session):
+        self.sessions[message_id] = session
+        self.started_at[message_id] = time.time()
+        session.manager = self
+        session.session_id = message_id
+        self.wheel.schedule(message_id, session.idle_timeout)
+
+    def touch(self, message_id):
+        # Any activity restarts the idle timeout
+        session = self.sessions.get(message_id)
+        if session is not None:
+            self.wheel.schedule(message_id, session.idle_timeout)
+
+    def unregister(self, message_id):
+        self.wheel.cancel(message_id)
+        self.started_at.pop(message_id, None)
+        return self.sessions.pop(message_id, None)
+
+    def get(self, message_id):
+        return self.sessions.get(message_id)
+
+    def describe(self):
+        """``(message_id, session, age in seconds, seconds until timeout)`` for every session."""
+        now = time.time()
+        return [
+            (message_id, session, now - self.started_at[message_id], self.wheel.remaining(message_id))
+            for message_id, session in self.sessions.items()
+        ]
+
+    async def _expire(self, session):
+        try:
+            await session.on_timeout()
+        except Exception as e:
+            print(f"Session timeout failed: {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.wheel.tick)
+            for message_id in self.wheel.advance():
+                session = self.unregister(message_id)
+                if session is not None:
+                    # Timeouts edit messages, so don't hold up the wheel on them
+                    task = asyncio.create_task(self._expire(session))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        """Stop the wheel and wait for the timeouts already running to settle their games."""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        self._task = None
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
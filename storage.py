@@ -0,0 +1,758 @@
+"""Storage backends behind the ledger.
+
+Every backend exposes the same small interface used by ``Ledger``:
+
+- ``fetch(user_id)`` returns one ``Account`` (see ``account.py``) or ``None``
+- ``write(changes, meta)`` persists ``{user_id: account}`` for every changed
+  account, together with the snapshot metadata, in one atomic step
+- ``meta`` is the metadata stored with the last snapshot (journal position
+  and open game rounds, see ``journal.py``)
+- ``top_balances(limit, offset)`` returns ``[(user_id, account), ...]`` by balance
+- ``iter_accounts()`` returns ``[(user_id, balance, loan, assets), ...]`` for
+  every user, where ``assets`` is the value of their items
+- ``iter_items()`` returns ``[(user_id, {item: count}), ...]`` for every user
+  who owns an item
+- ``reset_balances(balance, meta)`` resets every balance and clears every loan
+- ``count()`` and ``close()``
+- ``stats``: running totals of bytes read and written, writes, and full-file
+  rewrites, for the metrics exporter
+
+``write`` is called from a worker thread, everything else from the event loop.
+
+Run ``python storage.py migrate user_data.json user_data.db`` to copy an
+existing JSON economy into a SQLite database, and ``python storage.py import
+user_data.json user_data.snap`` or ``export user_data.snap user_data.json`` to
+convert between JSON and the binary snapshot format.
+"""
+import argparse
+import json
+import mmap
+import os
+import sqlite3
+import struct
+import tempfile
+import threading
+import zlib
+
+import numpy as np
+
+from account import SCHEMA_VERSION, Account, load_account
+from catalog import ITEMS, canonical_name, price
+
+
+def new_stats():
+    return {"read_bytes": 0, "write_bytes": 0, "writes": 0, "rewrites": 0}
+
+
+def catalog_fingerprint():
+    # Changes whenever an item is added, removed or repriced
+    return zlib.crc32(json.dumps([[item.name, item.price] for item in ITEMS]).encode())
+
+
+def payload_size(rows):
+    # SQLite doesn't report I/O per connection, so count the bytes of the
+    # values going in and out instead
+    return sum(len(str(value)) for row in rows for value in row)
+
+
+def atomic_write_json(path, data):
+    # Write to a temp file in the same directory and rename it over the old
+    # file, so a crash mid-write never leaves a truncated data file behind.
+    # Returns the number of bytes written
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", suffix=".json", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as file:
+            json.dump(data, file)
+            file.flush()
+            os.fsync(file.fileno())
+            size = file.tell()
+        os.replace(tmp_path, path)
+        return size
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class JsonStorage:
+    """The original single-file format. Fine for small servers.
+
+    The file maps user ids to accounts in the compact format from
+    ``account.py``, next to ``_meta`` (the snapshot metadata) and ``_schema``
+    (the record format version; files without it are version 1).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.data = {}
+        self.meta = {}
+        self.stats = new_stats()
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, "r") as file:
+                raw = json.load(file)
+                self.stats["read_bytes"] += file.tell()
+            self.meta = raw.pop("_meta", {})
+            version = raw.pop("_schema", 1)
+            for user_id, record in raw.items():
+                self.data[user_id] = load_account(record, version)
+
+    def _dump(self):
+        # Every write rewrites the whole file, however few records changed
+        data = {"_schema": SCHEMA_VERSION, "_meta": self.meta}
+        for user_id, account in self.data.items():
+            data[user_id] = account.to_dict()
+        self.stats["write_bytes"] += atomic_write_json(self.path, data)
+        self.stats["writes"] += 1
+        self.stats["rewrites"] += 1
+
+    def fetch(self, user_id):
+        with self._lock:
+            account = self.data.get(str(user_id))
+            return account.copy() if account is not None else None
+
+    def write(self, changes, meta=None):
+        with self._lock:
+            self.data.update(changes)
+            if meta is not None:
+                self.meta = meta
+            self._dump()
+
+    def top_balances(self, limit=None, offset=0):
+        with self._lock:
+            ranked = sorted(self.data.items(), key=lambda x: x[1].balance, reverse=True)
+            end = None if limit is None else offset + limit
+            return [(user_id, account.copy()) for user_id, account in ranked[offset:end]]
+
+    def iter_accounts(self):
+        with self._lock:
+            return [(user_id, a.balance, a.loan, a.assets) for user_id, a in self.data.items()]
+
+    def iter_items(self):
+        with self._lock:
+            return [(user_id, dict(a.items)) for user_id, a in self.data.items() if a.items]
+
+    def reset_balances(self, balance, meta=None):
+        with self._lock:
+            for account in self.data.values():
+                account.balance = balance
+                account.loan = 0
+            if meta is not None:
+                self.meta = meta
+            self._dump()
+
+    def count(self):
+        return len(self.data)
+
+    def close(self):
+        pass
+
+
+class SqliteStorage:
+    """Users, loans and items in their own tables, WAL mode, indexed balances.
+
+    The record format version is kept in SQLite's ``user_version``; databases
+    from before it was set are version 1 and get upgraded when opened.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        user_id TEXT PRIMARY KEY,
+        balance NUMERIC NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_users_balance ON users (balance DESC);
+    CREATE TABLE IF NOT EXISTS loans (
+        user_id TEXT PRIMARY KEY REFERENCES users (user_id),
+        amount NUMERIC NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS items (
+        user_id TEXT NOT NULL REFERENCES users (user_id),
+        item TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        PRIMARY KEY (user_id, item)
+    );
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    );
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # The ledger writes from a worker thread, so share one connection and
+        # serialize access to it ourselves
+        self._lock = threading.Lock()
+        self.stats = new_stats()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        self.conn.commit()
+        self._upgrade()
+        self.meta = {
+            key: json.loads(value)
+            for key, value in self.conn.execute("SELECT key, value FROM meta")
+        }
+
+    def _upgrade(self):
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0] or 1
+        if version >= SCHEMA_VERSION:
+            return
+        with self.conn:
+            if version == 1:
+                # Version 2 balances are whole coins
+                self.conn.execute("UPDATE users SET balance = CAST(balance AS INTEGER)")
+                self.conn.execute("UPDATE loans SET amount = CAST(amount AS INTEGER)")
+                # and items are keyed by their catalog name, as in upgrade_v1;
+                # aliases of the same item are merged
+                merged = {}
+                for user_id, item, quantity in self.conn.execute("SELECT user_id, item, quantity FROM items"):
+                    key = (user_id, canonical_name(item))
+                    merged[key] = merged.get(key, 0) + quantity
+                self.conn.execute("DELETE FROM items")
+                self.conn.executemany(
+                    "INSERT INTO items (user_id, item, quantity) VALUES (?, ?, ?)",
+                    [(user_id, item, quantity) for (user_id, item), quantity in merged.items()],
+                )
+            self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _write_meta(self, meta):
+        self.meta = meta
+        self.conn.executemany(
+            "INSERT INTO meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+            [(key, json.dumps(value)) for key, value in meta.items()],
+        )
+
+    def _items(self, user_id):
+        rows = self.conn.execute(
+            "SELECT item, quantity FROM items WHERE user_id = ? ORDER BY item", (user_id,)
+        ).fetchall()
+        self.stats["read_bytes"] += payload_size(rows)
+        return dict(rows)
+
+    def fetch(self, user_id):
+        user_id = str(user_id)
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT u.balance, COALESCE(l.amount, 0) FROM users u "
+                "LEFT JOIN loans l ON l.user_id = u.user_id WHERE u.user_id = ?",
+                (user_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            self.stats["read_bytes"] += payload_size([row])
+            return Account(row[0], row[1], self._items(user_id))
+
+    def write(self, changes, meta=None):
+        users = []
+        loans = []
+        no_loans = []
+        items = []
+        for user_id, account in changes.items():
+            users.append((user_id, account.balance))
+            if account.loan:
+                loans.append((user_id, account.loan))
+            else:
+                no_loans.append((user_id,))
+            items.extend((user_id, item, quantity) for item, quantity in account.items.items())
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO users (user_id, balance) VALUES (?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET balance = excluded.balance",
+                users,
+            )
+            self.conn.executemany(
+                "INSERT INTO loans (user_id, amount) VALUES (?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET amount = excluded.amount",
+                loans,
+            )
+            self.conn.executemany("DELETE FROM loans WHERE user_id = ?", no_loans)
+            self.conn.executemany(
+                "DELETE FROM items WHERE user_id = ?", [(user_id,) for user_id in changes]
+            )
+            self.conn.executemany(
+                "INSERT INTO items (user_id, item, quantity) VALUES (?, ?, ?)", items
+            )
+            if meta is not None:
+                self._write_meta(meta)
+            self.stats["write_bytes"] += payload_size(users) + payload_size(loans) + payload_size(items)
+            self.stats["writes"] += 1
+
+    def top_balances(self, limit=None, offset=0):
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT u.user_id, u.balance, COALESCE(l.amount, 0) FROM users u "
+                "LEFT JOIN loans l ON l.user_id = u.user_id "
+                "ORDER BY u.balance DESC LIMIT ? OFFSET ?",
+                (-1 if limit is None else limit, offset),
+            ).fetchall()
+            self.stats["read_bytes"] += payload_size(rows)
+            return [
+                (user_id, Account(balance, loan, self._items(user_id)))
+                for user_id, balance, loan in rows
+            ]
+
+    def iter_accounts(self):
+        with self._lock:
+            assets = {}
+            items = self.conn.execute("SELECT user_id, item, quantity FROM items").fetchall()
+            for user_id, item, quantity in items:
+                assets[user_id] = assets.get(user_id, 0) + price(item) * quantity
+            rows = self.conn.execute(
+                "SELECT u.user_id, u.balance, COALESCE(l.amount, 0) FROM users u "
+                "LEFT JOIN loans l ON l.user_id = u.user_id"
+            ).fetchall()
+            self.stats["read_bytes"] += payload_size(items) + payload_size(rows)
+        return [(user_id, balance, loan, assets.get(user_id, 0)) for user_id, balance, loan in rows]
+
+    def iter_items(self):
+        with self._lock:
+            rows = self.conn.execute("SELECT user_id, item, quantity FROM items").fetchall()
+            self.stats["read_bytes"] += payload_size(rows)
+        owned = {}
+        for user_id, item, quantity in rows:
+            owned.setdefault(user_id, {})[item] = quantity
+        return list(owned.items())
+
+    def reset_balances(self, balance, meta=None):
+        with self._lock, self.conn:
+            self.conn.execute("UPDATE users SET balance = ?", (balance,))
+            self.conn.execute("DELETE FROM loans")
+            if meta is not None:
+                self._write_meta(meta)
+            self.stats["writes"] += 1
+
+    def count(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+SNAPSHOT_MAGIC = b"BETSNAP\x00"
+SNAPSHOT_VERSION = 1
+# magic, format version, account schema, then: generation, user count, ids
+# offset, records offset, items offset, items length, metadata offset,
+# metadata length, catalog fingerprint
+SNAPSHOT_HEADER = struct.Struct("<8sII9Q")
+# One per user, in the same order as the sorted id column. The inventory is
+# the JSON between items_start and items_end in the items blob
+SNAPSHOT_RECORD = np.dtype([
+    ("balance", "<i8"),
+    ("loan", "<i8"),
+    ("assets", "<i8"),
+    ("items_start", "<u8"),
+    ("items_end", "<u8"),
+])
+
+
+def write_snapshot(path, generation, ids, records, blob, meta):
+    """Atomically write a snapshot file. ``blob`` is the items blob in chunks.
+
+    Returns the number of bytes written.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", suffix=".snap", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as file:
+            ids_at = SNAPSHOT_HEADER.size
+            records_at = ids_at + ids.nbytes
+            items_at = records_at + records.nbytes
+            # The header goes in last, once the offsets are known
+            file.seek(ids_at)
+            file.write(ids.tobytes())
+            file.write(records.tobytes())
+            for chunk in blob:
+                file.write(chunk)
+            meta_at = file.tell()
+            meta_data = json.dumps(meta).encode()
+            file.write(meta_data)
+            size = file.tell()
+            file.seek(0)
+            file.write(SNAPSHOT_HEADER.pack(
+                SNAPSHOT_MAGIC, SNAPSHOT_VERSION, SCHEMA_VERSION, generation, len(ids), ids_at, records_at,
+                items_at, meta_at - items_at, meta_at, len(meta_data), catalog_fingerprint(),
+            ))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+        return size
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class SnapshotStorage:
+    """A memory-mapped binary snapshot plus a log of the changes since.
+
+    The snapshot file holds a header, the sorted user ids as one column of
+    uint64 (the index), one fixed-width ``SNAPSHOT_RECORD`` per id in the
+    same order, a blob of JSON-encoded inventories and the JSON metadata. Opening it maps
+    the file and reads the header, so startup doesn't depend on the number of
+    users. ``fetch`` binary-searches the id column and decodes just that
+    record; pages of the file are only read when something touches them.
+
+    ``write`` appends the changed accounts and the metadata to ``<path>.log``
+    as one line and keeps them in memory. Once ``COMPACT_RECORDS`` accounts are
+    waiting there, and when the storage is closed, they are merged into a new
+    snapshot that is renamed over the old one. Log lines carry the snapshot's
+    generation, so a crash between the rename and emptying the log can't
+    replay stale accounts over a newer snapshot.
+
+    Balances, loans and item values are stored as int64 columns, so
+    ``iter_accounts`` never decodes an inventory unless the catalog's prices
+    have changed since the snapshot was written. User ids must be numeric.
+    """
+
+    COMPACT_RECORDS = 20000
+
+    def __init__(self, path):
+        self.path = path
+        self.log_path = path + ".log"
+        self.meta = {}
+        self.stats = new_stats()
+        self._lock = threading.Lock()
+        self.changes = {}  # accounts written since the snapshot
+        self._added = 0  # how many of them the snapshot doesn't have
+        self._open_snapshot()
+        self._replay_log()
+        self._log = open(self.log_path, "a")
+
+    def _open_snapshot(self):
+        self.generation = 0
+        self.ids = np.zeros(0, dtype="<u8")
+        self.records = np.zeros(0, dtype=SNAPSHOT_RECORD)
+        self._items = b""
+        self._garbage = 0  # inventory bytes no record points at any more
+        self._mmap = None
+        self._stale_assets = False
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return
+        with open(self.path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, format_version, schema, self.generation, count, ids_at, records_at, items_at, items_len,
+         meta_at, meta_len, fingerprint) = SNAPSHOT_HEADER.unpack_from(self._mmap)
+        if magic != SNAPSHOT_MAGIC or format_version != SNAPSHOT_VERSION:
+            raise ValueError(f"{self.path} is not a version {SNAPSHOT_VERSION} snapshot")
+        if schema != SCHEMA_VERSION:
+            raise ValueError(f"{self.path} holds schema {schema} accounts; export it with that version's bot")
+        # Views straight onto the mapped file; nothing is copied or parsed
+        self.ids = np.frombuffer(self._mmap, dtype="<u8", count=count, offset=ids_at)
+        self.records = np.frombuffer(self._mmap, dtype=SNAPSHOT_RECORD, count=count, offset=records_at)
+        self._items = memoryview(self._mmap)[items_at:items_at + items_len]
+        self._garbage = 0
+        self.meta = json.loads(self._mmap[meta_at:meta_at + meta_len])
+        self._stale_assets = fingerprint != catalog_fingerprint()
+        self.stats["read_bytes"] += SNAPSHOT_HEADER.size + meta_len
+
+    def _replay_log(self):
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path, "r") as file:
+            for line in file:
+                self.stats["read_bytes"] += len(line)
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A line torn by a crash; everything in it is in the journal
+                    break
+                if entry["g"] != self.generation:
+                    continue
+                for user_id, record in entry["a"].items():
+                    self._remember(user_id, Account.from_dict(record))
+                if entry.get("m") is not None:
+                    self.meta = entry["m"]
+
+    def _position(self, user_id):
+        # Row of ``user_id`` in the snapshot, or None
+        try:
+            key = int(user_id)
+        except ValueError:
+            return None
+        if not 0 <= key < 2 ** 64:
+            return None
+        row = int(np.searchsorted(self.ids, np.uint64(key)))
+        if row < len(self.ids) and int(self.ids[row]) == key:
+            return row
+        return None
+
+    def _remember(self, user_id, account):
+        if user_id not in self.changes and self._position(user_id) is None:
+            self._added += 1
+        self.changes[user_id] = account
+
+    def _decode(self, row):
+        record = self.records[row]
+        start, end = int(record["items_start"]), int(record["items_end"])
+        items = json.loads(self._items[start:end].tobytes()) if end > start else {}
+        self.stats["read_bytes"] += SNAPSHOT_RECORD.itemsize + end - start
+        return Account(int(record["balance"]), int(record["loan"]), items)
+
+    def _assets(self):
+        # The stored item values, or fresh ones if the catalog changed since
+        if self._stale_assets:
+            assets = self.records["assets"].copy()
+            for row in np.flatnonzero(self.records["items_end"] > self.records["items_start"]):
+                assets[row] = self._decode(row).assets
+            return assets
+        return self.records["assets"]
+
+    def _columns(self):
+        # (ids, balance, loan, assets) for every account, logged changes included
+        ids = [str(user_id) for user_id in self.ids.tolist()]
+        balance = self.records["balance"].copy()
+        loan = self.records["loan"].copy()
+        assets = np.array(self._assets())
+        extra = []
+        for user_id, account in self.changes.items():
+            row = self._position(user_id)
+            if row is None:
+                extra.append((user_id, account.balance, account.loan, account.assets))
+            else:
+                balance[row], loan[row], assets[row] = account.balance, account.loan, account.assets
+        ids.extend(row[0] for row in extra)
+        balance = np.concatenate([balance, np.array([row[1] for row in extra], dtype=np.int64)])
+        loan = np.concatenate([loan, np.array([row[2] for row in extra], dtype=np.int64)])
+        assets = np.concatenate([assets, np.array([row[3] for row in extra], dtype=np.int64)])
+        return ids, balance, loan, assets
+
+    def _compact(self, reset_balance=None):
+        # Merge the logged accounts into a new snapshot, then empty the log
+        count = len(self.ids)
+        user_ids = list(self.changes)
+        accounts = list(self.changes.values())
+        keys = np.array([int(user_id) for user_id in user_ids], dtype="<u8")
+        rows = np.searchsorted(self.ids, keys)
+        found = rows < count
+        found[found] = self.ids[rows[found]] == keys[found]
+        added = np.flatnonzero(~found)
+        rows[added] = count + np.arange(len(added))
+
+        ids = np.concatenate([self.ids, keys[added]])
+        records = np.zeros(len(ids), dtype=SNAPSHOT_RECORD)
+        records[:count] = self.records
+        records["assets"][:count] = self._assets()
+        old = records[rows[found]]
+        garbage = self._garbage + int((old["items_end"] - old["items_start"]).sum())
+
+        # Changed inventories go after the old blob; their old bytes become garbage
+        blob_end = len(self._items)
+        chunks = []
+        starts = np.zeros(len(accounts), dtype="<u8")
+        ends = np.zeros(len(accounts), dtype="<u8")
+        for i, account in enumerate(accounts):
+            if account.items:
+                data = json.dumps(account.items, separators=(",", ":")).encode()
+                starts[i], ends[i] = blob_end, blob_end + len(data)
+                blob_end += len(data)
+                chunks.append(data)
+        records["balance"][rows] = [account.balance for account in accounts]
+        records["loan"][rows] = [account.loan for account in accounts]
+        records["assets"][rows] = [account.assets for account in accounts]
+        records["items_start"][rows] = starts
+        records["items_end"][rows] = ends
+        if reset_balance is not None:
+            records["balance"] = reset_balance
+            records["loan"] = 0
+
+        if len(added):
+            order = np.argsort(ids, kind="stable")
+            ids, records = ids[order], records[order]
+        blob = [self._items] + chunks
+        if garbage > blob_end // 2:
+            # Mostly dead bytes: copy out only the inventories still in use
+            new = b"".join(chunks)
+            old_end = len(self._items)
+            blob, garbage, offset = [], 0, 0
+            for row in np.flatnonzero(records["items_end"] > records["items_start"]):
+                start, end = int(records["items_start"][row]), int(records["items_end"][row])
+                data = self._items[start:end] if start < old_end else new[start - old_end:end - old_end]
+                blob.append(data)
+                records["items_start"][row], records["items_end"][row] = offset, offset + len(data)
+                offset += len(data)
+        self.stats["write_bytes"] += write_snapshot(self.path, self.generation + 1, ids, records, blob, self.meta)
+
+        # Drop the views onto the old file before mapping the new one
+        self.ids = self.records = self._items = None
+        self._mmap = None
+        self._open_snapshot()
+        self._garbage = garbage
+        self.changes = {}
+        self._added = 0
+        self._log.seek(0)
+        self._log.truncate()
+        self.stats["rewrites"] += 1
+
+    def fetch(self, user_id):
+        user_id = str(user_id)
+        with self._lock:
+            account = self.changes.get(user_id)
+            if account is not None:
+                return account.copy()
+            row = self._position(user_id)
+            return self._decode(row) if row is not None else None
+
+    def write(self, changes, meta=None):
+        with self._lock:
+            for user_id in changes:
+                if not str(user_id).isdigit():
+                    raise ValueError(f"Snapshot storage needs numeric user ids, got {user_id!r}")
+            line = json.dumps({
+                "g": self.generation,
+                "a": {str(user_id): account.to_dict() for user_id, account in changes.items()},
+                "m": meta,
+            }) + "\n"
+            self._log.write(line)
+            self._log.flush()
+            os.fsync(self._log.fileno())
+            for user_id, account in changes.items():
+                self._remember(str(user_id), account.copy())
+            if meta is not None:
+                self.meta = meta
+            self.stats["write_bytes"] += len(line)
+            self.stats["writes"] += 1
+            if len(self.changes) >= self.COMPACT_RECORDS:
+                self._compact()
+
+    def top_balances(self, limit=None, offset=0):
+        with self._lock:
+            ids, balance, _, _ = self._columns()
+            order = np.argsort(-balance, kind="stable")
+            end = None if limit is None else offset + limit
+            return [(ids[row], self._fetch_locked(ids[row])) for row in order[offset:end].tolist()]
+
+    def _fetch_locked(self, user_id):
+        account = self.changes.get(user_id)
+        return account.copy() if account is not None else self._decode(self._position(user_id))
+
+    def iter_accounts(self):
+        with self._lock:
+            ids, balance, loan, assets = self._columns()
+        return list(zip(ids, balance.tolist(), loan.tolist(), assets.tolist()))
+
+    def iter_items(self):
+        with self._lock:
+            owned = {}
+            for row in np.flatnonzero(self.records["items_end"] > self.records["items_start"]).tolist():
+                owned[str(int(self.ids[row]))] = self._decode(row).items
+            # Logged changes replace whatever the snapshot holds for a user
+            for user_id, account in self.changes.items():
+                if account.items:
+                    owned[user_id] = dict(account.items)
+                else:
+                    owned.pop(user_id, None)
+        return list(owned.items())
+
+    def reset_balances(self, balance, meta=None):
+        with self._lock:
+            if meta is not None:
+                self.meta = meta
+            self._compact(reset_balance=balance)
+            self.stats["writes"] += 1
+
+    def count(self):
+        with self._lock:
+            return len(self.ids) + self._added
+
+    def close(self):
+        with self._lock:
+            if self.changes:
+                self._compact()
+            self._log.close()
+            self.ids = self.records = self._items = None
+            self._mmap = None
+
+
+BACKENDS = {
+    "json": JsonStorage,
+    "sqlite": SqliteStorage,
+    "snapshot": SnapshotStorage,
+}
+
+
+def open_storage(backend, path):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown storage backend {backend!r}, expected one of {sorted(BACKENDS)}")
+    return BACKENDS[backend](path)
+
+
+def migrate(json_path, sqlite_path):
+    source = JsonStorage(json_path)
+    target = SqliteStorage(sqlite_path)
+    try:
+        target.write(source.data, source.meta)
+    finally:
+        target.close()
+    return len(source.data)
+
+
+def import_snapshot(json_path, snapshot_path):
+    """Write the accounts in a JSON data file out as a new binary snapshot."""
+    source = JsonStorage(json_path)
+    for user_id in source.data:
+        if not user_id.isdigit():
+            raise ValueError(f"Snapshot storage needs numeric user ids, got {user_id!r}")
+    ids = np.array(sorted(int(user_id) for user_id in source.data), dtype="<u8")
+    accounts = [source.data[str(user_id)] for user_id in ids.tolist()]
+    blob = [json.dumps(a.items, separators=(",", ":")).encode() if a.items else b"" for a in accounts]
+    ends = np.cumsum([len(items) for items in blob], dtype=np.int64)
+    records = np.zeros(len(ids), dtype=SNAPSHOT_RECORD)
+    records["balance"] = [account.balance for account in accounts]
+    records["loan"] = [account.loan for account in accounts]
+    records["assets"] = [account.assets for account in accounts]
+    records["items_start"] = ends - [len(items) for items in blob]
+    records["items_end"] = ends
+    for path in (snapshot_path, snapshot_path + ".log"):
+        if os.path.exists(path):
+            os.remove(path)
+    write_snapshot(snapshot_path, 0, ids, records, blob, source.meta)
+    return len(ids)
+
+
+def export_snapshot(snapshot_path, json_path):
+    """Write every account in a binary snapshot (and its log) out as JSON."""
+    source = SnapshotStorage(snapshot_path)
+    try:
+        data = {"_schema": SCHEMA_VERSION, "_meta": source.meta}
+        for row, user_id in enumerate(source.ids.tolist()):
+            data[str(user_id)] = source._decode(row).to_dict()
+        for user_id, account in source.changes.items():
+            data[user_id] = account.to_dict()
+    finally:
+        source.close()
+    atomic_write_json(json_path, data)
+    return len(data) - 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Storage maintenance for the betting bot.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = subparsers.add_parser("migrate", help="Copy a JSON data file into SQLite.")
+    migrate_parser.add_argument("json_path")
+    migrate_parser.add_argument("sqlite_path")
+    import_parser = subparsers.add_parser("import", help="Convert a JSON data file into a binary snapshot.")
+    import_parser.add_argument("json_path")
+    import_parser.add_argument("snapshot_path")
+    export_parser = subparsers.add_parser("export", help="Convert a binary snapshot into a JSON data file.")
+    export_parser.add_argument("snapshot_path")
+    export_parser.add_argument("json_path")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        count = migrate(args.json_path, args.sqlite_path)
+        print(f"Migrated {count} users from {args.json_path} to {args.sqlite_path}.")
+    elif args.command == "import":
+        count = import_snapshot(args.json_path, args.snapshot_path)
+        print(f"Imported {count} users from {args.json_path} into {args.snapshot_path}.")
+    elif args.command == "export":
+        count = export_snapshot(args.snapshot_path, args.json_path)
+        print(f"Exported {count} users from {args.snapshot_path} to {args.json_path}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Economy statistics: running totals against a brute-force recount."""
+import random
+from statistics import median_low
+
+import numpy as np
+
+from account import Account
+from economy_stats import DAY, EconomyStats, exact_totals
+
+ITEMS = ("Rolex", "Lambo", "JetSki")
+NOW = 1_700_000_000.0
+
+
+def random_account(rng):
+    items = {item: rng.randint(1, 3) for item in ITEMS if rng.random() < 0.3}
+    return Account(rng.randint(-50, 5000), rng.choice([0, 0, 100, 250]), items)
+
+
+def brute_force(stats):
+    balances = list(stats.balances.values())
+    supply = sum(balances)
+    spread = sum(abs(a - b) for a in balances for b in balances)
+    top = max(1, int(len(balances) * 0.01))
+    return {
+        "supply": supply,
+        "spread": spread,
+        "gini": spread / (2 * len(balances) * supply),
+        "median": median_low(balances),
+        "top_share": sum(sorted(balances)[-top:]) / supply,
+    }
+
+
+def exact(stats):
+    balance = np.array(list(stats.balances.values()), dtype=np.int64)
+    loan = np.array([stats.loans.get(user_id, 0) for user_id in stats.balances], dtype=np.int64)
+    return exact_totals(balance, loan, stats.holdings)
+
+
+def test_running_totals_match_a_recount_after_random_changes():
+    rng = random.Random(24)
+    stats = EconomyStats()
+    accounts = {}
+    for step in range(2000):
+        # Mostly changes to existing users, some new ones
+        user_id = str(rng.randrange(300))
+        accounts[user_id] = random_account(rng)
+        stats.record_changed(user_id, accounts[user_id])
+
+        if step % 250 == 249:
+            expected = brute_force(stats)
+            assert stats.supply == expected["supply"]
+            assert stats.spread == expected["spread"]
+            assert stats.gini() == expected["gini"]
+            assert stats.median() == expected["median"]
+            assert stats.top_share() == expected["top_share"]
+
+    totals = exact(stats)
+    assert stats.accounts == totals["accounts"] == len(accounts)
+    assert stats.debt == totals["debt"] == sum(account.loan for account in accounts.values())
+    assert (stats.supply, stats.spread) == (totals["supply"], totals["spread"])
+    # Items that nobody owns any more stay at zero
+    assert {item: count for item, count in stats.owners.items() if count} == totals["owners"]
+    assert {item: count for item, count in stats.units.items() if count} == totals["units"]
+    assert totals["owners"]["Rolex"] == sum("Rolex" in account.items for account in accounts.values())
+
+
+def test_load_matches_recording_every_account():
+    rng = random.Random(7)
+    accounts = {str(user_id): random_account(rng) for user_id in range(200)}
+    recorded = EconomyStats()
+    for user_id, account in accounts.items():
+        recorded.record_changed(user_id, account)
+    loaded = EconomyStats()
+    loaded.load(
+        [(user_id, account.balance, account.loan, 0) for user_id, account in accounts.items()],
+        [(user_id, account.items) for user_id, account in accounts.items()],
+    )
+    for key in ("accounts", "supply", "debt", "spread", "holdings"):
+        assert getattr(loaded, key) == getattr(recorded, key)
+    assert loaded.owners == {item: count for item, count in recorded.owners.items() if count}
+    assert loaded.median() == recorded.median()
+
+
+def test_reconcile_corrects_drift_and_reports_it():
+    stats = EconomyStats()
+    stats.record_changed("1", Account(100, 50, {"Rolex": 2}))
+    stats.record_changed("2", Account(300, 0, {}))
+    totals = exact(stats)
+    running = {key: getattr(stats, key) for key in ("accounts", "supply", "debt", "spread")}
+    running.update(owners=dict(stats.owners), units=dict(stats.units))
+    assert stats.reconcile(running, totals) == {}
+
+    # Changes the observer never heard about
+    stats.supply += 7
+    stats.units["Rolex"] = 5
+    stats.owners["Lambo"] = 1
+    running = {key: getattr(stats, key) for key in ("accounts", "supply", "debt", "spread")}
+    running.update(owners=dict(stats.owners), units=dict(stats.units))
+    drift = stats.reconcile(running, totals)
+    assert drift == {"supply": -7, "units:Rolex": -3, "owners:Lambo": -1}
+    assert stats.supply == 400
+    assert stats.units["Rolex"] == 2
+    assert stats.owners["Lambo"] == 0
+    assert (stats.checks, stats.corrections) == (2, 3)
+
+
+def test_balances_reset_keeps_items():
+    stats = EconomyStats()
+    stats.record_changed("1", Account(100, 50, {"Rolex": 1}))
+    stats.record_changed("2", Account(900, 0, {}))
+    stats.balances_reset(1000)
+    assert (stats.supply, stats.debt, stats.spread) == (2000, 0, 0)
+    assert stats.gini() == 0.0
+    assert stats.median() == 1000
+    assert stats.owners == {"Rolex": 1}
+    stats.record_changed("1", Account(1500, 0, {"Rolex": 1}))
+    assert stats.spread == brute_force(stats)["spread"]
+
+
+def test_samples_track_flows_and_the_window_sums_them(tmp_path):
+    path = str(tmp_path / "economy.json")
+    flows = {}
+    stats = EconomyStats(path, samples=3, flows=flows)
+    stats.record_changed("1", Account(1000, 0, {}))
+    stats.sample(NOW - 2 * DAY)
+
+    flows["strip"] = 300
+    stats.sample(NOW - DAY / 2)
+    flows["strip"] = 500
+    flows["doors"] = -100
+    point = stats.sample(NOW)
+    assert point["flows"] == {"strip": 200, "doors": -100}
+
+    # The window starts at the oldest point inside it, so only what came after counts
+    start, window = stats.window(1, NOW)
+    assert start["t"] == NOW - DAY / 2
+    assert window == {"strip": 200, "doors": -100}
+    start, window = stats.window(3, NOW)
+    assert start["t"] == NOW - 2 * DAY
+    assert window == {"strip": 500, "doors": -100}
+    # Flows since the last sample are included too
+    flows["doors"] = -150
+    assert stats.window(1, NOW)[1] == {"strip": 200, "doors": -150}
+
+    summary = stats.summary(1, NOW)
+    assert "Created: strip +200. Removed: doors -150." in summary
+    assert "Nobody owns any items." in summary
+
+    # The ring buffer is saved and keeps only the newest points
+    stats.sample(NOW + 60)
+    reopened = EconomyStats(path, samples=3)
+    assert [point["t"] for point in reopened.series] == [NOW - DAY / 2, NOW, NOW + 60]
+    assert reopened.export_csv().splitlines()[0] == "time,accounts,supply,debt,gini,median,top_share,doors,strip"
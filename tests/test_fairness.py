@@ -0,0 +1,126 @@
+"""Nonce reservations and seeds across restarts of the fair RNG.
+
+As in ``test_journal.py``, a crash is dropping the ``FairRng`` without
+``close``: every reservation is flushed to the log as it is made.
+"""
+import asyncio
+import datetime
+import json
+import os
+
+import fairness
+from fairness import FairRng
+from journal import Journal
+from ledger import Ledger
+from ledger_service import LedgerService
+from markets import MarketRegistry
+from storage import JsonStorage
+
+
+def play(rng, user_id, game, rounds, *params):
+    async def run():
+        results = []
+        for _ in range(rounds):
+            results.append(rng.draw(user_id, game, *params))
+            # Let the lookahead refill between rounds, like between commands
+            await asyncio.sleep(0)
+        return results
+    return asyncio.run(run())
+
+
+def test_never_reuses_a_nonce_after_a_crash(tmp_path):
+    path = os.path.join(tmp_path, "fairness.log")
+    rng = FairRng(path, batch=4, ahead=2)
+    played = play(rng, 1, "slots", 6)
+    assert [nonce for nonce, _ in played] == list(range(6))
+    committed = rng.info(1)["hash"]
+
+    rng = FairRng(path, batch=4, ahead=2)
+    # Same seeds, resumed after everything that was reserved
+    assert rng.info(1)["hash"] == committed
+    nonce, _ = play(rng, 1, "slots", 1)[0]
+    assert nonce >= 6
+    assert nonce <= rng.users["1"].reserved
+
+
+def test_ignores_a_torn_reservation(tmp_path):
+    path = os.path.join(tmp_path, "fairness.log")
+    rng = FairRng(path, batch=4, ahead=2)
+    play(rng, 1, "rps", 3)
+    with open(path, "a") as file:
+        file.write('{"u": "1", "s": "ab')
+
+    rng = FairRng(path, batch=4, ahead=2)
+    nonce, _ = play(rng, 1, "rps", 1)[0]
+    assert nonce >= 3
+
+
+def test_close_compacts_to_one_line_per_user(tmp_path):
+    path = os.path.join(tmp_path, "fairness.log")
+    rng = FairRng(path, batch=2, ahead=1)
+    for user_id in (1, 2):
+        play(rng, user_id, "strip", 5)
+    rng.close()
+    with open(path) as file:
+        entries = [json.loads(line) for line in file]
+    assert sorted(entry["u"] for entry in entries) == ["1", "2"]
+
+
+def test_seeded_mode_is_deterministic(tmp_path):
+    first = FairRng(os.path.join(tmp_path, "a.log"), seed=7)
+    second = FairRng(os.path.join(tmp_path, "b.log"), seed=7)
+    assert play(first, 1, "doors", 5) == play(second, 1, "doors", 5)
+    assert play(first, 2, "mines", 3, 5) == play(second, 2, "mines", 3, 5)
+
+
+def test_rotated_seeds_verify_every_round(tmp_path):
+    rng = FairRng(os.path.join(tmp_path, "fairness.log"), batch=4, ahead=3)
+    played = play(rng, 1, "slots", 5) + play(rng, 1, "mines", 2, 3)
+    committed = rng.info(1)["hash"]
+    revealed = rng.rotate(1)["revealed"]
+
+    assert fairness.seed_hash(revealed["server"]) == committed
+    assert revealed["rounds"] == len(played)
+    for nonce, result in played[:5]:
+        assert fairness.outcome("slots", revealed["server"], revealed["client"], nonce) == result
+    for nonce, result in played[5:]:
+        assert fairness.outcome("mines", revealed["server"], revealed["client"], nonce, 3) == result
+
+
+def open_service(directory):
+    ledger = Ledger(JsonStorage(os.path.join(directory, "data.json")), Journal(os.path.join(directory, "journal")))
+    fair = FairRng(os.path.join(directory, "fairness.log"), batch=4, ahead=2)
+    return LedgerService(ledger, MarketRegistry(), {}, None, datetime.time(0), fair=fair)
+
+
+def test_rotate_keeps_the_seed_while_a_round_is_open(tmp_path):
+    bank = open_service(tmp_path)
+
+    async def run():
+        round_id, nonce, door = await bank.open_game(1, 100, "doors")
+        refused = await bank.rotate_seeds(1)
+        info = await bank.seeds(1)
+        await bank.close_round(round_id, 0, "doors")
+        return nonce, door, refused, info, await bank.rotate_seeds(1)
+
+    nonce, door, refused, info, rotated = asyncio.run(run())
+    # Mid-game the server seed stays secret, so the winning door can't be looked up
+    assert refused is None
+    assert info["revealed"] is None
+    assert rotated["revealed"]["rounds"] == 1
+    # Once the game is settled it is revealed and verifies the round
+    revealed = rotated["revealed"]
+    assert fairness.outcome("doors", revealed["server"], revealed["client"], nonce) == door
+
+
+def test_rotate_keeps_the_seed_while_a_bet_is_open(tmp_path):
+    bank = open_service(tmp_path)
+
+    async def run():
+        await bank.open_market(1, 1, "match", 2.0, 2.0)
+        await bank.place_bet(1, 1, None, "1", 100, "win")
+        return await bank.rotate_seeds(1), await bank.rotate_seeds(2)
+
+    refused, other = asyncio.run(run())
+    assert refused is None
+    assert other["revealed"] is not None
@@ -0,0 +1,119 @@
+"""History: paging back along each user's chain, compaction and retention."""
+from history import DAY, History
+
+NOW = 1_700_000_000.0
+
+
+def fill(history, counts, start=NOW):
+    """Record ``counts[user]`` changes per user, interleaved, one second apart."""
+    seq = max([history.seq] + [pending[0] for pending in history.pending])
+    balances = dict.fromkeys(counts, 0)
+    for step in range(max(counts.values())):
+        for user_id, count in counts.items():
+            if step < count:
+                seq += 1
+                balances[user_id] += step + 1
+                history.pending.append((seq, start + step, user_id, "work", {"b": step + 1}, balances[user_id]))
+    return seq
+
+
+def test_pages_are_newest_first_and_clamped(tmp_path):
+    history = History(str(tmp_path), page_size=3, keep=0, retention_days=0)
+    fill(history, {"1": 7, "2": 2})
+
+    entries, page, pages = history.page(1, 1)
+    assert (page, pages) == (1, 3)
+    assert [entry["b"] for entry in entries] == [7, 6, 5]
+    entries, page, pages = history.page(1, 3)
+    assert [entry["b"] for entry in entries] == [1]
+    # Out of range pages clamp to the first and last
+    assert history.page(1, 99)[1] == 3
+    assert history.page(1, 0)[1] == 1
+    assert [entry["b"] for entry in history.page(2, 1)[0]] == [2, 1]
+    assert history.page(3, 1) is None
+
+    assert [entry["a"] for entry in history.export(1)] == [1, 3, 6, 10, 15, 21, 28]
+    assert history.export(3) == []
+    history.close()
+
+
+def test_reopening_reads_back_lines_after_the_index(tmp_path):
+    history = History(str(tmp_path), page_size=5, keep=0, retention_days=0)
+    fill(history, {"1": 4})
+    history.close()
+    history = History(str(tmp_path), page_size=5, keep=0, retention_days=0)
+    seq = fill(history, {"1": 2, "2": 1})
+    history.flush(NOW)
+    # Dropped without close: the index on disk is older than the log
+    history._file.close()
+
+    history = History(str(tmp_path), page_size=5, keep=0, retention_days=0)
+    assert history.seq == seq
+    assert history.page(1, 1)[2] == 2
+    assert len(history.export(1)) == 6
+    assert len(history.export(2)) == 1
+    history.close()
+
+
+def test_reopening_truncates_a_torn_line(tmp_path):
+    history = History(str(tmp_path), keep=0, retention_days=0)
+    fill(history, {"1": 3})
+    history.close()
+    with open(history.path, "ab") as file:
+        file.write(b'{"s":4,"t":1,"u":"1","r":"wo')
+
+    history = History(str(tmp_path), keep=0, retention_days=0)
+    assert history.seq == 3
+    assert [entry["b"] for entry in history.export(1)] == [1, 2, 3]
+    fill(history, {"1": 1}, start=NOW + 10)
+    assert len(history.export(1)) == 4
+    history.close()
+
+
+def test_compact_keeps_each_users_newest_lines(tmp_path):
+    history = History(str(tmp_path), page_size=2, keep=3, retention_days=0)
+    fill(history, {"1": 5, "2": 2})
+    history.compact(NOW + 100)
+
+    assert [entry["b"] for entry in history.export(1)] == [3, 4, 5]
+    assert [entry["b"] for entry in history.export(2)] == [1, 2]
+    assert history.heads["1"][1] == 3
+    entries, page, pages = history.page(1, 2)
+    assert (page, pages) == (2, 2)
+    assert [entry["b"] for entry in entries] == [3]
+    assert history.compactions == 1
+    history.close()
+
+    # The rewritten chains and index survive a restart
+    history = History(str(tmp_path), page_size=2, keep=3, retention_days=0)
+    assert [entry["b"] for entry in history.export(1)] == [3, 4, 5]
+    history.close()
+
+
+def test_compact_drops_lines_past_retention(tmp_path):
+    history = History(str(tmp_path), keep=0, retention_days=30)
+    fill(history, {"1": 2, "2": 1}, start=NOW - 40 * DAY)
+    fill(history, {"1": 1}, start=NOW)
+    history.compact(NOW)
+
+    assert [entry["b"] for entry in history.export(1)] == [1]
+    assert history.export(1)[0]["t"] == NOW
+    # A user with nothing recent has no history left at all
+    assert history.page(2, 1) is None
+    assert len(history) == 1
+    history.close()
+
+
+def test_flush_compacts_once_the_log_has_grown(tmp_path):
+    history = History(str(tmp_path), keep=2, retention_days=0, compact_growth=2.0, compact_min_bytes=0)
+    history.compacted_at = NOW
+    fill(history, {"1": 6})
+    history.flush(NOW)
+    assert history.compactions == 1
+    assert len(history.export(1)) == 2
+    # Nothing new to grow by, and less than a day later: no compaction
+    history.flush(NOW + 60)
+    assert history.compactions == 1
+    history.flush(NOW + DAY)
+    assert history.compactions == 2
+    history.close()
@@ -0,0 +1,242 @@
+"""Crash recovery: journal replay on top of the last snapshot.
+
+A "crash" here is dropping the ledger without ``close`` or ``flush``; every
+journal append is already flushed to the file, so reopening the same
+directory sees exactly what a restarted bot would.
+"""
+import json
+import os
+
+import pytest
+
+from account import DEFAULT_BALANCE
+from history import History
+from journal import Journal
+from ledger import Ledger
+from storage import JsonStorage
+
+
+def open_ledger(directory, with_history=False):
+    storage = JsonStorage(os.path.join(directory, "data.json"))
+    transactions = History(os.path.join(directory, "history")) if with_history else None
+    return Ledger(storage, Journal(os.path.join(directory, "journal")), history=transactions)
+
+
+def restart(directory, with_history=False):
+    ledger = open_ledger(directory, with_history)
+    replayed, refunded = ledger.recover()
+    return ledger, replayed, refunded
+
+
+def test_replays_changes_that_were_never_snapshotted(tmp_path):
+    ledger = open_ledger(tmp_path)
+    ledger.adjust(1, "slots", balance=-50)
+    ledger.adjust(1, "slots", balance=120)
+    ledger.adjust(2, "loan", balance=500, loan=500)
+    ledger.adjust(2, "buy", items={"Rolex": 2})
+
+    ledger, replayed, refunded = restart(tmp_path)
+    assert (replayed, refunded) == (4, 0)
+    assert ledger.get(1).balance == DEFAULT_BALANCE + 70
+    assert ledger.get(2).balance == DEFAULT_BALANCE + 500
+    assert ledger.get(2).loan == 500
+    assert ledger.get(2).items == {"Rolex": 2}
+
+
+def test_replays_only_the_tail_after_a_snapshot(tmp_path):
+    ledger = open_ledger(tmp_path)
+    ledger.adjust(1, "slots", balance=-100)
+    ledger.flush()
+    ledger.adjust(1, "slots", balance=30)
+
+    ledger, replayed, _ = restart(tmp_path)
+    assert replayed == 1
+    assert ledger.get(1).balance == DEFAULT_BALANCE - 70
+
+
+def test_snapshot_compacts_the_journal(tmp_path):
+    ledger = open_ledger(tmp_path)
+    ledger.adjust(1, "slots", balance=-100)
+    first = ledger.journal.segments()
+    assert len(first) == 1
+    ledger.flush()
+    ledger.adjust(1, "slots", balance=10)
+    segments = ledger.journal.segments()
+    assert first[0] not in segments
+    assert len(segments) == 1
+
+
+def test_refunds_rounds_open_at_the_crash(tmp_path):
+    ledger = open_ledger(tmp_path)
+    # Mid-doors: the stake is taken, no door has been picked yet
+    round_id, balance = ledger.open_round(1, 200, "doors")
+    assert balance == DEFAULT_BALANCE - 200
+    assert round_id in ledger.open_rounds
+
+    ledger, replayed, refunded = restart(tmp_path)
+    assert (replayed, refunded) == (1, 1)
+    assert ledger.open_rounds == {}
+    assert ledger.get(1).balance == DEFAULT_BALANCE
+    # The refund itself is stored, so a second restart doesn't pay it twice
+    ledger, _, refunded = restart(tmp_path)
+    assert refunded == 0
+    assert ledger.get(1).balance == DEFAULT_BALANCE
+
+
+def test_keeps_rounds_settled_before_the_crash(tmp_path):
+    ledger = open_ledger(tmp_path)
+    round_id, _ = ledger.open_round(1, 200, "doors")
+    ledger.close_round(round_id, 600, "doors")
+
+    ledger, replayed, refunded = restart(tmp_path)
+    assert (replayed, refunded) == (2, 0)
+    assert ledger.get(1).balance == DEFAULT_BALANCE + 400
+
+
+def test_open_rounds_survive_a_snapshot(tmp_path):
+    ledger = open_ledger(tmp_path)
+    round_id, _ = ledger.open_round(1, 200, "mines")
+    ledger.flush()
+    assert ledger.storage.meta["open_rounds"] == {round_id: ["1", 200, "mines"]}
+
+    ledger, replayed, refunded = restart(tmp_path)
+    assert (replayed, refunded) == (0, 1)
+    assert ledger.get(1).balance == DEFAULT_BALANCE
+
+
+def test_ignores_a_torn_last_line(tmp_path):
+    ledger = open_ledger(tmp_path)
+    ledger.adjust(1, "slots", balance=-50)
+    ledger.adjust(1, "slots", balance=-25)
+    (segment,) = ledger.journal.segments()
+    with open(segment, "a") as file:
+        file.write('{"s": 3, "t": 1700000000.0, "u": "1", "r": "slo')
+
+    ledger, replayed, _ = restart(tmp_path)
+    assert replayed == 2
+    assert ledger.get(1).balance == DEFAULT_BALANCE - 75
+    # New entries go to a new segment and don't reuse the torn one's numbers
+    assert ledger.adjust(1, "slots", balance=5).balance == DEFAULT_BALANCE - 70
+    entries = list(ledger.journal.read())
+    assert [entry["s"] for entry in entries][-1] > 2
+
+
+def test_journal_lines_are_compact_deltas(tmp_path):
+    ledger = open_ledger(tmp_path)
+    ledger.adjust(1, "buy", balance=-5000, items={"Rolex": 1})
+    ledger.adjust(1, "sell", balance=3500, items={"Rolex": -1})
+    (segment,) = ledger.journal.segments()
+    with open(segment) as file:
+        entry = json.loads(file.readlines()[-1])
+    assert {key: entry[key] for key in ("s", "u", "r", "b", "i")} == {
+        "s": 2, "u": "1", "r": "sell", "b": 3500, "i": {"Rolex": -1},
+    }
+
+
+def open_bets(ledger, stakes):
+    return {ledger.open_round(user_id, stake, "bet")[0]: stake for user_id, stake in stakes.items()}
+
+
+def test_replays_a_settled_batch_in_full(tmp_path):
+    ledger = open_ledger(tmp_path)
+    rounds = open_bets(ledger, {1: 100, 2: 200, 3: 300})
+    payouts = dict(zip(rounds, (250, 0, 750)))
+    ledger.settle_rounds(payouts, "resolve_bet")
+
+    ledger, replayed, refunded = restart(tmp_path)
+    assert (replayed, refunded) == (4, 0)
+    assert ledger.open_rounds == {}
+    assert [ledger.get(user_id).balance for user_id in (1, 2, 3)] == [
+        DEFAULT_BALANCE + 150, DEFAULT_BALANCE - 200, DEFAULT_BALANCE + 450,
+    ]
+
+
+def test_refunds_every_stake_when_the_batch_was_torn(tmp_path):
+    ledger = open_ledger(tmp_path)
+    rounds = open_bets(ledger, {1: 100, 2: 200})
+    ledger.settle_rounds(dict.fromkeys(rounds, 0), "resolve_bet")
+    # Cut the batch entry in half, as if the crash hit during the write
+    (segment,) = ledger.journal.segments()
+    with open(segment) as file:
+        lines = file.readlines()
+    with open(segment, "w") as file:
+        file.writelines(lines[:-1])
+        file.write(lines[-1][:len(lines[-1]) // 2])
+
+    ledger, replayed, refunded = restart(tmp_path)
+    assert (replayed, refunded) == (2, 2)
+    assert ledger.get(1).balance == DEFAULT_BALANCE
+    assert ledger.get(2).balance == DEFAULT_BALANCE
+
+
+def test_rejects_a_batch_with_unknown_rounds_without_paying_any(tmp_path):
+    ledger = open_ledger(tmp_path)
+    (round_id,) = open_bets(ledger, {1: 100})
+    with pytest.raises(KeyError):
+        ledger.settle_rounds({round_id: 200, "999": 50}, "resolve_bet")
+    assert round_id in ledger.open_rounds
+    assert ledger.get(1).balance == DEFAULT_BALANCE - 100
+    assert len(list(ledger.journal.read())) == 1
+
+
+def history_of(ledger, user_id):
+    return [(entry["r"], entry.get("b"), entry["a"]) for entry in ledger.history.export(user_id)]
+
+
+def test_history_catches_up_from_the_journal(tmp_path):
+    ledger = open_ledger(tmp_path, with_history=True)
+    ledger.adjust(1, "slots", balance=-50)
+    ledger.flush()
+    # Journaled but still only buffered in the history when the bot dies
+    ledger.adjust(1, "strip", balance=80)
+
+    ledger, replayed, _ = restart(tmp_path, with_history=True)
+    assert replayed == 1
+    assert history_of(ledger, 1) == [
+        ("slots", -50, DEFAULT_BALANCE - 50), ("strip", 80, DEFAULT_BALANCE + 30),
+    ]
+    # Nothing is recorded twice by another restart
+    ledger.close()
+    ledger, _, _ = restart(tmp_path, with_history=True)
+    assert len(history_of(ledger, 1)) == 2
+
+
+def test_history_survives_a_crash_during_the_snapshot(tmp_path, monkeypatch):
+    ledger = open_ledger(tmp_path, with_history=True)
+    ledger.adjust(1, "slots", balance=-50)
+
+    def crash(changes, meta=None):
+        raise OSError("disk full")
+
+    # The process dies writing the snapshot, after the history was written
+    monkeypatch.setattr(ledger.storage, "write", crash)
+    with pytest.raises(OSError):
+        ledger.flush()
+    monkeypatch.undo()
+
+    ledger, replayed, _ = restart(tmp_path, with_history=True)
+    assert replayed == 1
+    assert ledger.get(1).balance == DEFAULT_BALANCE - 50
+    assert history_of(ledger, 1) == [("slots", -50, DEFAULT_BALANCE - 50)]
+
+
+def test_snapshot_waits_for_the_history(tmp_path, monkeypatch):
+    ledger = open_ledger(tmp_path, with_history=True)
+    ledger.adjust(1, "slots", balance=-50)
+
+    def crash(now=None):
+        raise OSError("disk full")
+
+    # The history can't be written: the snapshot must not move past the
+    # journal entries it would catch up from
+    monkeypatch.setattr(ledger.history, "flush", crash)
+    with pytest.raises(OSError):
+        ledger.flush()
+    assert ledger.storage.meta.get("journal_seq", 0) == 0
+    assert ledger.journal.segments()
+    assert ledger.dirty == {"1"}
+    monkeypatch.undo()
+
+    ledger, replayed, _ = restart(tmp_path, with_history=True)
+    assert replayed == 1
+    assert history_of(ledger, 1) == [("slots", -50, DEFAULT_BALANCE - 50)]
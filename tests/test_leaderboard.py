@@ -0,0 +1,110 @@
+"""Rank and sum indexes behind the leaderboards, checked against a sorted list."""
+import random
+from bisect import bisect_left
+
+from account import Account
+from leaderboard import Leaderboard, NetWorthLeaderboard, RankIndex, SumIndex
+
+
+class SmallRankIndex(RankIndex):
+    LOAD = 4  # tiny buckets, so a few hundred keys split and empty plenty
+
+
+class SmallSumIndex(SumIndex):
+    LOAD = 4
+
+
+def check_index(index, expected):
+    assert len(index) == len(expected)
+    assert index.slice(0, len(expected) + 5) == expected
+    for start in range(0, len(expected), 7):
+        assert index.slice(start, start + 10) == expected[start:start + 10]
+    for key in expected:
+        assert index.position(key) == bisect_left(expected, key)
+
+
+def test_rank_index_matches_a_sorted_list():
+    rng = random.Random(1)
+    keys = [(rng.randrange(1000), f"u{i}") for i in range(200)]
+    index = SmallRankIndex(keys[:50])
+    expected = sorted(keys[:50])
+    check_index(index, expected)
+    for key in keys[50:]:
+        index.insert(key)
+        expected.append(key)
+    expected.sort()
+    check_index(index, expected)
+    rng.shuffle(keys)
+    for key in keys[:180]:
+        index.remove(key)
+        expected.remove(key)
+    check_index(index, expected)
+    for key in keys[180:]:
+        index.remove(key)
+    assert len(index) == 0
+    assert index.slice(0, 10) == []
+    index.insert((5, "again"))
+    assert index.slice(0, 10) == [(5, "again")]
+
+
+def test_sum_index_matches_brute_force():
+    rng = random.Random(2)
+    values = [rng.randrange(-500, 5000) for _ in range(150)]
+    index = SmallSumIndex(values[:40])
+    live = values[:40]
+    for value in values[40:]:
+        index.insert(value)
+        live.append(value)
+    for value in rng.sample(live, 60):
+        index.remove(value)
+        live.remove(value)
+    live.sort()
+    assert index.total() == sum(live)
+    for position, value in enumerate(live):
+        assert index.at(position) == value
+    for count in range(len(live) + 2):
+        assert index.smallest_sum(count) == sum(live[:count])
+    for value in (-1000, 0, live[0], live[len(live) // 2], live[-1], 10000):
+        below = [v for v in live if v < value]
+        assert index.below(value) == (len(below), sum(below))
+
+
+def accounts(balances):
+    return [(str(user_id), balance, 0, 0) for user_id, balance in balances.items()]
+
+
+def brute_ranking(balances):
+    # Highest balance first, ties by user id, as the index orders them
+    return sorted(balances, key=lambda user_id: (-balances[user_id], str(user_id)))
+
+
+def test_leaderboard_ranks_and_pages_follow_changes():
+    rng = random.Random(3)
+    balances = {user_id: rng.randrange(5000) for user_id in range(1, 40)}
+    board = Leaderboard(page_size=5)
+    board.load(accounts(balances))
+    # Render (and cache) every page before changing anything
+    for page in range(1, board.page_count() + 1):
+        board.render_page(page)
+    for _ in range(100):
+        user_id = rng.randrange(1, 50)  # some of them new
+        balances[user_id] = rng.randrange(5000)
+        board.record_changed(str(user_id), Account(balances[user_id]))
+    ranking = brute_ranking(balances)
+    for rank, user_id in enumerate(ranking, 1):
+        assert board.rank(user_id) == rank
+    top = [f"#{rank} <@{user_id}>: {balances[user_id]} coins (Debt: 0)" for rank, user_id in enumerate(ranking, 1)]
+    assert board.page_count() == -(-len(ranking) // 5)
+    for page in range(1, board.page_count() + 1):
+        assert board.render_page(page) == "\n".join(top[(page - 1) * 5:page * 5])
+    assert board.rank(999) is None
+
+
+def test_networth_counts_items_and_debt():
+    board = NetWorthLeaderboard(page_size=10)
+    board.load([("1", 1000, 0, 0), ("2", 500, 0, 0)])
+    board.record_changed("2", Account(500, 0, {"Rolex": 1}))
+    assert board.rank("2") == 1
+    board.record_changed("2", Account(500, 5000, {"Rolex": 1}))
+    assert board.rank("2") == 2
+    assert board.scores["2"] == 500 + 5000 - 5000
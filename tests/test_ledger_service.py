@@ -0,0 +1,50 @@
+"""Same-user operations through the ledger service serialize on the account lock."""
+import asyncio
+import datetime
+import os
+
+from account import DEFAULT_BALANCE
+from journal import Journal
+from ledger import Ledger
+from ledger_service import LedgerService
+from markets import MarketRegistry
+from storage import JsonStorage
+
+
+def open_service(directory):
+    ledger = Ledger(JsonStorage(os.path.join(directory, "data.json")), Journal(os.path.join(directory, "journal")))
+    return LedgerService(ledger, MarketRegistry(), {}, None, datetime.time(0))
+
+
+def test_open_round_refuses_a_stake_above_the_balance(tmp_path):
+    bank = open_service(tmp_path)
+    assert asyncio.run(bank.open_round(1, DEFAULT_BALANCE + 1, "mines")) is None
+    assert bank.ledger.open_rounds == {}
+    round_id, balance = asyncio.run(bank.open_round(1, DEFAULT_BALANCE, "mines"))
+    assert balance == 0
+    assert round_id in bank.ledger.open_rounds
+
+
+def test_open_round_waits_for_a_transaction_on_the_account(tmp_path):
+    bank = open_service(tmp_path)
+
+    async def run():
+        sent = asyncio.Event()
+
+        async def send_everything():
+            async with bank.transaction(1, 2, reason="send") as tx:
+                # The check passed; the game must not take the coins before this commits
+                tx.adjust(1, balance=-DEFAULT_BALANCE)
+                tx.adjust(2, balance=DEFAULT_BALANCE)
+                sent.set()
+                await asyncio.sleep(0.01)
+
+        task = asyncio.create_task(send_everything())
+        await sent.wait()
+        opened = await bank.open_round(1, 500, "doors")
+        await task
+        return opened
+
+    assert asyncio.run(run()) is None
+    assert bank.ledger.get(1).balance == 0
+    assert bank.ledger.get(2).balance == 2 * DEFAULT_BALANCE
@@ -0,0 +1,214 @@
+"""Markets: finding them by channel, pool payouts, and resolving one as a journal batch."""
+import asyncio
+import datetime
+import json
+import os
+
+from account import DEFAULT_BALANCE
+from journal import Journal
+from ledger import Ledger
+from ledger_service import LedgerService
+from markets import Market, MarketRegistry
+from storage import JsonStorage
+
+
+def test_find_uses_the_channels_only_market():
+    registry = MarketRegistry()
+    assert registry.find(10, 20) == (None, "There is no active bet in this channel.")
+    market = registry.open(10, 20, "match", 2, 2)
+    registry.open(10, 21, "other channel", 2, 2)
+    registry.open(11, 20, "other guild", 2, 2)
+    assert registry.find(10, 20) == (market, None)
+    assert registry.in_channel(10, 20) == [market]
+    assert len(registry.in_guild(10)) == 2
+    assert len(registry) == 3
+
+
+def test_find_needs_an_id_when_a_channel_has_several_markets():
+    registry = MarketRegistry()
+    first = registry.open(10, 20, "first half", 2, 2)
+    second = registry.open(10, 20, "second half", 2, 2)
+    market, error = registry.find(10, 20)
+    assert market is None
+    assert f"#{first.id}, #{second.id}" in error
+    assert registry.find(10, 20, second.id) == (second, None)
+    # An id works from any channel, but not from another guild
+    assert registry.find(10, 99, first.id) == (first, None)
+    assert registry.find(11, 20, first.id) == (None, f"There is no bet #{first.id}.")
+    assert registry.find(10, 20, 999) == (None, "There is no bet #999.")
+
+
+def test_remove_leaves_the_channels_other_markets():
+    registry = MarketRegistry()
+    first = registry.open(10, 20, "first half", 2, 2)
+    second = registry.open(10, 20, "second half", 2, 2)
+    first.place(1, 50, "win", "1")
+    second.place(1, 60, "lose", "2")
+    second.place(2, 70, "win", "3")
+    assert registry.pending_placements() == 3
+    assert registry.remove(first.id) is first
+    assert registry.find(10, 20) == (second, None)
+    registry.remove(second.id)
+    assert registry.in_channel(10, 20) == []
+    assert registry._by_channel == {}
+    # Ids are never reused
+    assert registry.open(10, 20, "extra time", 2, 2).id == second.id + 1
+
+
+def test_markets_close_on_time_or_when_locked():
+    registry = MarketRegistry()
+    market = registry.open(10, 20, "match", 2, 2, closes_in=60)
+    now = market.closes_at - 30
+    assert market.is_open(now)
+    assert market.status(now) == "open, closes in 30s"
+    assert not market.is_open(market.closes_at)
+    assert market.status(market.closes_at) == "closed"
+    market.locked = True
+    assert not market.is_open(now)
+    assert market.info(now)["status"] == "locked"
+    assert registry.open(10, 20, "no deadline", 2, 2).status() == "open"
+
+
+def test_place_keeps_running_totals():
+    market = Market(1, 10, 20, "match", 2, 3)
+    market.place(1, 50, "win", "1")
+    market.place(2, 70, "win", "2")
+    market.place(3, 20, "lose", "3")
+    assert market.pools == {"win": 120, "lose": 20}
+    assert market.counts == {"win": 2, "lose": 1}
+    assert market.odds() == {"win": 2, "lose": 3}
+
+
+def pool_market(placements, rake=0):
+    market = Market(1, 10, 20, "match", 0, 0, mode="pool", rake=rake)
+    for round_id, (user_id, amount, prediction) in enumerate(placements, 1):
+        market.place(user_id, amount, prediction, str(round_id))
+    return market
+
+
+def test_pool_splits_what_is_left_after_the_rake_by_stake():
+    market = pool_market([(1, 100, "win"), (2, 300, "win"), (3, 600, "lose")], rake=10)
+    assert market.pool_after_rake() == 900
+    assert market.odds() == {"win": 2.25, "lose": 1.5}
+
+    payouts, winners, total_staked = market.settle("win")
+    assert payouts == {"1": 225, "2": 675, "3": 0}
+    assert sorted(winners) == [(225, 1), (675, 2)]
+    assert total_staked == 1000
+
+
+def test_pool_rounds_payouts_down_and_the_house_keeps_the_remainder():
+    market = pool_market([(1, 100, "win"), (2, 200, "win"), (3, 301, "lose")], rake=5)
+    # 601 staked, 30 raked, 571 split over the 300 on "win"
+    assert market.pool_after_rake() == 571
+    payouts, _, _ = market.settle("win")
+    assert payouts == {"1": 190, "2": 380, "3": 0}
+    assert sum(payouts.values()) == 570
+
+    # Three equal winners can't split 100 evenly
+    market = pool_market([(1, 10, "lose"), (2, 10, "lose"), (3, 10, "lose"), (4, 70, "win")])
+    payouts, _, _ = market.settle("lose")
+    assert payouts == {"1": 33, "2": 33, "3": 33, "4": 0}
+
+
+def test_pool_nobody_backed_refunds_every_stake_without_rake():
+    market = pool_market([(1, 100, "win"), (2, 50, "win")], rake=10)
+    assert market.odds() == {"win": 0.9, "lose": None}
+    payouts, winners, total_staked = market.settle("lose")
+    assert payouts == {"1": 100, "2": 50}
+    assert winners == []
+    assert total_staked == 150
+
+
+def test_fixed_market_pays_whole_coins_at_the_multiplier():
+    market = Market(1, 10, 20, "match", 1.5, 3)
+    market.place(1, 25, "win", "1")
+    market.place(2, 40, "lose", "2")
+    assert market.settle("win") == ({"1": 37, "2": 0}, [(37, 1)], 65)
+    assert market.settle("lose")[0] == {"1": 0, "2": 120}
+
+
+def open_service(directory):
+    ledger = Ledger(JsonStorage(os.path.join(directory, "data.json")), Journal(os.path.join(directory, "journal")))
+    return LedgerService(ledger, MarketRegistry(), {}, None, datetime.time(0))
+
+
+def run_pool(bank, stakes, rake=10):
+    async def run():
+        market = await bank.open_market(10, 20, "match", 0, 0, mode="pool", rake=rake)
+        for user_id, (amount, prediction) in stakes.items():
+            _, error = await bank.place_bet(10, 20, market["id"], user_id, amount, prediction)
+            assert error is None
+        return await bank.resolve_market(10, 20, market["id"], "win")
+
+    return asyncio.run(run())
+
+
+def restart(directory):
+    bank = open_service(directory)
+    replayed, refunded = bank.ledger.recover()
+    return bank, replayed, refunded
+
+
+def test_resolving_a_pool_is_one_journal_batch(tmp_path):
+    bank = open_service(tmp_path)
+    result, error = run_pool(bank, {1: (100, "win"), 2: (300, "win"), 3: (600, "lose")})
+    assert error is None
+    assert (result["bettors"], result["winners"]) == (3, 2)
+    assert (result["total_staked"], result["total_paid"]) == (1000, 900)
+    assert result["top"] == [(675, 2), (225, 1)]
+    assert bank.ledger.open_rounds == {}
+    assert len(bank.markets) == 0
+
+    entries = list(bank.ledger.journal.read())
+    # Three stakes, then every payout in a single entry
+    assert len(entries) == 4
+    assert sorted(payout for _, payout in entries[-1]["batch"]) == [0, 225, 675]
+
+    bank, replayed, refunded = restart(tmp_path)
+    assert (replayed, refunded) == (4, 0)
+    assert [bank.ledger.get(user_id).balance for user_id in (1, 2, 3)] == [
+        DEFAULT_BALANCE + 125, DEFAULT_BALANCE + 375, DEFAULT_BALANCE - 600,
+    ]
+
+
+def test_a_torn_pool_batch_refunds_every_stake(tmp_path):
+    bank = open_service(tmp_path)
+    run_pool(bank, {1: (100, "win"), 2: (300, "win"), 3: (600, "lose")})
+    (segment,) = bank.ledger.journal.segments()
+    with open(segment) as file:
+        lines = file.readlines()
+    assert "batch" in json.loads(lines[-1])
+    # The crash hit while the batch was being written: nobody is paid
+    with open(segment, "w") as file:
+        file.writelines(lines[:-1])
+        file.write(lines[-1][:len(lines[-1]) // 2])
+
+    bank, replayed, refunded = restart(tmp_path)
+    assert (replayed, refunded) == (3, 3)
+    assert [bank.ledger.get(user_id).balance for user_id in (1, 2, 3)] == [DEFAULT_BALANCE] * 3
+
+
+def test_place_bet_refuses_closed_unaffordable_and_repeat_bets(tmp_path):
+    bank = open_service(tmp_path)
+
+    async def run():
+        market = await bank.open_market(10, 20, "match", 2, 2)
+        other = await bank.open_market(10, 21, "elsewhere", 2, 2)
+        results = [
+            await bank.place_bet(10, 20, None, 1, DEFAULT_BALANCE + 1, "win"),
+            await bank.place_bet(10, 20, None, 1, 100, "win"),
+            await bank.place_bet(10, 20, None, 1, 100, "lose"),
+            # The same user can still bet on a market in another channel
+            await bank.place_bet(10, 21, None, 1, 100, "lose"),
+        ]
+        await bank.lock_market(10, 20, market["id"])
+        results.append(await bank.place_bet(10, 20, None, 2, 100, "win"))
+        return other, [error for _, error in results]
+
+    other, errors = asyncio.run(run())
+    assert errors == ["balance", None, "placed", None, "closed"]
+    assert bank.ledger.get(1).balance == DEFAULT_BALANCE - 200
+    assert bank.ledger.get(2).balance == DEFAULT_BALANCE
+    assert len(bank.ledger.open_rounds) == 2
+    assert bank.markets.get(other["id"]).pools == {"win": 0, "lose": 100}
@@ -0,0 +1,117 @@
+"""Reply coalescing in ``Outbox`` and edit debouncing in ``LiveMessages``."""
+import asyncio
+
+import pytest
+
+from outbox import LiveMessages, Outbox
+
+
+class Channel:
+    def __init__(self, channel_id, fail=()):
+        self.id = channel_id
+        self.sent = []
+        self.fail = set(fail)  # send numbers (from 0) that raise
+
+    async def send(self, text):
+        number = len(self.sent)
+        self.sent.append(text)
+        if number in self.fail:
+            raise RuntimeError("Missing Permissions")
+        return f"message {self.id}/{number}"
+
+
+class Message:
+    id = 1
+
+    def __init__(self, fail=False):
+        self.edits = []
+        self.fail = fail
+
+    async def edit(self, content):
+        self.edits.append(content)
+        if self.fail:
+            raise RuntimeError("Unknown Message")
+
+
+def test_a_burst_in_one_channel_becomes_one_message():
+    outbox = Outbox(window=0.01)
+    first, second = Channel(1), Channel(2)
+
+    async def run():
+        futures = [outbox.post(first, f"reply {i}") for i in range(3)]
+        futures.append(outbox.post(second, "elsewhere"))
+        return await asyncio.gather(*futures)
+
+    messages = asyncio.run(run())
+    assert first.sent == ["reply 0\nreply 1\nreply 2"]
+    assert second.sent == ["elsewhere"]
+    assert messages == ["message 1/0"] * 3 + ["message 2/0"]
+    assert outbox.sent == 2
+    assert outbox.depth() == 0
+
+
+def test_a_failed_send_only_fails_its_own_replies():
+    # A limit of 10 puts each reply in its own message; the second one fails
+    outbox = Outbox(window=0.01, limit=10)
+    channel = Channel(1, fail={1})
+
+    async def run():
+        futures = [outbox.post(channel, f"reply {i}") for i in range(3)]
+        return await asyncio.gather(*futures, return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert channel.sent == ["reply 0", "reply 1", "reply 2"]
+    assert results[0] == "message 1/0"
+    assert isinstance(results[1], RuntimeError)
+    assert results[2] == "message 1/2"
+    assert outbox.sent == 2
+
+
+def test_replies_after_a_failure_still_go_out():
+    outbox = Outbox(window=0.01)
+    channel = Channel(1, fail={0})
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await outbox.post(channel, "lost")
+        return await outbox.post(channel, "next")
+
+    assert asyncio.run(run()) == "message 1/1"
+
+
+def test_live_message_edits_once_per_interval_with_the_latest_text():
+    live = LiveMessages(interval=0.05)
+    message = Message()
+
+    async def run():
+        live.track("bet 1", message)
+        for odds in range(5):
+            live.update("bet 1", f"odds {odds}")
+        await asyncio.sleep(0.1)
+        live.update("bet 1", "odds 5")
+        await live.finish("bet 1", "resolved")
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    # The pending edit for "odds 5" was dropped in favour of the final text
+    assert message.edits == ["odds 4", "resolved"]
+    assert (live.updates, live.edits) == (6, 2)
+    assert len(live) == 0
+
+
+def test_a_failed_edit_doesnt_stop_the_others():
+    live = LiveMessages(interval=0.0)
+    broken, working = Message(fail=True), Message()
+
+    async def run():
+        live.track(1, broken)
+        live.track(2, working)
+        live.update(1, "odds")
+        live.update(2, "odds")
+        await asyncio.sleep(0.01)
+        await live.finish(1, "resolved")
+        await live.finish(2, "resolved")
+
+    asyncio.run(run())
+    assert broken.edits == ["odds", "resolved"]
+    assert working.edits == ["odds", "resolved"]
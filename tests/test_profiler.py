@@ -0,0 +1,43 @@
+"""``CommandProfiler`` turning cProfile on and off around commands."""
+import sys
+
+from profiler import CommandProfiler
+
+
+def test_stop_turns_profiling_off_on_the_calling_thread(tmp_path):
+    profiler = CommandProfiler(str(tmp_path))
+    profiler.start()
+    profiler.command_started("slots")
+    assert sys.getprofile() is not None
+    profile = profiler.stop()
+    assert sys.getprofile() is None
+    path, stats = profiler.save(profile)
+    assert path.startswith(str(tmp_path))
+    assert stats is not None
+
+
+def test_commands_from_before_the_start_dont_count(tmp_path):
+    profiler = CommandProfiler(str(tmp_path))
+    early = profiler.command_started("slots")
+    profiler.start(["slots"])
+    token = profiler.command_started("slots")
+    # Finishing the command that began before the profile leaves it on
+    profiler.command_finished(early)
+    assert sys.getprofile() is not None
+    profiler.command_finished(token)
+    assert sys.getprofile() is None
+    profiler.save(profiler.stop())
+
+
+def test_commands_from_an_earlier_profile_dont_count(tmp_path):
+    profiler = CommandProfiler(str(tmp_path))
+    profiler.start()
+    stale = profiler.command_started("slots")
+    profiler.save(profiler.stop())
+    profiler.start()
+    token = profiler.command_started("rps")
+    profiler.command_finished(stale)
+    assert sys.getprofile() is not None
+    profiler.command_finished(token)
+    assert sys.getprofile() is None
+    profiler.save(profiler.stop())
@@ -0,0 +1,58 @@
+"""Game rates for ``rtp.py`` from the transaction history."""
+import os
+
+import pytest
+
+from history import History
+from rtp import history_rates
+
+
+def write_history(directory, entries):
+    history = History(str(directory))
+    for seq, (when, user_id, reason, deltas) in enumerate(entries, 1):
+        # Queued as record() would, with a made-up time
+        history.pending.append((seq, when, str(user_id), reason, deltas, 1000))
+    history.close()
+
+
+def test_counts_rounds_per_hour_from_the_history(tmp_path):
+    write_history(tmp_path, [
+        (0, 1, "slots", {"b": -10}),
+        (600, 1, "slots", {"b": 20}),
+        (900, 2, "mines", {"b": -50}),  # the stake opens the round
+        (1000, 2, "mines", {"b": 120}),  # the cash-out is the same round
+        (1200, 2, "doors", {"b": -10}),
+        (1800, 3, "send", {"b": -5}),  # not a game
+        (3600, 3, "strip", {"b": 40}),
+    ])
+    rates, hours = history_rates(str(tmp_path))
+    assert hours == 1
+    assert rates["slots"] == 2
+    assert rates["mines"] == 1
+    assert rates["doors"] == 1
+    assert "send" not in rates
+    assert rates["strip"] == pytest.approx(701 / 700)
+
+
+def test_scales_rps_for_ties_that_leave_no_entry(tmp_path):
+    # Two decided games in an hour stand for three, one of them a tie
+    write_history(tmp_path, [(0, 1, "rps", {"b": 10}), (3600, 1, "rps", {"b": -10})])
+    rates, _ = history_rates(os.path.join(tmp_path, "history.log"))
+    assert rates["rps"] == pytest.approx(3)
+
+
+def test_only_counts_the_last_hours(tmp_path):
+    write_history(tmp_path, [
+        (0, 1, "slots", {"b": -10}),
+        (86400, 1, "slots", {"b": -10}),
+        (88200, 1, "slots", {"b": -10}),
+        (90000, 1, "slots", {"b": -10}),
+    ])
+    rates, hours = history_rates(str(tmp_path), hours=1)
+    assert hours == 1
+    assert rates["slots"] == 3
+
+
+def test_no_rate_without_a_time_span(tmp_path):
+    write_history(tmp_path, [(0, 1, "slots", {"b": -10})])
+    assert history_rates(str(tmp_path)) == ({}, 0.0)
@@ -0,0 +1,39 @@
+"""Session timeouts off the shared timer wheel."""
+import asyncio
+
+from sessions import SessionManager
+
+
+class Session:
+    idle_timeout = 0.01
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.timed_out = False
+
+    async def on_timeout(self):
+        await asyncio.sleep(0.2)
+        if self.fail:
+            raise RuntimeError("edit failed")
+        self.timed_out = True
+
+
+def test_close_waits_for_running_timeouts():
+    manager = SessionManager(tick=0.01)
+    sessions = [Session(), Session(fail=True), Session()]
+
+    async def run():
+        manager.start()
+        for message_id, session in enumerate(sessions):
+            manager.register(message_id, session)
+        # Long enough for the wheel to fire, not for the timeouts to finish
+        await asyncio.sleep(0.06)
+        running = len(manager._tasks)
+        await manager.close()
+        return running
+
+    assert asyncio.run(run()) == 3
+    # A failing timeout doesn't stop the others
+    assert [session.timed_out for session in sessions] == [True, False, True]
+    assert not manager._tasks
+    assert not len(manager)
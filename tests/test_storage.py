@@ -0,0 +1,106 @@
+"""Storage backends: upgrading old records and the snapshot log."""
+import json
+import os
+import sqlite3
+
+from account import SCHEMA_VERSION, Account
+from storage import JsonStorage, SnapshotStorage, SqliteStorage
+
+# One version 1 account: float coins and items under old or emoji names
+V1_ITEMS = [("rolex", 1), ("⌚", 2), ("Lambo", 1)]
+UPGRADED = Account(1500, 200, {"Rolex": 3, "Lambo": 1})
+
+
+def test_json_upgrades_version_1_records(tmp_path):
+    path = os.path.join(tmp_path, "user_data.json")
+    items = [name for name, count in V1_ITEMS for _ in range(count)]
+    with open(path, "w") as file:
+        json.dump({"42": {"balance": 1500.7, "loan": 200.0, "items": items}}, file)
+
+    storage = JsonStorage(path)
+    assert storage.fetch(42) == UPGRADED
+    storage.write({})
+    with open(path) as file:
+        assert json.load(file)["_schema"] == SCHEMA_VERSION
+
+
+def test_sqlite_upgrades_version_1_records(tmp_path):
+    path = os.path.join(tmp_path, "user_data.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(SqliteStorage.SCHEMA)
+    conn.execute("INSERT INTO users VALUES ('42', 1500.7)")
+    conn.execute("INSERT INTO loans VALUES ('42', 200.0)")
+    conn.executemany("INSERT INTO items VALUES ('42', ?, ?)", V1_ITEMS)
+    conn.commit()
+    conn.close()
+
+    storage = SqliteStorage(path)
+    account = storage.fetch(42)
+    assert account == UPGRADED
+    assert account.assets == UPGRADED.assets
+    assert storage.iter_items() == [("42", {"Lambo": 1, "Rolex": 3})]
+    assert storage.conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    storage.close()
+
+
+def test_snapshot_round_trips_through_the_log_and_the_snapshot(tmp_path):
+    path = os.path.join(tmp_path, "user_data.snap")
+    accounts = {
+        "1": Account(100, 0, {}),
+        "2": Account(250, 50, {"Rolex": 2}),
+        "3": Account(0, 0, {"Lambo": 1}),
+    }
+    storage = SnapshotStorage(path)
+    storage.write(accounts, {"day": 1})
+    # Reopening without close() replays the log
+    storage = SnapshotStorage(path)
+    for user_id, account in accounts.items():
+        assert storage.fetch(user_id) == account
+    assert storage.meta == {"day": 1}
+
+    # close() compacts into the snapshot and empties the log
+    storage.close()
+    assert os.path.getsize(path + ".log") == 0
+    storage = SnapshotStorage(path)
+    for user_id, account in accounts.items():
+        assert storage.fetch(user_id) == account
+    assert storage.fetch(4) is None
+    assert storage.meta == {"day": 1}
+    assert sorted(storage.iter_items()) == [("2", {"Rolex": 2}), ("3", {"Lambo": 1})]
+    storage.close()
+
+
+def test_snapshot_ignores_a_torn_log_line(tmp_path):
+    path = os.path.join(tmp_path, "user_data.snap")
+    storage = SnapshotStorage(path)
+    storage.write({"1": Account(100, 0, {})})
+    storage.close()
+    storage = SnapshotStorage(path)
+    storage.write({"1": Account(150, 0, {}), "2": Account(75, 0, {"Rolex": 1})}, {"day": 2})
+    storage._log.close()
+    # A crash halfway through the next write leaves half a line behind
+    with open(path + ".log", "a") as file:
+        file.write('{"g": %d, "a": {"1": {"bal' % storage.generation)
+
+    storage = SnapshotStorage(path)
+    assert storage.fetch(1) == Account(150, 0, {})
+    assert storage.fetch(2) == Account(75, 0, {"Rolex": 1})
+    assert storage.meta == {"day": 2}
+    storage.close()
+
+
+def test_snapshot_skips_log_lines_from_an_older_generation(tmp_path):
+    path = os.path.join(tmp_path, "user_data.snap")
+    storage = SnapshotStorage(path)
+    storage.write({"1": Account(100, 0, {})})
+    with open(path + ".log") as file:
+        stale = file.read()
+    assert '"b": 100' in stale
+    storage.close()
+    # A crash after the rename but before the log was emptied
+    with open(path + ".log", "w") as file:
+        file.write(stale.replace('"b": 100', '"b": 999'))
+
+    storage = SnapshotStorage(path)
+    assert storage.fetch(1) == Account(100, 0, {})
+    storage.close()
@@ -0,0 +1,143 @@
+"""Token buckets, driven by an explicit clock instead of time.monotonic."""
+import asyncio
+
+import pytest
+
+from throttle import Throttle, Throttled
+
+LIMITS = {"strip": {"user": (0.5, 2), "guild": (10, 3)}}
+
+
+def test_burst_then_refill():
+    throttle = Throttle(LIMITS)
+    throttle.check("strip", 1, now=0)
+    throttle.check("strip", 1, now=0)
+    with pytest.raises(Throttled) as rejected:
+        throttle.check("strip", 1, now=0.5)
+    assert rejected.value.scope == "user"
+    # A quarter of a token has come back; the rest takes 1.5s at 0.5/s
+    assert rejected.value.retry_after == pytest.approx(1.5)
+    throttle.check("strip", 1, now=2.0)
+    # Refills stop at the burst size
+    throttle = Throttle(LIMITS)
+    throttle.check("strip", 1, now=0)
+    throttle.check("strip", 1, now=100)
+    throttle.check("strip", 1, now=100)
+    with pytest.raises(Throttled):
+        throttle.check("strip", 1, now=100)
+
+
+def test_only_the_first_rejection_of_a_burst_notifies():
+    throttle = Throttle(LIMITS)
+    for _ in range(2):
+        throttle.check("strip", 1, now=0)
+    notified = []
+    for now in (0, 0.1, 0.2):
+        with pytest.raises(Throttled) as rejected:
+            throttle.check("strip", 1, now=now)
+        notified.append(rejected.value.notify)
+    assert notified == [True, False, False]
+    assert throttle.hits["strip", "user"] == 3
+    # Once a command gets through, the next burst is told again
+    throttle.check("strip", 1, now=2.2)
+    with pytest.raises(Throttled) as rejected:
+        throttle.check("strip", 1, now=2.2)
+    assert rejected.value.notify
+
+
+def test_guild_limit_takes_nothing_from_the_user():
+    throttle = Throttle(LIMITS)
+    for user_id in (1, 2, 3):
+        throttle.check("strip", user_id, guild_id=9, now=0)
+    with pytest.raises(Throttled) as rejected:
+        throttle.check("strip", 4, guild_id=9, now=0)
+    assert rejected.value.scope == "guild"
+    # User 4's own bucket still holds its whole burst
+    throttle.check("strip", 4, guild_id=None, now=0)
+    throttle.check("strip", 4, guild_id=None, now=0)
+
+
+def test_default_and_unlimited_commands():
+    throttle = Throttle(LIMITS, default={"user": (1, 1)})
+    throttle.check("slots", 1, now=0)
+    with pytest.raises(Throttled):
+        throttle.check("slots", 1, now=0)
+    unlimited = Throttle(LIMITS)
+    for _ in range(100):
+        unlimited.check("slots", 1, now=0)
+    assert len(unlimited) == 0
+
+
+def test_evicts_the_least_recently_used_bucket():
+    throttle = Throttle(LIMITS, capacity=2)
+    throttle.check("strip", 1, now=0)
+    throttle.check("strip", 2, now=0)
+    throttle.check("strip", 1, now=0)  # user 1 is now the most recently used
+    throttle.check("strip", 3, now=0)
+    assert throttle.evictions == 1
+    assert len(throttle) == 2
+    assert [key[2] for key in throttle.buckets] == [1, 3]
+    # User 1 kept their bucket, which is empty
+    with pytest.raises(Throttled):
+        throttle.check("strip", 1, now=0)
+
+
+class Response:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, content, ephemeral=False):
+        self.sent.append((content, ephemeral))
+
+
+class Interaction:
+    def __init__(self):
+        self.response = Response()
+
+
+class Context:
+    def __init__(self, interaction=None):
+        self.interaction = interaction
+        self.author = type("Author", (), {"mention": "<@1>"})()
+
+
+@pytest.fixture
+def bot_module(tmp_path, monkeypatch):
+    # main.py opens its data files in the working directory on import
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("BOT_METRICS_PORT", "0")
+    import main
+    return main
+
+
+def test_every_throttled_slash_command_is_answered(bot_module, monkeypatch):
+    replies = []
+
+    async def reply(ctx, content):
+        replies.append(content)
+
+    monkeypatch.setattr(bot_module, "reply", reply)
+    throttle = Throttle(LIMITS)
+    for _ in range(2):
+        throttle.check("strip", 1, now=0)
+    errors = []
+    for _ in range(3):
+        try:
+            throttle.check("strip", 1, now=0)
+        except Throttled as error:
+            errors.append(error)
+
+    async def run():
+        interactions = []
+        for error in errors:
+            interaction = Interaction()
+            await bot_module.on_command_error(Context(interaction), error)
+            interactions.append(interaction)
+            await bot_module.on_command_error(Context(), error)
+        return interactions
+
+    interactions = asyncio.run(run())
+    # Interactions always get an ephemeral answer; channels only the first
+    assert [len(interaction.response.sent) for interaction in interactions] == [1, 1, 1]
+    assert all(ephemeral for interaction in interactions for _, ephemeral in interaction.response.sent)
+    assert len(replies) == 1
@@ -0,0 +1,86 @@
+"""Per-user and per-guild token buckets in front of the commands.
+
+Each command can have a user limit and a guild limit. Both are token buckets
+given as ``(rate, burst)``: ``burst`` invocations straight away, then one more
+every ``1 / rate`` seconds. A command runs only if every bucket it uses has a
+token. Otherwise it is rejected by a global check, before its arguments are
+converted and before it reaches the ledger. The caller is told how long to
+wait once per burst, not on every attempt, so spam doesn't turn into a reply
+for each message either.
+
+Buckets live in one ``OrderedDict`` used as an LRU. Every lookup moves its
+bucket to the end, and once there are ``capacity`` buckets the least recently
+used is dropped. A bucket idle for that long has almost always refilled, so
+dropping it changes nothing. Every check is O(1) and memory stays bounded
+however many users there are.
+"""
+import time
+from collections import OrderedDict
+
+from discord.ext import commands
+
+
+class Throttled(commands.CheckFailure):
+    """Raised by the check when a bucket is empty."""
+
+    def __init__(self, command, scope, retry_after, notify):
+        self.command = command
+        self.scope = scope
+        self.retry_after = retry_after
+        # Only the first rejection of a burst gets a reply
+        self.notify = notify
+        who = "You're" if scope == "user" else "This server is"
+        super().__init__(f"{who} using !{command} too fast. Try again in {retry_after:.1f}s.")
+
+
+class Throttle:
+    def __init__(self, limits, default=None, capacity=100000):
+        # limits: {command: {"user": (rate, burst), "guild": (rate, burst)}};
+        # commands without an entry use ``default``, and None means no limit
+        self.limits = limits
+        self.default = default or {}
+        self.capacity = capacity
+        # (scope, command, id) -> [tokens, last refill, rejected since last token]
+        self.buckets = OrderedDict()
+        self.hits = {}  # (command, scope) -> rejections
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def _bucket(self, key, burst, now):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [burst, now, False]
+            if len(self.buckets) > self.capacity:
+                self.buckets.popitem(last=False)
+                self.evictions += 1
+        else:
+            self.buckets.move_to_end(key)
+        return bucket
+
+    def check(self, command, user_id, guild_id=None, now=None):
+        """Take a token for ``command`` or raise ``Throttled``."""
+        limits = self.limits.get(command, self.default)
+        if not limits:
+            return
+        now = time.monotonic() if now is None else now
+        taken = []
+        for scope, owner in (("user", user_id), ("guild", guild_id)):
+            limit = limits.get(scope)
+            if limit is None or owner is None:
+                continue
+            rate, burst = limit
+            bucket = self._bucket((scope, command, owner), burst, now)
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                # Nothing is taken from any bucket unless every one has a token
+                self.hits[command, scope] = self.hits.get((command, scope), 0) + 1
+                notify = not bucket[2]
+                bucket[2] = True
+                raise Throttled(command, scope, (1 - bucket[0]) / rate, notify)
+            taken.append(bucket)
+        for bucket in taken:
+            bucket[0] -= 1
+            bucket[2] = False